@@ -7,5 +7,17 @@ def main(global_config, **settings):
     config = Configurator(settings=settings)
     config.include('.models')
     config.include('.routes')
-    config.scan()
+    config.include('.timing')
+    config.include('.metrics')
+    config.include('.profiling')
+    config.include('.ratelimit')
+    config.include('.retry')
+    config.include('.idempotency')
+    config.include('.deadline')
+    config.include('.admission')
+    config.include('.events')
+    config.include('.singleflight')
+    config.include('.compression')
+    config.include('.renderers')
+    config.scan('.views')
     return config.make_wsgi_app()
@@ -0,0 +1,198 @@
+"""Admission control, shedding requests early when the server is overloaded.
+
+When more requests arrive than the server threads can handle, they queue
+up, and past a point every one of them waits so long that it times out. With
+``book_api.admission`` enabled, requests beyond a limit on the requests in
+flight are answered at once with a 503 and ``Retry-After``, which keeps the
+latency of the admitted requests bounded.
+
+Only requests holding a server thread are seen here, so the limit defaults
+to three quarters of ``book_api.threads``, the number of server threads;
+the remaining threads answer the excess requests quickly. Open event
+streams hold a thread after their view has returned, so they are counted
+against the limit too.
+
+Requests are admitted by class, from what they cost. Cheap requests, which
+never check a password, such as ``/metrics`` or requests missing their
+credentials, may use every slot. Reads verifying a password may only use a
+share of them, and writes, which verify or hash a password and write to the
+database, a smaller share still, so they are shed first and leave room for
+the cheaper requests.
+
+Behind a proxy setting ``X-Request-Start``, the time a request waited before
+reaching the app is recorded too, and requests that waited longer than
+``book_api.admission.max_queue_wait_ms`` are shed, as their clients have
+most likely given up on them.
+"""
+
+import threading
+import time
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+
+from book_api.metrics import IN_FLIGHT, QUEUE_WAIT, SHED
+
+QUEUE_START_HEADER = 'X-Request-Start'
+
+SHED_MESSAGE = 'The server is too busy, try again later.'
+
+CHEAP = 'cheap'
+AUTH = 'auth'
+WRITE = 'write'
+
+READ_METHODS = frozenset(['GET', 'HEAD'])
+
+# routes checking the password of the request
+PASSWORD_ROUTES = frozenset([
+    'book-list', 'book-batch', 'book-changes', 'book-events', 'book-id',
+    'book-restore', 'signup',
+])
+
+# routes that only read, whatever their method
+READ_ROUTES = frozenset(['book-batch'])
+
+
+def classify(request):
+    """Get the admission class of a request: cheap, auth or write.
+
+    Requests that check no password are cheap, including those to a route
+    checking one that lack the email or password, as they are refused first.
+    Signups hash a password and are writes.
+    """
+    mapper = request.registry.queryUtility(IRoutesMapper)
+    route = mapper(request)['route'] if mapper is not None else None
+    if route is None or route.name not in PASSWORD_ROUTES:
+        return CHEAP
+    data = request.GET if request.method == 'GET' else request.POST
+    if 'email' not in data or 'password' not in data:
+        return CHEAP
+    if route.name != 'signup' and (
+            request.method in READ_METHODS or route.name in READ_ROUTES):
+        return AUTH
+    return WRITE
+
+
+def queue_wait(request, now=None):
+    """Get the seconds since the proxy saw the request, or None if unknown.
+
+    The ``X-Request-Start`` header may hold seconds, milliseconds or
+    microseconds since the epoch, optionally after ``t=``.
+    """
+    value = request.headers.get(QUEUE_START_HEADER, '').strip()
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        start = float(value)
+    except ValueError:
+        return None
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    now = time.time() if now is None else now
+    return max(now - start, 0.0)
+
+
+class AdmissionController(object):
+    """Count the requests in flight and decide which to admit."""
+
+    def __init__(self, max_in_flight=12, auth_share=0.8, write_share=0.5,
+                 max_queue_wait=None):
+        """Admit up to ``max_in_flight`` requests at once.
+
+        Reads verifying a password may take ``auth_share`` of the slots and
+        writes ``write_share`` of them. Requests that waited longer than
+        ``max_queue_wait`` seconds to reach the app are not admitted.
+        """
+        self.max_queue_wait = max_queue_wait
+        self.limits = {
+            CHEAP: max_in_flight,
+            AUTH: max(1, int(max_in_flight * auth_share)),
+            WRITE: max(1, int(max_in_flight * write_share)),
+        }
+        self.in_flight = 0
+        # the event bus, whose open streams also hold server threads
+        self.streams = None
+        self._lock = threading.Lock()
+
+    def try_acquire(self, kind):
+        """Take a slot for a request of the class, or return False if full."""
+        streams = self.streams.subscribers if self.streams is not None else 0
+        with self._lock:
+            if self.in_flight + streams >= self.limits[kind]:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        """Give back the slot of a finished request."""
+        with self._lock:
+            self.in_flight -= 1
+
+
+def _in_flight(controller):
+    """Get the requests the controller has admitted and not yet finished."""
+    return {(): controller.in_flight}
+
+
+def _shed(retry_after):
+    """Build the JSON 503 response for a shed request."""
+    response = Response(json={'message': SHED_MESSAGE, 'status': 503}, status=503)
+    response.headers['Retry-After'] = retry_after
+    return response
+
+
+def admission_tween_factory(handler, registry):
+    """Create a tween shedding the requests the server has no room for."""
+    controller = registry['admission_controller']
+    controller.streams = registry.get('event_bus')
+    retry_after = registry.settings.get('book_api.admission.retry_after', '1')
+
+    def admission_tween(request):
+        kind = classify(request)
+        wait = queue_wait(request)
+        if wait is not None:
+            QUEUE_WAIT.observe(wait)
+            if controller.max_queue_wait is not None and wait > controller.max_queue_wait:
+                SHED.inc((kind, 'queue_wait'))
+                return _shed(retry_after)
+
+        if not controller.try_acquire(kind):
+            SHED.inc((kind, 'in_flight'))
+            return _shed(retry_after)
+        try:
+            return handler(request)
+        finally:
+            controller.release()
+
+    return admission_tween
+
+
+def includeme(config):
+    """
+    Shed load early when ``book_api.admission`` is enabled.
+
+    The controller is stored as ``registry['admission_controller']``. Its
+    tween sits under INGRESS, so requests are shed before any other tween
+    but compression does its work.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.admission', False)):
+        return
+
+    threads = int(settings.get('book_api.threads', 4))
+    max_queue_wait = settings.get('book_api.admission.max_queue_wait_ms')
+    controller = AdmissionController(
+        max_in_flight=int(settings.get(
+            'book_api.admission.max_in_flight', max(1, threads * 3 // 4))),
+        auth_share=float(settings.get('book_api.admission.auth_share', 0.8)),
+        write_share=float(settings.get('book_api.admission.write_share', 0.5)),
+        max_queue_wait=float(max_queue_wait) / 1000 if max_queue_wait else None,
+    )
+    config.registry['admission_controller'] = controller
+    IN_FLIGHT.add_source(_in_flight, owner=controller)
+    config.add_tween('book_api.admission.admission_tween_factory', under=INGRESS)
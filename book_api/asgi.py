@@ -0,0 +1,183 @@
+"""ASGI entry point serving the same application as ``book_api:main``.
+
+The connection handling runs on the event loop: request bodies are read and
+responses are written asynchronously, so slow clients and idle keep-alive
+connections do not hold a thread. Only the application itself, including its
+database access and password hashing, runs on a bounded pool of threads.
+
+Run it with any ASGI server, for example::
+
+    BOOK_API_INI=production.ini uvicorn --factory book_api.asgi:from_env
+
+"""
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from pyramid.paster import get_appsettings, setup_logging
+
+from book_api import main
+
+
+class WSGIBridge(object):
+    """Serve a WSGI application to an ASGI server from a thread pool."""
+
+    def __init__(self, wsgi_app, threads=16, max_body_size=1024 * 1024):
+        """Wrap the WSGI app, running it on at most ``threads`` threads."""
+        self.wsgi_app = wsgi_app
+        self.max_body_size = max_body_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='book_api')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type: {}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        """Acknowledge startup and shut the thread pool down on shutdown."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        """Read the whole request body, or None if it is too large."""
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body_size:
+                return None
+            chunks.append(chunk)
+            more_body = message.get('more_body', False)
+        return b''.join(chunks)
+
+    async def http(self, scope, receive, send):
+        """Handle a single HTTP request."""
+        body = await self.read_body(receive)
+        if body is None:
+            await send({
+                'type': 'http.response.start',
+                'status': 413,
+                'headers': [(b'content-length', b'0')],
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        loop = asyncio.get_running_loop()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and 'status' in response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        environ = build_environ(scope, body)
+        app_iter = await loop.run_in_executor(
+            self.executor, self.wsgi_app, environ, start_response)
+        chunks = iter(app_iter)
+        try:
+            started = False
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if not started:
+                    await send({
+                        'type': 'http.response.start',
+                        'status': response['status'],
+                        'headers': response['headers'],
+                    })
+                    started = True
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+
+def build_environ(scope, body):
+    """Build a WSGI environ for the ASGI HTTP scope and request body."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            # the body has already been read, so its real length is used
+            continue
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def make_asgi_app(global_config, **settings):
+    """Get the book_api application as an ASGI application.
+
+    ``book_api.asgi.threads``, or else ``book_api.threads``, sets how many
+    requests run at once and ``book_api.asgi.max_body_size`` the largest
+    request body accepted.
+    """
+    return WSGIBridge(
+        main(global_config, **settings),
+        threads=int(settings.get(
+            'book_api.asgi.threads', settings.get('book_api.threads', 16))),
+        max_body_size=int(settings.get('book_api.asgi.max_body_size', 1024 * 1024)),
+    )
+
+
+def from_env():
+    """Get the ASGI application for the ini file named by ``BOOK_API_INI``."""
+    config_uri = os.environ.get('BOOK_API_INI', 'production.ini')
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    return make_asgi_app({'__file__': config_uri}, **settings)
@@ -0,0 +1,190 @@
+"""Compression of JSON and event stream responses.
+
+The encoding is negotiated from the ``Accept-Encoding`` header, preferring
+brotli when the ``brotli`` package is installed, then gzip, then deflate.
+Bodies smaller than ``book_api.compression.min_size`` are sent as they are.
+
+Complete bodies are compressed in one go, and the compressed form is kept in
+a small cache keyed by the encoding and a digest of the body, so a book list
+that is polled without changing is only compressed once. Streamed responses,
+such as the event stream, are compressed chunk by chunk and flushed after
+each chunk so nothing is held back from the client.
+"""
+
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from pyramid.settings import asbool
+
+from book_api.metrics import record_cache_lookup
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/event-stream', 'text/plain')
+
+ZLIB_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def available_encodings():
+    """Get the supported encodings, in order of preference."""
+    encodings = ['gzip', 'deflate']
+    if brotli is not None:
+        encodings.insert(0, 'br')
+    return encodings
+
+
+class Compressor(object):
+    """Incrementally compress data with one of the supported encodings."""
+
+    def __init__(self, encoding, level=6, brotli_quality=5):
+        """Start compressing with the given encoding."""
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, ZLIB_WBITS[encoding])
+
+    def compress(self, data):
+        """Compress a chunk, returning all of its output so far."""
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """End the compressed stream."""
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def compress(body, encoding, level=6, brotli_quality=5):
+    """Compress a complete body with the given encoding."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ZLIB_WBITS[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+class CompressedCache(object):
+    """A least recently used cache of compressed bodies, bounded in bytes."""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        """Create an empty cache holding up to ``max_bytes`` of data."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get the compressed body for the key, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store a compressed body, evicting the oldest ones to make room."""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def choose_encoding(request, encodings):
+    """Get the best encoding the client accepts, or None."""
+    if 'Accept-Encoding' not in request.headers:
+        return None
+    offers = request.accept_encoding.acceptable_offers(encodings)
+    return offers[0][0] if offers else None
+
+
+def _compress_stream(app_iter, compressor):
+    """Compress the chunks of a streamed response as they are produced."""
+    try:
+        for chunk in app_iter:
+            if chunk:
+                yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if close is not None:
+            close()
+
+
+def compression_tween_factory(handler, registry):
+    """Create a tween compressing responses for clients that accept it."""
+    settings = registry.settings
+    min_size = int(settings.get('book_api.compression.min_size', 1024))
+    level = int(settings.get('book_api.compression.level', 6))
+    brotli_quality = int(settings.get('book_api.compression.brotli_quality', 5))
+    cache = CompressedCache(int(settings.get(
+        'book_api.compression.cache_bytes', 8 * 1024 * 1024)))
+    encodings = available_encodings()
+
+    def compression_tween(request):
+        response = handler(request)
+
+        if (response.content_type not in COMPRESSIBLE_TYPES
+                or 'Content-Encoding' in response.headers
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+        if 'Accept-Encoding' not in (response.vary or ()):
+            response.vary = tuple(response.vary or ()) + ('Accept-Encoding',)
+
+        encoding = choose_encoding(request, encodings)
+        if encoding is None or request.method == 'HEAD':
+            return response
+
+        if response.content_length is None:
+            response.app_iter = _compress_stream(
+                response.app_iter, Compressor(encoding, level, brotli_quality))
+            response.content_encoding = encoding
+            return response
+
+        if response.content_length < min_size:
+            return response
+
+        body = response.body
+        key = (encoding, hashlib.sha1(body).digest())
+        compressed = cache.get(key)
+        record_cache_lookup('compression', compressed is not None)
+        if compressed is None:
+            compressed = compress(body, encoding, level, brotli_quality)
+            cache.set(key, compressed)
+
+        response.body = compressed
+        response.content_encoding = encoding
+        return response
+
+    return compression_tween
+
+
+def includeme(config):
+    """
+    Compress responses when ``book_api.compression`` is enabled.
+
+    Behind a proxy that already compresses responses, leave it disabled.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.compression', False)):
+        return
+
+    config.add_tween('book_api.compression.compression_tween_factory')
@@ -0,0 +1,140 @@
+"""Time budgets for requests, enforced on their database statements.
+
+A slow query otherwise holds a server thread for as long as it runs. With
+``book_api.deadline`` enabled, every request gets a deadline from the timeout
+of its route. The statements of the request are stopped once it passes, with
+a progress handler on SQLite connections and ``statement_timeout`` on
+PostgreSQL, and the views check it before expensive steps such as verifying
+a password. A request out of time gets a 503 response.
+"""
+
+import time
+
+from pyramid.httpexceptions import HTTPServiceUnavailable
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_request
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+START_KEY = 'book_api.deadline.start'
+
+# SQLite virtual machine instructions between checks of the deadline
+SQLITE_PROGRESS_STEPS = 1000
+
+TIMEOUT_MESSAGE = 'The request ran out of time.'
+
+
+class Deadline(object):
+    """A point in time by which a request should be done."""
+
+    def __init__(self, timeout, start=None):
+        """Expire ``timeout`` seconds after ``start``, a time.monotonic value."""
+        self.expires_at = (time.monotonic() if start is None else start) + timeout
+
+    def remaining(self):
+        """Get the seconds left, which are negative once expired."""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self):
+        """Tell whether the deadline has passed."""
+        return self.remaining() <= 0
+
+    def check(self):
+        """Raise HTTPServiceUnavailable if the deadline has passed."""
+        if self.expired:
+            raise HTTPServiceUnavailable(TIMEOUT_MESSAGE, headers={'Retry-After': '1'})
+
+
+def check_deadline(request):
+    """Raise HTTPServiceUnavailable if the request is out of time.
+
+    Does nothing for requests without a deadline.
+    """
+    deadline = getattr(request, 'deadline', None)
+    if deadline is not None:
+        deadline.check()
+
+
+def _request_deadline(request):
+    """Get the deadline of the request from the timeout of its route.
+
+    Retries of a request share the deadline of its first attempt.
+    """
+    settings = request.registry.settings
+    route = getattr(request, 'matched_route', None)
+    timeout_ms = settings.get('book_api.deadline.timeout_ms', 10000)
+    if route is not None:
+        timeout_ms = settings.get(
+            'book_api.deadline.timeout_ms.' + route.name, timeout_ms)
+    start = request.environ.setdefault(START_KEY, time.monotonic())
+    return Deadline(float(timeout_ms) / 1000, start)
+
+
+def _limit_statements(session, transaction, connection):
+    """Stop the statements of the current request once it is out of time.
+
+    Sessions begun before the request is routed, such as those of the tweens,
+    are left alone, as the deadline depends on the route.
+    """
+    request = get_current_request()
+    if getattr(request, 'matched_route', None) is None:
+        return
+    deadline = getattr(request, 'deadline', None)
+    if deadline is None:
+        return
+
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        connection.connection.set_progress_handler(
+            lambda: deadline.expired, SQLITE_PROGRESS_STEPS)
+    elif dialect == 'postgresql':
+        connection.execute('SET LOCAL statement_timeout = %d' % max(
+            1, int(deadline.remaining() * 1000)))
+
+
+def _clear_progress_handler(dbapi_connection, connection_record):
+    """Remove the progress handler of a SQLite connection back in the pool."""
+    if hasattr(dbapi_connection, 'set_progress_handler'):
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def deadline_tween_factory(handler, registry):
+    """Create a tween answering 503 for requests stopped by their deadline.
+
+    It sits over pyramid_tm so that statements stopped at commit are seen.
+    """
+    def deadline_tween(request):
+        request.environ.setdefault(START_KEY, time.monotonic())
+        try:
+            return handler(request)
+        except DBAPIError:
+            if not request.deadline.expired:
+                raise
+            response = Response(
+                json={'message': TIMEOUT_MESSAGE, 'status': 503}, status=503)
+            response.headers['Retry-After'] = '1'
+            return response
+
+    return deadline_tween
+
+
+def includeme(config):
+    """
+    Give requests deadlines when ``book_api.deadline`` is enabled.
+
+    Every request gets ``request.deadline``, expiring after the
+    ``book_api.deadline.timeout_ms`` setting, or after
+    ``book_api.deadline.timeout_ms.<route name>`` for that route.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.deadline', False)):
+        return
+
+    config.add_request_method(_request_deadline, 'deadline', reify=True)
+    event.listen(config.registry['dbsession_factory'], 'after_begin', _limit_statements)
+    event.listen(config.registry['db_engine'], 'checkin', _clear_progress_handler)
+    config.add_tween(
+        'book_api.deadline.deadline_tween_factory', over='pyramid_tm.tm_tween_factory')
@@ -0,0 +1,180 @@
+"""In-process publishing of book changes to Server-Sent Events streams.
+
+The book views publish each change once its transaction has committed. Each
+stream has a bounded queue; a client that reads too slowly to keep up has
+its pending events dropped and is sent a ``resync`` event instead, telling it
+to catch up through ``GET /books/changes``.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+from pyramid.settings import asbool
+
+
+class Subscription(object):
+    """A bounded queue of events for a single stream."""
+
+    def __init__(self, user_id, max_size=100):
+        """Create an empty queue for the user's events."""
+        self.user_id = user_id
+        self.max_size = max_size
+        self.events = deque()
+        self.overflowed = False
+        self._ready = threading.Condition()
+
+    def put(self, event):
+        """Queue an event, dropping the queue if it is full."""
+        with self._ready:
+            if len(self.events) >= self.max_size:
+                self.events.clear()
+                self.overflowed = True
+            elif not self.overflowed:
+                self.events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Wait for the next event, returning None if none came in time.
+
+        Returns the string 'resync' once after events have been dropped.
+        """
+        with self._ready:
+            if not self.events and not self.overflowed:
+                self._ready.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                return 'resync'
+            if self.events:
+                return self.events.popleft()
+            return None
+
+
+class EventBus(object):
+    """Deliver published events to the subscriptions of each user."""
+
+    def __init__(self, queue_size=100, max_subscribers=1000):
+        """Create a bus with no subscribers."""
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscriptions = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """Get a new subscription, or None if there are too many already."""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = Subscription(user_id, self.queue_size)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    @property
+    def subscribers(self):
+        """Get the number of open subscriptions."""
+        return self._count
+
+    @property
+    def full(self):
+        """Tell whether there are as many subscriptions as allowed."""
+        with self._lock:
+            return self._count >= self.max_subscribers
+
+    def unsubscribe(self, subscription):
+        """Stop delivering events to the subscription."""
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            if subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self._count -= 1
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id, event):
+        """Deliver an event to every subscription of the user."""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+def publish_after_commit(request, user_id, event):
+    """Publish an event once the request's transaction has committed.
+
+    Does nothing when events are not enabled.
+    """
+    bus = request.registry.get('event_bus')
+    if bus is None:
+        return
+
+    def publish(success):
+        if success:
+            bus.publish(user_id, event)
+
+    request.tm.get().addAfterCommitHook(publish)
+
+
+def format_event(event, name='book'):
+    """Format an event for an event stream."""
+    lines = []
+    if isinstance(event, dict) and 'token' in event:
+        lines.append('id: {}'.format(event['token']))
+    lines.append('event: {}'.format(name))
+    lines.append('data: {}'.format(json.dumps(event)))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def stream_events(bus, user_id, heartbeat=15, max_duration=300):
+    """Yield the events for the user as an event stream.
+
+    The subscription is only made once the stream is iterated, so a stream
+    the server never starts cannot leave it behind. If the bus filled up in
+    the meantime, the stream ends at once and the client reconnects.
+
+    A comment is sent when there have been no events for ``heartbeat``
+    seconds, so closed connections are noticed. The stream ends after
+    ``max_duration`` seconds, and the client's EventSource reconnects.
+    """
+    yield b'retry: 1000\n\n'
+    subscription = bus.subscribe(user_id)
+    if subscription is None:
+        return
+
+    deadline = time.monotonic() + max_duration
+    try:
+        while time.monotonic() < deadline:
+            event = subscription.get(timeout=min(heartbeat, deadline - time.monotonic()))
+            if event is None:
+                yield b': keepalive\n\n'
+            elif event == 'resync':
+                yield format_event({}, name='resync')
+            else:
+                yield format_event(event)
+    finally:
+        bus.unsubscribe(subscription)
+
+
+def includeme(config):
+    """
+    Publish book changes to event streams when ``book_api.events`` is enabled.
+
+    The bus is stored as ``registry['event_bus']`` and streamed by the
+    ``book-events`` view. ``book_api.threads`` should be the number of
+    threads of the server, which bounds the default number of streams.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.events', False)):
+        return
+
+    # each stream holds a server thread, so by default streams may only
+    # take half of them
+    threads = int(settings.get('book_api.threads', 4))
+    config.registry['event_bus'] = EventBus(
+        queue_size=int(settings.get('book_api.events.queue_size', 100)),
+        max_subscribers=int(settings.get(
+            'book_api.events.max_subscribers', max(1, threads // 2))),
+    )
@@ -0,0 +1,188 @@
+"""Replaying the response to a repeated POST with the same Idempotency-Key.
+
+Clients that time out on ``POST /books`` or ``POST /signup`` send the request
+again, which creates a duplicate book or pays for another password hash only
+to fail on the unique email. With ``book_api.idempotency`` enabled, a client
+can send an ``Idempotency-Key`` header; the first successful response for it
+is stored, and a repeat of the same request within the TTL gets that response
+back without running the view, so nothing is validated, hashed or inserted
+again.
+
+Keys are scoped to the path, email and Accept header, and a repeat must have
+exactly the same body, password included, or it is rejected with a 422.
+"""
+
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pyramid.response import Response
+from pyramid.settings import asbool
+from sqlalchemy.exc import DBAPIError
+
+from book_api.metrics import record_cache_lookup
+from book_api.models.idempotency_key import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+IDEMPOTENT_PATHS = frozenset(['/books', '/signup'])
+
+
+def _sha256(*parts):
+    """Get the hex SHA-256 of the parts joined by newlines."""
+    return hashlib.sha256(b'\n'.join(parts)).hexdigest()
+
+
+def _json_error(status, message, **headers):
+    """Build a JSON error response like the exception views give."""
+    response = Response(json={'message': message, 'status': status}, status=status)
+    response.headers.update(headers)
+    return response
+
+
+class IdempotencyStore(object):
+    """Responses stored by scope in the idempotency_keys table."""
+
+    def __init__(self, session_factory, ttl=86400, purge_interval=300):
+        """Keep responses for ``ttl`` seconds, purging every ``purge_interval``."""
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.last_purge = time.monotonic()
+        self._in_progress = set()
+        self._lock = threading.Lock()
+
+    def get(self, scope):
+        """Get the unexpired IdempotencyKey for the scope, or None."""
+        dbsession = self.session_factory()
+        try:
+            return dbsession.query(IdempotencyKey).filter(
+                IdempotencyKey.scope == scope,
+                IdempotencyKey.created_at > datetime.utcnow() - timedelta(seconds=self.ttl),
+            ).first()
+        finally:
+            dbsession.close()
+
+    def save(self, scope, fingerprint, response):
+        """Store a response for the scope, keeping the first one stored."""
+        dbsession = self.session_factory()
+        try:
+            dbsession.query(IdempotencyKey).filter(
+                IdempotencyKey.scope == scope,
+                IdempotencyKey.created_at <= datetime.utcnow() - timedelta(seconds=self.ttl),
+            ).delete(synchronize_session=False)
+            dbsession.add(IdempotencyKey(
+                scope=scope,
+                fingerprint=fingerprint,
+                status=response.status_code,
+                content_type=response.headers['Content-Type'],
+                body=response.body,
+                created_at=datetime.utcnow(),
+            ))
+            dbsession.commit()
+        except DBAPIError:
+            # another process stored a response for the scope first
+            dbsession.rollback()
+        finally:
+            dbsession.close()
+        self.maybe_purge()
+
+    def maybe_purge(self):
+        """Delete the expired responses if the purge interval has passed."""
+        now = time.monotonic()
+        if now - self.last_purge < self.purge_interval:
+            return
+        self.last_purge = now
+        dbsession = self.session_factory()
+        try:
+            dbsession.query(IdempotencyKey).filter(
+                IdempotencyKey.created_at <= datetime.utcnow() - timedelta(seconds=self.ttl)
+            ).delete(synchronize_session=False)
+            dbsession.commit()
+        finally:
+            dbsession.close()
+
+    def begin(self, scope):
+        """Claim the scope for a request, or return False if it is taken."""
+        with self._lock:
+            if scope in self._in_progress:
+                return False
+            self._in_progress.add(scope)
+            return True
+
+    def end(self, scope):
+        """Release the scope claimed by a request."""
+        with self._lock:
+            self._in_progress.discard(scope)
+
+
+def idempotency_tween_factory(handler, registry):
+    """Create a tween replaying stored responses for repeated requests.
+
+    It sits over pyramid_tm, so a response is only stored once the request
+    that produced it has committed.
+    """
+    store = registry['idempotency_store']
+
+    def idempotency_tween(request):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if (not key or request.method != 'POST'
+                or request.path_info not in IDEMPOTENT_PATHS):
+            return handler(request)
+
+        scope = _sha256(
+            key.encode('utf-8'),
+            request.path_info.encode('utf-8'),
+            request.POST.get('email', '').lower().encode('utf-8'),
+            str(request.accept).encode('utf-8'),
+        )
+        fingerprint = _sha256(request.body)
+
+        stored = store.get(scope)
+        record_cache_lookup('idempotency', stored is not None)
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                return _json_error(
+                    422, 'The Idempotency-Key was used for a different request.')
+            response = Response(body=stored.body, status=stored.status)
+            response.headers['Content-Type'] = stored.content_type
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response
+
+        if not store.begin(scope):
+            return _json_error(
+                409, 'A request with this Idempotency-Key is in progress.',
+                **{'Retry-After': '1'})
+        try:
+            response = handler(request)
+            if 200 <= response.status_code < 300:
+                store.save(scope, fingerprint, response)
+            return response
+        finally:
+            store.end(scope)
+
+    return idempotency_tween
+
+
+def includeme(config):
+    """
+    Replay responses for repeated requests when ``book_api.idempotency`` is enabled.
+
+    The store is kept as ``registry['idempotency_store']``.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.idempotency', False)):
+        return
+
+    config.registry['idempotency_store'] = IdempotencyStore(
+        config.registry['dbsession_factory'],
+        ttl=float(settings.get('book_api.idempotency.ttl', 86400)),
+        purge_interval=float(settings.get('book_api.idempotency.purge_interval', 300)),
+    )
+    config.add_tween(
+        'book_api.idempotency.idempotency_tween_factory',
+        over='pyramid_tm.tm_tween_factory')
@@ -0,0 +1,577 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Each metric keeps a separate set of values for every thread that updates it,
+so recording a value never takes a lock. The per-thread values are only added
+together when the metrics are collected.
+
+With ``book_api.metrics.dir`` set, every process periodically writes its
+values to a file in that directory and the ``/metrics`` view adds up the files
+of all the processes, so any worker can answer for the whole deployment.
+"""
+
+import atexit
+import fcntl
+import glob
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
+
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid_retry import IBeforeRetry
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (
+    .005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0,
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# the files written by each process, and the one for processes that are gone
+FILE_NAME = re.compile(r'^metrics_(\d+)_[0-9a-f]+\.json$')
+ARCHIVE_NAME = 'archive.json'
+
+
+class MetricsRegistry(object):
+    """A collection of metrics that are collected and rendered together."""
+
+    def __init__(self):
+        """Create an empty registry."""
+        self.metrics = []
+
+    def register(self, metric):
+        """Add a metric to the registry."""
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Get the current values of all the metrics as plain data."""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def write_snapshot(self, path):
+        """Atomically write the current values to the given file."""
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric(object):
+    """Base class for metrics with values sharded by thread."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        """Create and register a new metric."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _values(self):
+        """Get the values owned by the current thread."""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append(values)
+            return values
+
+    def _collect(self):
+        """Get a copy of the values of every thread."""
+        with self._lock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+    def snapshot(self):
+        """Get the metadata and merged values of the metric."""
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'samples': [[list(labels), value]
+                        for labels, value in self._merged().items()],
+        }
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        """Increase the counter for the given label values."""
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def _merged(self):
+        """Add up the values from every thread."""
+        merged = {}
+        for shard in self._collect():
+            for labels, value in shard.items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+
+class Histogram(_Metric):
+    """Count observed values into buckets, keeping their sum."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=REGISTRY):
+        """Create and register a new histogram with the given buckets."""
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, labels=()):
+        """Record a single observed value for the given label values."""
+        values = self._values()
+        try:
+            counts = values[labels]
+        except KeyError:
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    def time(self, labels=()):
+        """Observe the duration of the enclosed block in seconds."""
+        return _Timer(self, labels)
+
+    def _merged(self):
+        """Add up the bucket counts from every thread."""
+        merged = {}
+        for shard in self._collect():
+            for labels, counts in shard.items():
+                if labels not in merged:
+                    merged[labels] = list(counts)
+                else:
+                    merged[labels] = [a + b for a, b in zip(merged[labels], counts)]
+        return merged
+
+    def snapshot(self):
+        """Get the metadata, buckets and merged values of the histogram."""
+        data = super(Histogram, self).snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+class Gauge(_Metric):
+    """A value read from a callback when the metrics are collected."""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        """Create and register a new gauge with no sources."""
+        self.sources = []
+        super(Gauge, self).__init__(name, documentation, labelnames, registry)
+
+    def add_source(self, source, owner=None):
+        """Add a callable returning a dict of label values to values.
+
+        With an owner, like the engine or controller of an app, the source
+        is called with it and only held on to for as long as the owner, so
+        the gauge neither keeps a discarded app alive nor counts it.
+        """
+        ref = weakref.ref(owner) if owner is not None else None
+        with self._lock:
+            self.sources.append((source, ref))
+
+    def _merged(self):
+        """Add up the values from every source with a live owner."""
+        live = []
+        with self._lock:
+            for source, ref in self.sources:
+                owner = ref() if ref is not None else None
+                if ref is None or owner is not None:
+                    live.append((source, ref, owner))
+            self.sources = [(source, ref) for source, ref, _ in live]
+
+        merged = {}
+        for source, ref, owner in live:
+            values = source() if ref is None else source(owner)
+            for labels, value in values.items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+
+class _Timer(object):
+    """Context manager observing the duration of a block in a histogram."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+REQUESTS = Counter(
+    'book_api_requests_total',
+    'Requests handled, by route, method and status.',
+    ('route', 'method', 'status'),
+)
+REQUEST_DURATION = Histogram(
+    'book_api_request_duration_seconds',
+    'Time taken to handle a request, by route and method.',
+    ('route', 'method'),
+)
+PASSWORD_VERIFY_DURATION = Histogram(
+    'book_api_password_verify_duration_seconds',
+    'Time taken to verify a password against its stored hash.',
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'book_api_db_pool_checked_out_connections',
+    'Database connections currently checked out of the pool.',
+)
+DB_POOL_OVERFLOW = Gauge(
+    'book_api_db_pool_overflow_connections',
+    'Database connections open beyond the configured pool size.',
+)
+DB_CONNECTION_HELD = Histogram(
+    'book_api_db_connection_held_seconds',
+    'Time a database connection stays checked out of the pool.',
+)
+CACHE_REQUESTS = Counter(
+    'book_api_cache_requests_total',
+    'Cache lookups, by cache name and result (hit or miss).',
+    ('cache', 'result'),
+)
+IN_FLIGHT = Gauge(
+    'book_api_requests_in_flight',
+    'Requests admitted and not yet handled.',
+)
+QUEUE_WAIT = Histogram(
+    'book_api_queue_wait_seconds',
+    'Time requests waited between the proxy and the app, from X-Request-Start.',
+)
+SHED = Counter(
+    'book_api_requests_shed_total',
+    'Requests answered with a 503 to shed load, by class and reason.',
+    ('class', 'reason'),
+)
+RETRIES = Counter(
+    'book_api_retries_total',
+    'Requests retried by pyramid_retry, by route and exception.',
+    ('route', 'exception'),
+)
+RETRIES_EXHAUSTED = Counter(
+    'book_api_retries_exhausted_total',
+    'Requests failing with a retryable error on their last attempt, by route '
+    'and exception.',
+    ('route', 'exception'),
+)
+
+
+def record_cache_lookup(cache, hit):
+    """Count a hit or miss for the named cache."""
+    CACHE_REQUESTS.inc((cache, 'hit' if hit else 'miss'))
+
+
+def merge_snapshots(snapshots):
+    """Add up the values of several snapshots into one."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, data in snapshot.items():
+            if name not in merged:
+                merged[name] = dict(data, samples={})
+            samples = merged[name]['samples']
+            for labels, value in data['samples']:
+                labels = tuple(labels)
+                if labels not in samples:
+                    samples[labels] = value
+                elif isinstance(value, list):
+                    samples[labels] = [a + b for a, b in zip(samples[labels], value)]
+                else:
+                    samples[labels] += value
+    return merged
+
+
+def _format_labels(names, values, extra=()):
+    """Format label names and values for the text format."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in pairs
+    ) + '}'
+
+
+def render_text(merged):
+    """Render merged snapshot data in the Prometheus text format."""
+    lines = []
+    for name in sorted(merged):
+        data = merged[name]
+        lines.append('# HELP {} {}'.format(name, data['help']))
+        lines.append('# TYPE {} {}'.format(name, data['type']))
+        names = data['labelnames']
+        for labels, value in sorted(data['samples'].items()):
+            if data['type'] != 'histogram':
+                lines.append('{}{} {}'.format(name, _format_labels(names, labels), value))
+                continue
+
+            cumulative = 0
+            for bound, count in zip(data['buckets'], value):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(names, labels, [('le', bound)]), cumulative))
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(names, labels, [('le', '+Inf')]), value[-1]))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(names, labels), value[-2]))
+            lines.append('{}_count{} {}'.format(name, _format_labels(names, labels), value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsStore(object):
+    """Collect metrics for this process, sharing them through a directory.
+
+    Each process writes its values to a file named after its PID and a
+    random token, so a process reusing the PID of an earlier one does not
+    overwrite its file. Files of processes that are gone have their
+    counters and histograms folded into an archive file and are removed,
+    so the totals keep growing while the gauges of dead processes stop
+    counting. Gauges are also left out of files not written for a few
+    flush intervals.
+    """
+
+    def __init__(self, registry=REGISTRY, directory=None, flush_interval=5.0):
+        """Create a store, shared through the directory when one is given."""
+        self.registry = registry
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.last_flush = 0.0
+        self._pid = None
+        self._name = None
+
+    @property
+    def path(self):
+        """Get the file this process writes its values to."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._name = 'metrics_{}_{}.json'.format(self._pid, uuid.uuid4().hex[:8])
+        return os.path.join(self.directory, self._name)
+
+    @property
+    def archive_path(self):
+        """Get the file holding the counters of processes that are gone."""
+        return os.path.join(self.directory, ARCHIVE_NAME)
+
+    def maybe_flush(self):
+        """Write the values of this process if the interval has passed."""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.last_flush = now
+            self.registry.write_snapshot(self.path)
+
+    def collect(self):
+        """Get the merged values for every process sharing the store."""
+        if not self.directory:
+            return merge_snapshots([self.registry.snapshot()])
+
+        self.last_flush = time.monotonic()
+        own_path = self.path
+        self.registry.write_snapshot(own_path)
+        stale_before = time.time() - 3 * self.flush_interval
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            match = FILE_NAME.match(os.path.basename(path))
+            if match is None:
+                continue
+            if path != own_path and not _process_alive(int(match.group(1))):
+                self.fold(path)
+                continue
+            try:
+                snapshot = _read_snapshot(path)
+                stale = os.path.getmtime(path) < stale_before
+            except (OSError, ValueError):
+                continue
+            if stale:
+                snapshot = _totals(snapshot)
+            snapshots.append(snapshot)
+        try:
+            snapshots.append(_read_snapshot(self.archive_path))
+        except (OSError, ValueError):
+            pass
+        return merge_snapshots(snapshots)
+
+    def fold(self, path):
+        """Add the counters and histograms in the file to the archive, removing it."""
+        claimed = '{}.{}.fold'.format(path, os.getpid())
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            # already folded by another process
+            return
+        try:
+            snapshot = _totals(_read_snapshot(claimed))
+        except (OSError, ValueError):
+            snapshot = {}
+        with open(os.path.join(self.directory, 'archive.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                archive = _read_snapshot(self.archive_path)
+            except (OSError, ValueError):
+                archive = {}
+            merged = merge_snapshots([archive, snapshot])
+            tmp_path = '{}.{}.tmp'.format(self.archive_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(_as_snapshot(merged), f)
+            os.replace(tmp_path, self.archive_path)
+        os.remove(claimed)
+
+    def close(self):
+        """Fold the values of this process into the archive before it exits."""
+        if not self.directory:
+            return
+        self.registry.write_snapshot(self.path)
+        self.fold(self.path)
+
+
+def _process_alive(pid):
+    """Check if a process with the PID exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    """Read a snapshot written to a file."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def _totals(snapshot):
+    """Get the counters and histograms of a snapshot, without its gauges."""
+    return {name: data for name, data in snapshot.items() if data['type'] != 'gauge'}
+
+
+def _as_snapshot(merged):
+    """Turn merged values back into the snapshot format written to files."""
+    return {
+        name: dict(data, samples=[[list(labels), value]
+                                  for labels, value in data['samples'].items()])
+        for name, data in merged.items()
+    }
+
+
+def metrics_view(request):
+    """Get the metrics of all the processes in the Prometheus text format."""
+    store = request.registry['metrics_store']
+    return Response(
+        text=render_text(store.collect()), content_type=CONTENT_TYPE, charset='utf-8')
+
+
+def metrics_tween_factory(handler, registry):
+    """Create a tween that counts and times each request."""
+    store = registry['metrics_store']
+
+    def metrics_tween(request):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = handler(request)
+            status = response.status_code
+            return response
+        finally:
+            route = getattr(request, 'matched_route', None)
+            route = route.name if route else ''
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start, (route, request.method))
+            REQUESTS.inc((route, request.method, str(status)))
+            store.maybe_flush()
+
+    return metrics_tween
+
+
+def _count_retry(retry_event):
+    """Count a request that is about to be retried."""
+    route = getattr(retry_event.request, 'matched_route', None)
+    RETRIES.inc((
+        route.name if route else '',
+        type(retry_event.exception).__name__,
+    ))
+
+
+def _checked_out(engine):
+    """Get the connections checked out of the pool of the engine."""
+    pool = engine.pool
+    return {(): pool.checkedout()} if hasattr(pool, 'checkedout') else {}
+
+
+def _overflow(engine):
+    """Get the connections open beyond the pool size of the engine."""
+    pool = engine.pool
+    return {(): max(pool.overflow(), 0)} if hasattr(pool, 'overflow') else {}
+
+
+def _watch_pool(engine):
+    """Track the connections checked out of the pool of the given engine."""
+    pool = engine.pool
+    DB_POOL_CHECKED_OUT.add_source(_checked_out, owner=engine)
+    DB_POOL_OVERFLOW.add_source(_overflow, owner=engine)
+
+    @event.listens_for(pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checked_out_at'] = time.perf_counter()
+
+    @event.listens_for(pool, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        start = connection_record.info.pop('checked_out_at', None)
+        if start is not None:
+            DB_CONNECTION_HELD.observe(time.perf_counter() - start)
+
+
+def includeme(config):
+    """
+    Expose metrics at ``/metrics`` when ``book_api.metrics`` is enabled.
+
+    Set ``book_api.metrics.dir`` to a directory shared by all the worker
+    processes of a deployment to report their combined metrics.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.metrics', False)):
+        return
+
+    directory = settings.get('book_api.metrics.dir') or None
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    store = config.registry['metrics_store'] = MetricsStore(
+        directory=directory,
+        flush_interval=float(settings.get('book_api.metrics.flush_interval', 5)),
+    )
+    atexit.register(store.close)
+
+    _watch_pool(config.registry['db_engine'])
+    config.add_subscriber(_count_retry, IBeforeRetry)
+    config.add_tween('book_api.metrics.metrics_tween_factory')
+
+    config.add_route('metrics', '/metrics')
+    config.add_view(metrics_view, route_name='metrics', request_method='GET')
@@ -1,3 +1,4 @@
+from pyramid.settings import asbool
 from sqlalchemy import engine_from_config
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import configure_mappers
@@ -5,12 +6,13 @@ import zope.sqlalchemy
 
 # import or define all models here to ensure they are attached to the
 # Base.metadata prior to any initialization routines
-from .book import Book  # flake8: noqa
-from .user import User  # flake8: noqa
-
-# run configure_mappers after defining all of the models to ensure
-# all relationships can be setup
-configure_mappers()
+from .book import Book, BookRow  # flake8: noqa
+from .book_change import BookChange  # flake8: noqa
+from .idempotency_key import IdempotencyKey  # flake8: noqa
+from .user import User, pwd_context, pwd_context_from_settings  # flake8: noqa
+from .slowlog import install_slow_query_log
+from .group_commit import GroupCommitWriter
+from .user_cache import UserCache
 
 
 def get_engine(settings, prefix='sqlalchemy.'):
@@ -60,15 +62,54 @@ def includeme(config):
     settings = config.get_settings()
     settings['tm.manager_hook'] = 'pyramid_tm.explicit_manager'
 
+    # run configure_mappers once all of the models are defined to ensure
+    # all relationships can be setup
+    configure_mappers()
+
     # use pyramid_tm to hook the transaction lifecycle to the request
     config.include('pyramid_tm')
 
     # use pyramid_retry to retry a request when transient exceptions occur
     config.include('pyramid_retry')
 
-    session_factory = get_session_factory(get_engine(settings))
+    # hash and verify passwords with the policy from the passlib.* settings,
+    # leaving the default policy to load its handlers on first use
+    if any(key.startswith('passlib.') for key in settings):
+        config.registry['pwd_context'] = pwd_context_from_settings(settings)
+
+    engine = get_engine(settings)
+    config.registry['db_engine'] = engine
+
+    # log statements slower than the threshold along with their query plan
+    threshold = settings.get('book_api.slow_query.threshold_ms')
+    if threshold:
+        install_slow_query_log(
+            engine,
+            float(threshold) / 1000,
+            sample_rate=float(settings.get('book_api.slow_query.sample_rate', 1.0)),
+        )
+
+    session_factory = get_session_factory(engine)
     config.registry['dbsession_factory'] = session_factory
 
+    # authenticate requests from cached snapshots of the User rows
+    if asbool(settings.get('book_api.user_cache', False)):
+        user_cache = UserCache(
+            max_entries=int(settings.get('book_api.user_cache.max_entries', 10000)),
+            ttl=float(settings.get('book_api.user_cache.ttl', 60)),
+        )
+        user_cache.install(session_factory)
+        config.registry['user_cache'] = user_cache
+
+    # commit the book writes of many requests together, on an engine used
+    # by the writer thread only
+    if asbool(settings.get('book_api.group_commit', False)):
+        config.registry['group_commit'] = GroupCommitWriter(
+            get_engine(settings),
+            window=float(settings.get('book_api.group_commit.window_ms', 2)) / 1000,
+            max_batch=int(settings.get('book_api.group_commit.max_batch', 64)),
+        )
+
     # make request.dbsession available for use in Pyramid
     config.add_request_method(
         # r.tm is the transaction manager used by pyramid_tm
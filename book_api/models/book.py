@@ -1,21 +1,65 @@
 """Table for Book records."""
 
+from datetime import datetime
+
 from sqlalchemy import (
     Column,
     Date,
+    DateTime,
     ForeignKey,
+    Index,
     Integer,
     Unicode,
+    column,
 )
 from sqlalchemy.orm import relationship
 
 from .meta import Base
 
 
-class Book(Base):
+class DateString(str):
+    """A date formatted as mm/dd/yyyy that keeps the date it was made from.
+
+    It is a plain string to the JSON renderer, while the binary renderers
+    encode the date itself.
+    """
+
+    def __new__(cls, date):
+        """Format the date."""
+        formatted = super(DateString, cls).__new__(cls, date.strftime('%m/%d/%Y'))
+        formatted.date = date.date() if isinstance(date, datetime) else date
+        return formatted
+
+
+class BookJSON(object):
+    """Serialization shared by Book and BookRow."""
+
+    __slots__ = ()
+
+    def to_json(self):
+        """Take all model attributes and render them as JSON."""
+        return {
+            'id': self.id,
+            'title': self.title,
+            'author': self.author,
+            'isbn': self.isbn,
+            'pub_date': DateString(self.pub_date) if self.pub_date else None,
+        }
+
+
+class Book(BookJSON, Base):
     """Create a table for books."""
 
     __tablename__ = 'books'
+    __table_args__ = (
+        # only soft deleted books are indexed, for compact_books to find
+        Index(
+            'ix_books_deleted_at',
+            'deleted_at',
+            postgresql_where=column('deleted_at') != None,
+            sqlite_where=column('deleted_at') != None,
+        ),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     user = relationship("User", back_populates="books")
@@ -25,12 +69,30 @@ class Book(Base):
     isbn = Column(Unicode)
     pub_date = Column(Date)
 
-    def to_json(self):
-        """Take all model attributes and render them as JSON."""
-        return {
-            'id': self.id,
-            'title': self.title,
-            'author': self.author,
-            'isbn': self.isbn,
-            'pub_date': self.pub_date.strftime('%m/%d/%Y') if self.pub_date else None,
-        }
+    # set instead of deleting the row when soft deletes are enabled
+    deleted_at = Column(DateTime)
+
+
+class BookRow(BookJSON):
+    """A read-only book loaded from plain columns, without the ORM.
+
+    Much cheaper to build than a Book for rows that are only serialized.
+    Load them with ``dbsession.query(*BookRow.columns)`` and ``from_row``.
+    """
+
+    __slots__ = ('id', 'title', 'author', 'isbn', 'pub_date')
+
+    columns = (Book.id, Book.title, Book.author, Book.isbn, Book.pub_date)
+
+    def __init__(self, id, title, author, isbn, pub_date):
+        """Create a book from its column values."""
+        self.id = id
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.pub_date = pub_date
+
+    @classmethod
+    def from_row(cls, row):
+        """Create a book from a row of ``BookRow.columns``."""
+        return cls(*row)
@@ -0,0 +1,43 @@
+"""Table for the append-only log of changes to Book records."""
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    Unicode,
+)
+
+from .meta import Base
+
+
+class BookChange(Base):
+    """Create a table recording each create, update and delete of a book.
+
+    The id of a change doubles as the sync token handed to clients, who ask
+    for the changes with an id greater than the last token they saw. The
+    changes of a user are committed in the order of their ids, so no change
+    can later appear behind a token already handed out.
+    """
+
+    __tablename__ = 'book_changes'
+    __table_args__ = (
+        Index('ix_book_changes_user_id_id', 'user_id', 'id'),
+        Index('ix_book_changes_book_id_id', 'book_id', 'id'),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+
+    # not a foreign key, as the book may since have been removed
+    book_id = Column(Integer, nullable=False)
+    action = Column(Unicode, nullable=False)
+    changed_at = Column(DateTime, nullable=False)
+
+    def to_json(self):
+        """Take all model attributes and render them as JSON."""
+        return {
+            'token': self.id,
+            'id': self.book_id,
+            'action': self.action,
+        }
@@ -0,0 +1,156 @@
+"""Committing the book writes of many requests together.
+
+With SQLite every transaction that writes waits for its own fsync, and
+writers running at the same time fail with "database is locked" and are
+retried. With ``book_api.group_commit`` enabled, the book views hand their
+writes to a single writer thread instead. It gathers the writes that arrive
+within a short window, runs each in its own SAVEPOINT so a failing write
+only undoes itself, and commits them all with one COMMIT. Each request gets
+its result back once that commit is done.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+log = logging.getLogger(__name__)
+
+
+def enable_sqlite_savepoints(engine):
+    """Let the pysqlite driver use SAVEPOINT, by taking over BEGIN from it."""
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        conn.execute('BEGIN')
+
+
+class _Write(object):
+    """A write waiting for the writer thread."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.started = False
+        self.cancelled = False
+
+
+class GroupCommitWriter(object):
+    """Run writes on a single thread, committing them in groups."""
+
+    def __init__(self, engine, window=0.002, max_batch=64):
+        """Write with the engine, waiting up to ``window`` seconds for a group.
+
+        The engine should be used by this writer only.
+        """
+        if engine.dialect.name == 'sqlite':
+            enable_sqlite_savepoints(engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.window = window
+        self.max_batch = max_batch
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, timeout=None):
+        """Run ``fn(dbsession)`` on the writer and get its result once committed.
+
+        Exceptions raised by ``fn``, or by the commit, are raised here.
+        Raises ``TimeoutError`` if the writer did not get to the write in
+        time, in which case the write is cancelled and never runs. A write
+        the writer has already started is waited for until it is committed.
+        """
+        self._start()
+        write = _Write(fn)
+        self._queue.put(write)
+        if not write.done.wait(timeout):
+            with self._lock:
+                write.cancelled = not write.started
+            if write.cancelled:
+                raise TimeoutError('The write was not committed in time.')
+            write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def close(self):
+        """Stop the writer thread once the queued writes are done."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _start(self):
+        """Start the writer thread the first time it is needed.
+
+        Starting late keeps the thread out of a parent process that forks.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        """Commit groups of writes until told to stop."""
+        stopping = False
+        while not stopping:
+            write = self._queue.get()
+            if write is None:
+                return
+            batch = [write]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    write = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                batch.append(write)
+            self.commit(batch)
+
+    def commit(self, batch):
+        """Run a group of writes in one transaction, each in a SAVEPOINT."""
+        with self._lock:
+            batch = [write for write in batch if not write.cancelled]
+            for write in batch:
+                write.started = True
+        if not batch:
+            return
+
+        dbsession = self.session_factory()
+        try:
+            for write in batch:
+                savepoint = dbsession.begin_nested()
+                try:
+                    write.result = write.fn(dbsession)
+                    savepoint.commit()
+                except Exception as error:
+                    savepoint.rollback()
+                    write.error = error
+            dbsession.commit()
+            self.commits += 1
+        except Exception as error:
+            log.exception('group commit of %d writes failed', len(batch))
+            dbsession.rollback()
+            for write in batch:
+                if write.error is None:
+                    write.error = error
+        finally:
+            dbsession.close()
+            for write in batch:
+                write.done.set()
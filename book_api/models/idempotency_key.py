@@ -0,0 +1,32 @@
+"""Table for responses stored under the Idempotency-Key of a request."""
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    LargeBinary,
+    Unicode,
+)
+
+from .meta import Base
+
+
+class IdempotencyKey(Base):
+    """Create a table of successful responses to replay for repeated requests.
+
+    The scope is a hash of the key together with the path, email and Accept
+    header of the request, and the fingerprint a hash of its body, so a key
+    only replays a response for the exact request that produced it.
+    """
+
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+    scope = Column(Unicode(64), primary_key=True)
+    fingerprint = Column(Unicode(64), nullable=False)
+    status = Column(Integer, nullable=False)
+    content_type = Column(Unicode, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, nullable=False)
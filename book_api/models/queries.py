@@ -0,0 +1,56 @@
+"""Baked versions of the queries run on every request.
+
+Building a Query and compiling it to SQL costs more Python time than the
+queries themselves take to run on small tables. Baked queries are built and
+compiled once, then cached and reused with new parameters.
+"""
+
+from sqlalchemy import bindparam, func
+from sqlalchemy.ext import baked
+
+from .book import Book, BookRow
+from .book_change import BookChange
+from .user import User
+
+bakery = baked.bakery()
+
+
+def user_by_email(dbsession, email):
+    """Get the User with the email, or None."""
+    query = bakery(lambda session: session.query(User))
+    query += lambda q: q.filter(User.email == bindparam('email'))
+    return query(dbsession).params(email=email).first()
+
+
+def owned_book_row(dbsession, user_id, book_id):
+    """Get a row of ``BookRow.columns`` for a book of the user, or None.
+
+    Books that are soft deleted are left out.
+    """
+    query = bakery(lambda session: session.query(*BookRow.columns))
+    query += lambda q: q.filter(
+        Book.id == bindparam('book_id'),
+        Book.user_id == bindparam('user_id'),
+        Book.deleted_at == None,
+    )
+    return query(dbsession).params(user_id=user_id, book_id=book_id).first()
+
+
+def book_rows_for_user(dbsession, user_id):
+    """Get the rows of ``BookRow.columns`` for the books of the user.
+
+    Books that are soft deleted are left out, and the rest are ordered by id.
+    """
+    query = bakery(lambda session: session.query(*BookRow.columns))
+    query += lambda q: q.filter(
+        Book.user_id == bindparam('user_id'),
+        Book.deleted_at == None,
+    ).order_by(Book.id)
+    return query(dbsession).params(user_id=user_id).all()
+
+
+def list_version(dbsession, user_id):
+    """Get the token of the newest change to the books of the user, or None."""
+    query = bakery(lambda session: session.query(func.max(BookChange.id)))
+    query += lambda q: q.filter(BookChange.user_id == bindparam('user_id'))
+    return query(dbsession).params(user_id=user_id).scalar()
@@ -0,0 +1,112 @@
+"""Logging of slow SQL statements along with their query plans."""
+
+import logging
+import random
+import re
+import time
+
+from pyramid.threadlocal import get_current_request
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+# only these statements are explained; EXPLAIN of anything else, such as
+# SET LOCAL or DDL, is an error
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+# name of the savepoint guarding EXPLAIN inside a PostgreSQL transaction
+SAVEPOINT = 'slowlog_explain'
+
+
+# statements on tables holding secrets, such as password hashes, whose
+# parameters are not logged
+SECRET_TABLES = re.compile(r'\busers\b', re.IGNORECASE)
+
+
+def loggable_parameters(statement, parameters):
+    """Get the parameters of a statement as they may be logged.
+
+    Statements on the users table only have their number of parameters
+    logged, as they may carry password hashes.
+    """
+    if SECRET_TABLES.search(statement):
+        return '<{} parameters>'.format(len(parameters))
+    return repr(parameters)
+
+
+def _current_route():
+    """Get the name of the route for the request handled on this thread."""
+    route = getattr(get_current_request(), 'matched_route', None)
+    return route.name if route else None
+
+
+def explain(connection, statement, parameters):
+    """Get the query plan for a statement as a list of lines.
+
+    Uses a separate cursor so the results of the original statement are not
+    disturbed. Returns an empty list for statements that cannot be explained
+    and for databases without a known EXPLAIN.
+
+    On PostgreSQL a failed statement aborts the whole transaction, so EXPLAIN
+    runs inside a savepoint that is rolled back if it fails.
+    """
+    prefix = EXPLAIN_PREFIXES.get(connection.dialect.name)
+    words = statement.lstrip().split(None, 1)
+    if prefix is None or not words or words[0].upper() not in EXPLAINABLE:
+        return []
+
+    guarded = connection.dialect.name == 'postgresql'
+    cursor = connection.connection.cursor()
+    try:
+        if guarded:
+            cursor.execute('SAVEPOINT ' + SAVEPOINT)
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+        except Exception:
+            if guarded:
+                cursor.execute('ROLLBACK TO SAVEPOINT ' + SAVEPOINT)
+            raise
+        if guarded:
+            cursor.execute('RELEASE SAVEPOINT ' + SAVEPOINT)
+        return plan
+    finally:
+        cursor.close()
+
+
+def install_slow_query_log(engine, threshold, sample_rate=1.0):
+    """Log statements on the engine that take at least ``threshold`` seconds.
+
+    Only ``sample_rate`` of the slow statements are explained and logged, to
+    keep the cost of running EXPLAIN down when many statements are slow.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slowlog_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['slowlog_start_time'].pop()
+        if duration < threshold or random.random() >= sample_rate:
+            return
+
+        plan = []
+        if not executemany:
+            try:
+                plan = explain(conn, statement, parameters)
+            except Exception as exc:
+                plan = ['EXPLAIN failed: {}'.format(exc)]
+
+        log.warning(
+            'slow query %.2fms route=%s: %s params=%s\n%s',
+            duration * 1000,
+            _current_route(),
+            statement,
+            loggable_parameters(statement, parameters),
+            '\n'.join(plan),
+        )
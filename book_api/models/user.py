@@ -1,6 +1,7 @@
 """Table for User records."""
 
-from passlib.apps import custom_app_context as pwd_context
+from passlib.context import CryptContext, LazyCryptContext
+from pyramid.threadlocal import get_current_registry
 from sqlalchemy import (
     Column,
     Integer,
@@ -10,13 +11,63 @@ from sqlalchemy.orm import relationship
 
 from .meta import Base
 
+# the same policy as passlib's custom_app_context, used for any options the
+# settings do not override
+DEFAULT_PWD_OPTIONS = dict(
+    schemes=['sha512_crypt', 'sha256_crypt'],
+    default='sha512_crypt',
+    sha512_crypt__min_rounds=535000,
+    sha256_crypt__min_rounds=535000,
+)
+
+# the hash handlers are only loaded when the first password is checked
+pwd_context = LazyCryptContext(**DEFAULT_PWD_OPTIONS)
+
+
+def pwd_context_from_settings(settings, prefix='passlib.'):
+    """Build a password context from the settings starting with the prefix.
+
+    For example ``passlib.schemes = pbkdf2_sha256, sha512_crypt`` with
+    ``passlib.deprecated = auto`` makes new hashes use pbkdf2_sha256 and
+    marks existing sha512_crypt hashes to be upgraded on the next login.
+
+    Settings that only tune options, like ``passlib.sha512_crypt__min_rounds``,
+    are applied on top of the default policy. Settings with their own
+    ``passlib.schemes`` replace it.
+    """
+    options = {
+        key[len(prefix):]: value
+        for key, value in settings.items() if key.startswith(prefix)
+    }
+    if 'schemes' in options:
+        return CryptContext(**options)
+
+    context = CryptContext(**DEFAULT_PWD_OPTIONS)
+    if options:
+        context.load(options, update=True)
+    return context
+
+
+def current_pwd_context():
+    """Get the password context of the app handling the current request.
+
+    Apps built with ``passlib.*`` settings keep their own context in the
+    registry, everything else uses the default ``pwd_context``.
+    """
+    return get_current_registry().get('pwd_context') or pwd_context
+
 
 class User(Base):
     """Create a table for users."""
 
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
-    books = relationship("Book", back_populates="user")
+    books = relationship(
+        "Book",
+        back_populates="user",
+        # leave out books that have been soft deleted
+        primaryjoin="and_(User.id == Book.user_id, Book.deleted_at == None)",
+    )
 
     first_name = Column(Unicode)
     last_name = Column(Unicode)
@@ -26,13 +77,25 @@ class User(Base):
     def __init__(self, *args, **kwargs):
         """Create a new User and store only the hashed password."""
         if 'password' in kwargs:
-            kwargs['password'] = pwd_context.hash(kwargs['password'])
+            kwargs['password'] = current_pwd_context().hash(kwargs['password'])
 
         super(User, self).__init__(*args, **kwargs)
 
     def verify(self, password):
         """Verify that the given password is correct."""
-        return pwd_context.verify(password, self.password)
+        return current_pwd_context().verify(password, self.password)
+
+    def verify_and_update(self, password):
+        """Verify the password, rehashing it if the stored hash is outdated.
+
+        The stored hash is replaced when the password policy has changed,
+        for example to a new scheme or a different number of rounds.
+        """
+        verified, new_hash = current_pwd_context().verify_and_update(
+            password, self.password)
+        if verified and new_hash:
+            self.password = new_hash
+        return verified
 
     def to_json(self):
         """Take all model attributes and render them as JSON."""
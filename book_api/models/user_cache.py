@@ -0,0 +1,178 @@
+"""A process wide cache of User rows for authenticating requests.
+
+Every request looks its user up by email, while user rows rarely change.
+The cache keeps immutable snapshots of the rows, keyed by id and email, and
+turns a snapshot back into a User attached to the request's session without
+querying the database.
+
+Entries are dropped whenever a session flushes an inserted or updated User,
+and again when that session commits, so a snapshot read by a concurrent
+request between the two is not kept. A lookup that queried the database
+before an invalidation is not stored after it either: invalidating an email
+bumps its generation, and a lookup only stores its snapshot if the
+generation it saw before querying is unchanged. Entries also expire after a
+time to live, which bounds how long a change made by another process is
+missed.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from book_api.metrics import record_cache_lookup
+
+from .queries import user_by_email
+from .user import User
+
+UserSnapshot = namedtuple(
+    'UserSnapshot', ['id', 'first_name', 'last_name', 'email', 'password'])
+
+
+def snapshot_user(user):
+    """Get an immutable snapshot of a loaded User."""
+    return UserSnapshot(*(getattr(user, field) for field in UserSnapshot._fields))
+
+
+def restore_user(dbsession, snapshot):
+    """Get a User for the snapshot, attached to the session without a query."""
+    # skip User.__init__, which would hash the already hashed password
+    user = User.__mapper__.class_manager.new_instance()
+    for field, value in snapshot._asdict().items():
+        setattr(user, field, value)
+    make_transient_to_detached(user)
+    return dbsession.merge(user, load=False)
+
+
+# number of generation counters shared out among the emails by their hash
+GENERATION_SLOTS = 1024
+
+
+class UserCache(object):
+    """A least recently used cache of User snapshots with a time to live."""
+
+    def __init__(self, max_entries=10000, ttl=60):
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._by_id = OrderedDict()
+        self._ids_by_email = {}
+        # a fixed number of counters keeps the memory bounded; emails
+        # sharing a counter only cause the odd snapshot to be skipped
+        self._generations = [0] * GENERATION_SLOTS
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get(self, email=None, user_id=None, now=None):
+        """Get the snapshot for the email or user id, or None."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if user_id is None:
+                user_id = self._ids_by_email.get(email)
+            entry = self._by_id.get(user_id)
+            if entry is not None and entry[0] <= now:
+                self._remove(user_id)
+                entry = None
+            if entry is not None:
+                self._by_id.move_to_end(user_id)
+        snapshot = entry[1] if entry is not None else None
+        if snapshot is not None and email is not None and snapshot.email != email:
+            snapshot = None
+        record_cache_lookup('user', snapshot is not None)
+        return snapshot
+
+    def generation(self, email):
+        """Get the generation of the email, which invalidating it bumps."""
+        with self._lock:
+            return self._generations[hash(email) % GENERATION_SLOTS]
+
+    def add(self, snapshot, now=None, generation=None):
+        """Store a snapshot, evicting the least recently used if full.
+
+        When given the generation of its email from before the snapshot was
+        read, the snapshot is only stored if the email has not been
+        invalidated since. Returns whether it was stored.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            slot = hash(snapshot.email) % GENERATION_SLOTS
+            if generation is not None and self._generations[slot] != generation:
+                return False
+            self._remove(snapshot.id)
+            self._by_id[snapshot.id] = (now + self.ttl, snapshot)
+            self._ids_by_email[snapshot.email] = snapshot.id
+            while len(self._by_id) > self.max_entries:
+                self._remove(next(iter(self._by_id)))
+        return True
+
+    def invalidate(self, ids=(), emails=()):
+        """Drop the entries for the given ids and emails.
+
+        Bumps the generation of the emails, and of the emails of the entries
+        dropped by id, so lookups already under way do not store them again.
+        """
+        with self._lock:
+            for user_id in ids:
+                entry = self._by_id.get(user_id)
+                if entry is not None:
+                    self._bump(entry[1].email)
+                self._remove(user_id)
+            for email in emails:
+                self._bump(email)
+                user_id = self._ids_by_email.get(email)
+                if user_id is not None:
+                    self._remove(user_id)
+
+    def _bump(self, email):
+        """Bump the generation of an email; the lock must be held."""
+        self._generations[hash(email) % GENERATION_SLOTS] += 1
+
+    def _remove(self, user_id):
+        """Drop an entry by user id; the lock must be held."""
+        entry = self._by_id.pop(user_id, None)
+        if entry is not None and self._ids_by_email.get(entry[1].email) == user_id:
+            del self._ids_by_email[entry[1].email]
+
+    def load_user(self, dbsession, email):
+        """Get the User with the email, from the cache or the database."""
+        snapshot = self.get(email=email)
+        if snapshot is not None:
+            return restore_user(dbsession, snapshot)
+
+        generation = self.generation(email)
+        user = user_by_email(dbsession, email)
+        if user is not None:
+            self.add(snapshot_user(user), generation=generation)
+        return user
+
+    def install(self, session_factory):
+        """Invalidate entries for Users changed in the factory's sessions."""
+        event.listen(session_factory, 'after_flush', self._after_flush)
+        event.listen(session_factory, 'after_commit', self._after_commit)
+        event.listen(session_factory, 'after_rollback', self._after_rollback)
+
+    def _after_flush(self, session, flush_context):
+        ids, emails = session.info.setdefault('user_cache_changes', (set(), set()))
+        for obj in list(session.new) + list(session.dirty):
+            # adding a book only changes the user's collection, not the row
+            if isinstance(obj, User) and (
+                    obj in session.new
+                    or session.is_modified(obj, include_collections=False)):
+                history = inspect(obj).attrs.email.history
+                ids.add(obj.id)
+                emails.update(history.added or ())
+                emails.update(history.deleted or ())
+                emails.update(history.unchanged or ())
+        self.invalidate(ids, emails)
+
+    def _after_commit(self, session):
+        changes = session.info.pop('user_cache_changes', None)
+        if changes is not None:
+            self.invalidate(*changes)
+
+    def _after_rollback(self, session):
+        session.info.pop('user_cache_changes', None)
@@ -0,0 +1,140 @@
+"""Sampling profiler for a fraction of requests, or requests that ask for it.
+
+Profiled requests have the stack of their thread sampled at a fixed interval.
+Samples are aggregated per route and written in the folded stack format
+(``frame;frame;frame count``) read by flamegraph.pl, inferno and speedscope.
+"""
+
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from pyramid.settings import asbool
+
+log = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+
+
+class StackSampler(object):
+    """Sample the stack of a single thread from a background thread."""
+
+    def __init__(self, thread_id, interval=0.005):
+        """Prepare to sample the thread with the given id."""
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler')
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        """Take samples until stopped."""
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[fold_stack(frame)] += 1
+
+
+def fold_stack(frame):
+    """Get the stack ending at the frame as a ';' separated string."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class ProfileStore(object):
+    """Aggregate stack samples per route and write them to a directory."""
+
+    def __init__(self, directory):
+        """Create a store writing to the given directory."""
+        self.directory = directory
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def path(self, route):
+        """Get the file the samples for a route are written to."""
+        name = re.sub(r'[^\w.-]', '_', route)
+        return os.path.join(self.directory, '{}.{}.folded'.format(name, os.getpid()))
+
+    def add(self, route, stacks):
+        """Add samples for a route and rewrite its file."""
+        with self._lock:
+            totals = self.routes.setdefault(route, Counter())
+            totals.update(stacks)
+            lines = ['{} {}\n'.format(stack, count) for stack, count in totals.items()]
+
+            path = self.path(route)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.writelines(lines)
+            os.replace(tmp_path, path)
+
+
+def profiling_tween_factory(handler, registry):
+    """Create a tween that samples the stacks of selected requests."""
+    settings = registry.settings
+    store = registry['profile_store']
+    sample_rate = float(settings.get('book_api.profile.sample_rate', 0))
+    interval = float(settings.get('book_api.profile.interval_ms', 5)) / 1000
+    token = settings.get('book_api.profile.token')
+
+    def requested(request):
+        given = request.headers.get(PROFILE_HEADER)
+        return bool(token and given and hmac.compare_digest(
+            given.encode('utf-8'), token.encode('utf-8')))
+
+    def profiling_tween(request):
+        if not requested(request) and random.random() >= sample_rate:
+            return handler(request)
+
+        start = time.perf_counter()
+        with StackSampler(threading.get_ident(), interval) as sampler:
+            response = handler(request)
+
+        route = getattr(request, 'matched_route', None)
+        route = route.name if route else 'notfound'
+        store.add(route, sampler.stacks)
+        log.debug('profiled %s %s: %d samples in %.2fms',
+                  request.method, route, sum(sampler.stacks.values()),
+                  (time.perf_counter() - start) * 1000)
+        response.headers['X-Profile-Samples'] = str(sum(sampler.stacks.values()))
+        return response
+
+    return profiling_tween
+
+
+def includeme(config):
+    """
+    Profile requests when ``book_api.profile`` is enabled.
+
+    ``book_api.profile.sample_rate`` of the requests are profiled, along with
+    any request whose ``X-Profile`` header matches ``book_api.profile.token``.
+    Profiles are written to ``book_api.profile.dir``.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.profile', False)):
+        return
+
+    directory = settings.get('book_api.profile.dir') or 'profiles'
+    os.makedirs(directory, exist_ok=True)
+    config.registry['profile_store'] = ProfileStore(directory)
+    config.add_tween('book_api.profiling.profiling_tween_factory')
@@ -0,0 +1,160 @@
+"""Throttling of failed credential checks per email and per client address.
+
+Every failed login costs a full password hash, so once an email or a client
+address has too many recent failures, further attempts are rejected with a
+429 response before the password is checked at all.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from pyramid.httpexceptions import HTTPTooManyRequests
+from pyramid.settings import asbool
+
+
+class MemoryBackend(object):
+    """Sliding windows of failure times per key, kept in process memory.
+
+    Keys of each kind, such as ``email:`` and ``ip:``, are kept in their own
+    LRU of at most ``max_keys`` entries, so a flood of new addresses only
+    pushes out other addresses and never the counts of an email. Failures
+    older than the window are dropped when their key is next used.
+
+    A shared backend for multi-process deployments only needs the same
+    ``hit`` and ``recent`` methods, and can be selected with the
+    ``book_api.ratelimit.backend`` setting.
+    """
+
+    def __init__(self, settings=None, max_keys=100000):
+        """Create an empty backend tracking at most ``max_keys`` keys per kind."""
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key):
+        """Get the LRU holding keys of the same kind as the key."""
+        kind = key.split(':', 1)[0]
+        try:
+            return self._buckets[kind]
+        except KeyError:
+            return self._buckets.setdefault(kind, OrderedDict())
+
+    def hit(self, key, window, now):
+        """Record a failure for the key."""
+        with self._lock:
+            bucket = self._bucket(key)
+            hits = bucket.get(key)
+            if hits is None:
+                hits = bucket[key] = deque()
+                if len(bucket) > self.max_keys:
+                    bucket.popitem(last=False)
+            else:
+                bucket.move_to_end(key)
+                _expire(hits, window, now)
+            hits.append(now)
+
+    def recent(self, key, window, now):
+        """Get the failure times for the key within the window, oldest first."""
+        with self._lock:
+            bucket = self._bucket(key)
+            hits = bucket.get(key)
+            if not hits:
+                return []
+            _expire(hits, window, now)
+            if not hits:
+                del bucket[key]
+            return list(hits)
+
+
+def _expire(hits, window, now):
+    """Drop the failure times that are outside the window."""
+    while hits and hits[0] <= now - window:
+        hits.popleft()
+
+
+class RateLimiter(object):
+    """Limit the failed credential checks per email and per client address."""
+
+    def __init__(self, backend, email_limit=5, ip_limit=20, window=60,
+                 trusted_proxies=0):
+        """Allow the given failures for each email and address per window.
+
+        ``trusted_proxies`` is the number of proxies in front of the app
+        that append to ``X-Forwarded-For``; with none, the address of the
+        peer connection is used and the header is ignored.
+        """
+        self.backend = backend
+        self.email_limit = email_limit
+        self.ip_limit = ip_limit
+        self.window = window
+        self.trusted_proxies = trusted_proxies
+
+    def client_ip(self, request):
+        """Get the client address of the request, trusting only known proxies.
+
+        Each trusted proxy appends the address it got the request from to
+        ``X-Forwarded-For``, so the client is the entry added by the first
+        of them. Entries before it are sent by the client and can be forged.
+        """
+        if not self.trusted_proxies:
+            return request.remote_addr
+        forwarded = [
+            addr.strip() for addr in
+            request.headers.get('X-Forwarded-For', '').split(',') if addr.strip()
+        ]
+        if len(forwarded) < self.trusted_proxies:
+            return request.remote_addr
+        return forwarded[-self.trusted_proxies]
+
+    def _keys(self, email, ip):
+        """Get the keys and their limits for an attempt."""
+        keys = [('email:' + email.lower(), self.email_limit)]
+        if ip:
+            keys.append(('ip:' + ip, self.ip_limit))
+        return keys
+
+    def check(self, email, ip, now=None):
+        """Raise HTTPTooManyRequests if the email or address is throttled."""
+        now = time.time() if now is None else now
+        retry_after = 0
+        for key, limit in self._keys(email, ip):
+            hits = self.backend.recent(key, self.window, now)
+            if len(hits) >= limit:
+                retry_after = max(retry_after, hits[-limit] + self.window - now)
+
+        if retry_after > 0:
+            raise HTTPTooManyRequests(
+                'Too many failed attempts, try again later.',
+                headers={'Retry-After': str(int(math.ceil(retry_after)))},
+            )
+
+    def record_failure(self, email, ip, now=None):
+        """Record a failed credential check for the email and address."""
+        now = time.time() if now is None else now
+        for key, _ in self._keys(email, ip):
+            self.backend.hit(key, self.window, now)
+
+
+def includeme(config):
+    """
+    Throttle failed credential checks when ``book_api.ratelimit`` is enabled.
+
+    The limiter is stored as ``registry['ratelimiter']`` and consulted by
+    :func:`book_api.views.books.validate_user`.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.ratelimit', False)):
+        return
+
+    backend = config.maybe_dotted(
+        settings.get('book_api.ratelimit.backend') or MemoryBackend)
+    config.registry['ratelimiter'] = RateLimiter(
+        backend(settings),
+        email_limit=int(settings.get('book_api.ratelimit.email_limit', 5)),
+        ip_limit=int(settings.get('book_api.ratelimit.ip_limit', 20)),
+        window=float(settings.get('book_api.ratelimit.window', 60)),
+        trusted_proxies=int(settings.get('book_api.ratelimit.trusted_proxies', 0)),
+    )
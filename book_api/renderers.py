@@ -0,0 +1,121 @@
+"""Binary alternatives to the JSON responses of the book and signup views.
+
+Clients asking for ``Accept: application/msgpack`` get MessagePack, and
+clients asking for ``Accept: application/cbor`` get CBOR, when the
+``msgpack`` and ``cbor2`` packages are installed. Both contain the same
+fields as the JSON responses, except that publication dates are encoded as
+dates: a MessagePack timestamp at midnight UTC, or a CBOR full-date.
+JSON stays the default for every other client.
+"""
+
+from datetime import datetime, timezone
+
+from book_api.models.book import DateString
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+# the views with binary alternatives, as (view, route name, request methods)
+VIEWS = (
+    ('book_api.views.books.book_list_create_view', 'book-list', ('GET', 'POST')),
+    ('book_api.views.books.book_detail_update_delete_view', 'book-id', ('GET', 'PUT', 'DELETE')),
+    ('book_api.views.users.signup_view', 'signup', 'POST'),
+)
+
+
+def _msgpack_default(value):
+    """Encode the values MessagePack has no type for."""
+    if isinstance(value, DateString):
+        midnight = datetime(
+            value.date.year, value.date.month, value.date.day, tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(midnight)
+    if isinstance(value, str):
+        return str(value)
+    raise TypeError('Cannot encode {!r}'.format(value))
+
+
+def _with_dates(value):
+    """Replace the formatted dates in the value with the dates themselves."""
+    if isinstance(value, DateString):
+        return value.date
+    if isinstance(value, dict):
+        return {key: _with_dates(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_with_dates(item) for item in value]
+    return value
+
+
+class MsgPackRenderer(object):
+    """Render a view's value as MessagePack."""
+
+    content_type = 'application/msgpack'
+
+    def __init__(self, info):
+        """Create the renderer; there are no options."""
+
+    def __call__(self, value, system):
+        request = system.get('request')
+        if request is not None and request.response.content_type is not None:
+            request.response.content_type = self.content_type
+        # strict types send the DateString subclass of str to the default
+        return msgpack.packb(value, strict_types=True, default=_msgpack_default)
+
+
+class CBORRenderer(object):
+    """Render a view's value as CBOR."""
+
+    content_type = 'application/cbor'
+
+    def __init__(self, info):
+        """Create the renderer; there are no options."""
+
+    def __call__(self, value, system):
+        request = system.get('request')
+        if request is not None and request.response.content_type is not None:
+            request.response.content_type = self.content_type
+        return cbor2.dumps(_with_dates(value))
+
+
+def includeme(config):
+    """
+    Add binary response formats for the installed encoding packages.
+
+    Each format gets a renderer and, for every view in ``VIEWS``, a view
+    chosen by the ``Accept`` header. JSON is preferred when the header
+    allows any of them.
+
+    """
+    formats = []
+    if msgpack is not None:
+        formats.append(('msgpack', MsgPackRenderer))
+    if cbor2 is not None:
+        formats.append(('cbor', CBORRenderer))
+
+    if not formats:
+        return
+
+    # without an Accept header, or with */*, the most preferred of the views
+    # with an accept predicate is used, so JSON gets one too
+    formats.insert(0, ('json', None))
+    for name, renderer in formats[1:]:
+        config.add_renderer(name, renderer)
+        config.add_accept_view_order(
+            renderer.content_type, weighs_less_than='application/json')
+
+    for name, renderer in formats:
+        accept = renderer.content_type if renderer else 'application/json'
+        for view, route_name, request_method in VIEWS:
+            config.add_view(
+                view,
+                route_name=route_name,
+                request_method=request_method,
+                accept=accept,
+                renderer=name,
+            )
@@ -0,0 +1,192 @@
+"""Retrying requests that failed on database contention, with backoff.
+
+pyramid_retry runs a failed request again straight away, and only when the
+error is marked retryable, which zope.sqlalchemy does for a few serialization
+failures. With ``book_api.retry`` enabled, lock and deadlock errors from the
+database are retried as well, and every retry first sleeps for a random time
+up to a limit that doubles with each attempt, so requests competing for the
+same lock spread out instead of colliding again. Routes can also be given
+their own number of attempts.
+
+A request whose connection dropped may already have been committed, so it
+is only retried when running it twice is harmless: for idempotent methods,
+and for requests with an ``Idempotency-Key`` while their responses are
+replayed.
+"""
+
+import random
+import time
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.settings import asbool
+from pyramid_retry import (
+    IBeforeRetry,
+    IRetryableError,
+    is_last_attempt,
+    mark_error_retryable,
+)
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+
+from book_api.idempotency import IDEMPOTENCY_HEADER
+from book_api.metrics import RETRIES_EXHAUSTED
+
+# methods whose requests have the same effect when run twice
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# SQLSTATE codes for serialization failures, deadlocks and lock timeouts
+RETRYABLE_SQLSTATES = frozenset(['40001', '40P01', '55P03'])
+
+# MySQL error codes for lock wait timeouts and deadlocks
+RETRYABLE_MYSQL_ERRORS = frozenset([1205, 1213])
+
+# messages of the SQLite errors raised while another connection holds a lock
+RETRYABLE_SQLITE_MESSAGES = (
+    'database is locked',
+    'database table is locked',
+    'database schema has changed',
+)
+
+
+def can_run_twice(request):
+    """Tell whether running the request again is harmless."""
+    return request.method in IDEMPOTENT_METHODS or (
+        IDEMPOTENCY_HEADER in request.headers
+        and 'idempotency_store' in request.registry)
+
+
+def is_retryable(error, request=None):
+    """Tell whether a database error came from contention and may pass on retry.
+
+    Constraint violations are never retryable, and neither is any error
+    that is not a ``DBAPIError``. A dropped connection is only retryable
+    for a given request that can run twice.
+    """
+    if not isinstance(error, DBAPIError) or isinstance(error, IntegrityError):
+        return False
+    if error.connection_invalidated:
+        return request is not None and can_run_twice(request)
+
+    orig = error.orig
+    code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    if code in RETRYABLE_SQLSTATES:
+        return True
+    args = getattr(orig, 'args', None) or (None,)
+    if args[0] in RETRYABLE_MYSQL_ERRORS:
+        return True
+    if isinstance(error, OperationalError):
+        message = str(orig).lower()
+        return any(text in message for text in RETRYABLE_SQLITE_MESSAGES)
+    return False
+
+
+class RetryPolicy(object):
+    """How many times to run a request, and how long to wait between runs."""
+
+    def __init__(self, backoff=0.01, max_backoff=0.5, route_attempts=None):
+        """Wait up to ``backoff`` seconds before the first retry.
+
+        The limit doubles with each retry up to ``max_backoff`` seconds.
+        ``route_attempts`` maps route names to their number of attempts.
+        """
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.route_attempts = route_attempts or {}
+
+    def delay(self, attempt):
+        """Get a random time to sleep before retrying the given attempt."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def attempts(self, request):
+        """Get the attempts for the route of the request, or None for the default.
+
+        This runs before the route is matched, so the route is looked up here.
+        """
+        if not self.route_attempts:
+            return None
+        mapper = request.registry.queryUtility(IRoutesMapper)
+        route = mapper(request)['route'] if mapper is not None else None
+        return self.route_attempts.get(route.name) if route is not None else None
+
+
+def activate_hook(request):
+    """Get the number of attempts for a request, for pyramid_retry."""
+    return request.registry['retry_policy'].attempts(request)
+
+
+def _back_off(retry_event):
+    """Sleep before a request is run again."""
+    policy = retry_event.request.registry['retry_policy']
+    time.sleep(policy.delay(retry_event.environ['retry.attempt']))
+
+
+def should_retry(request, error):
+    """Tell whether a view should let the error through to be retried.
+
+    Always False while ``book_api.retry`` is disabled, so that views handle
+    the error themselves.
+    """
+    return 'retry_policy' in request.registry and is_retryable(error, request)
+
+
+def _classify(request, error):
+    """Mark a contention error retryable, or count it if out of attempts."""
+    if not (is_retryable(error, request) or IRetryableError.providedBy(error)):
+        return
+    if is_last_attempt(request):
+        route = getattr(request, 'matched_route', None)
+        RETRIES_EXHAUSTED.inc((route.name if route else '', type(error).__name__))
+    else:
+        mark_error_retryable(error)
+
+
+def retry_tween_factory(handler, registry):
+    """Create a tween marking contention errors retryable.
+
+    It sits over pyramid_tm so that errors raised by the commit are seen.
+    """
+    def retry_tween(request):
+        try:
+            response = handler(request)
+        except DBAPIError as error:
+            _classify(request, error)
+            raise
+
+        error = getattr(request, 'exception', None)
+        if isinstance(error, DBAPIError):
+            _classify(request, error)
+        return response
+
+    return retry_tween
+
+
+def includeme(config):
+    """
+    Retry database contention with backoff when ``book_api.retry`` is enabled.
+
+    Set ``book_api.retry.attempts.<route name>`` to change the number of
+    attempts from ``retry.attempts`` for a single route. The policy is
+    stored as ``registry['retry_policy']``.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.retry', False)):
+        return
+
+    prefix = 'book_api.retry.attempts.'
+    route_attempts = {
+        key[len(prefix):]: int(value)
+        for key, value in settings.items() if key.startswith(prefix)
+    }
+    config.registry['retry_policy'] = RetryPolicy(
+        backoff=float(settings.get('book_api.retry.backoff_ms', 10)) / 1000,
+        max_backoff=float(settings.get('book_api.retry.max_backoff_ms', 500)) / 1000,
+        route_attempts=route_attempts,
+    )
+
+    # read by pyramid_retry when its execution policy is registered, after
+    # the includes are done
+    if route_attempts:
+        settings['retry.activate_hook'] = 'book_api.retry.activate_hook'
+    config.add_subscriber(_back_off, IBeforeRetry)
+    config.add_tween(
+        'book_api.retry.retry_tween_factory', over='pyramid_tm.tm_tween_factory')
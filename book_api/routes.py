@@ -1,4 +1,8 @@
 def includeme(config):
     config.add_route('signup', '/signup')
     config.add_route('book-list', '/books')
+    config.add_route('book-batch', '/books/batch')
+    config.add_route('book-changes', '/books/changes')
+    config.add_route('book-events', '/books/events')
     config.add_route('book-id', '/books/{id:\d+}')
+    config.add_route('book-restore', r'/books/{id:\d+}/restore')
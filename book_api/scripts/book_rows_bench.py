@@ -0,0 +1,101 @@
+"""Compare serializing a book list from Book instances and from BookRows."""
+
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+import transaction
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+    )
+from ..models.book import Book, BookRow
+from ..models.meta import Base
+from ..models.user import User
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s [rows=10000] [runs=5] [sqlalchemy.url=sqlite://]\n'
+          '(example: "%s rows=50000")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def fill(session_factory, rows):
+    """Add a user with the given number of books, returning the user id."""
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        user = User(email='bench@example.com', password='bench')
+        dbsession.add(user)
+        dbsession.flush()
+        dbsession.bulk_insert_mappings(Book, [{
+            'user_id': user.id,
+            'title': 'Book %d' % i,
+            'author': 'Author %d' % (i % 100),
+            'isbn': '978-0-%06d-0' % i,
+            'pub_date': date(2000 + i % 20, 1 + i % 12, 1 + i % 28),
+        } for i in range(rows)])
+        return user.id
+
+
+def list_with_books(dbsession, user_id):
+    """Serialize the list from full Book instances."""
+    books = dbsession.query(Book).filter(
+        Book.user_id == user_id, Book.deleted_at == None).order_by(Book.id)
+    return [book.to_json() for book in books]
+
+
+def list_with_rows(dbsession, user_id):
+    """Serialize the list from BookRows."""
+    rows = dbsession.query(*BookRow.columns).filter(
+        Book.user_id == user_id, Book.deleted_at == None).order_by(Book.id)
+    return [BookRow.from_row(row).to_json() for row in rows]
+
+
+def measure(session_factory, user_id, list_books):
+    """Time one listing and find the peak memory it allocated."""
+    dbsession = session_factory()
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = list_books(dbsession, user_id)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak, len(result)
+    finally:
+        dbsession.close()
+
+
+def main(argv=sys.argv):
+    options = parse_vars(argv[1:])
+    if 'help' in options:
+        usage(argv)
+    rows = int(options.pop('rows', 10000))
+    runs = int(options.pop('runs', 5))
+    options.setdefault('sqlalchemy.url', 'sqlite://')
+
+    engine = get_engine(options)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+    user_id = fill(session_factory, rows)
+
+    print('listing %d books, %d runs (peak memory measured with tracemalloc):'
+          % (rows, runs))
+    for name, list_books in (('Book', list_with_books), ('BookRow', list_with_rows)):
+        results = [measure(session_factory, user_id, list_books) for _ in range(runs)]
+        times = [result[0] * 1000 for result in results]
+        peaks = [result[1] / 1024.0 / 1024.0 for result in results]
+        print('  %-8s median %8.1fms  min %8.1fms  peak %7.1fMB'
+              % (name, statistics.median(times), min(times), statistics.median(peaks)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from ..models.user import pwd_context_from_settings
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [target_ms=250] [var=value]\n'
+          '(example: "%s production.ini target_ms=100")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def time_verify(handler, rounds, password='calibrate-password', repeat=3):
+    """Get the fastest time in seconds to verify a hash with the rounds."""
+    hash = handler.using(rounds=rounds).hash(password)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handler.verify(password, hash)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _ratio(elapsed, target):
+    """Get how many times slower or faster the elapsed time is than target."""
+    return max(elapsed, target) / min(elapsed, target)
+
+
+def calibrate(handler, target):
+    """Find the rounds for the handler whose verify time is closest to target.
+
+    Linear rounds are scaled from a first measurement. Log2 rounds are
+    adjusted up or down one step at a time until the time crosses the
+    target, then the rounds on either side of it are compared.
+    """
+    rounds = handler.default_rounds
+    elapsed = time_verify(handler, rounds)
+
+    if handler.rounds_cost == 'log2':
+        # each extra round doubles the cost, so step towards the target until
+        # the time crosses it and keep whichever side is closer by ratio
+        step = 1 if elapsed < target else -1
+        while handler.min_rounds <= rounds + step <= handler.max_rounds:
+            next_elapsed = time_verify(handler, rounds + step)
+            if (next_elapsed < target) != (elapsed < target):
+                if _ratio(next_elapsed, target) < _ratio(elapsed, target):
+                    return rounds + step, next_elapsed
+                break
+            rounds, elapsed = rounds + step, next_elapsed
+        return rounds, elapsed
+
+    rounds = int(rounds * target / elapsed)
+    rounds = max(handler.min_rounds, min(handler.max_rounds, rounds))
+    return rounds, time_verify(handler, rounds)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+
+    target = float(options.get('target_ms', 250)) / 1000
+    handler = pwd_context_from_settings(settings).handler()
+    if 'rounds' not in handler.setting_kwds:
+        print('%s has no rounds setting to calibrate.' % handler.name)
+        sys.exit(1)
+
+    rounds, elapsed = calibrate(handler, target)
+    print('%s verifies in %.1fms with %d rounds on this host.'
+          % (handler.name, elapsed * 1000, rounds))
+    print('Add to the [app:main] section of %s:\n' % config_uri)
+    for option in ('min_rounds', 'default_rounds', 'max_rounds'):
+        print('passlib.%s__%s = %d' % (handler.name, option, rounds))
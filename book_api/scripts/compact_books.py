@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import transaction
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import aliased
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+    )
+from ..models.book import Book
+from ..models.book_change import BookChange
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [older_than=86400]\n'
+          '       [changes_older_than=2592000] [batch_size=500]\n'
+          '       [pause=0.5] [max_seconds=0] [var=value]\n'
+          '(example: "%s production.ini batch_size=200 max_seconds=3600")'
+          % (cmd, cmd))
+    sys.exit(1)
+
+
+def _delete_in_batches(session_factory, model, criteria, batch_size, pause, deadline):
+    """Delete the rows of the model matching the criteria, in batches.
+
+    Each batch is committed in its own transaction and followed by a pause,
+    so the work is spread out instead of holding locks for a long time.
+    Stops early once the deadline (a time.monotonic value) has passed.
+
+    Returns the number of rows deleted.
+    """
+    deleted = 0
+    while deadline is None or time.monotonic() < deadline:
+        with transaction.manager:
+            dbsession = get_tm_session(session_factory, transaction.manager)
+            ids = [row_id for row_id, in dbsession.query(model.id).filter(
+                *criteria
+            ).order_by(model.id).limit(batch_size)]
+            if ids:
+                dbsession.query(model).filter(model.id.in_(ids)).delete(
+                    synchronize_session=False)
+
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
+
+
+def compact(session_factory, cutoff, batch_size=500, pause=0.5, deadline=None):
+    """Hard delete books soft deleted before the cutoff, in batches.
+
+    Returns the number of books deleted.
+    """
+    return _delete_in_batches(
+        session_factory,
+        Book,
+        (Book.deleted_at != None, Book.deleted_at < cutoff),
+        batch_size,
+        pause,
+        deadline,
+    )
+
+
+def prune_changes(session_factory, cutoff, batch_size=500, pause=0.5, deadline=None):
+    """Delete changes made before the cutoff that syncing no longer needs.
+
+    The latest change of a book that still exists is always kept, so a
+    client syncing from the start still gets every book. Older changes of
+    the same book and deletions are removed once past the cutoff.
+
+    Returns the number of changes deleted.
+    """
+    newer = aliased(BookChange)
+    superseded = exists().where(and_(
+        newer.book_id == BookChange.book_id, newer.id > BookChange.id))
+    return _delete_in_batches(
+        session_factory,
+        BookChange,
+        (BookChange.changed_at < cutoff,
+         or_(BookChange.action == 'delete', superseded)),
+        batch_size,
+        pause,
+        deadline,
+    )
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+
+    now = datetime.utcnow()
+    max_seconds = float(options.get('max_seconds', 0))
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    batch_size = int(options.get('batch_size', 500))
+    pause = float(options.get('pause', 0.5))
+
+    session_factory = get_session_factory(get_engine(settings))
+    deleted = compact(
+        session_factory,
+        now - timedelta(seconds=float(options.get('older_than', 86400))),
+        batch_size=batch_size,
+        pause=pause,
+        deadline=deadline,
+    )
+    pruned = prune_changes(
+        session_factory,
+        now - timedelta(seconds=float(options.get('changes_older_than', 2592000))),
+        batch_size=batch_size,
+        pause=pause,
+        deadline=deadline,
+    )
+    print('Removed %d deleted books and %d old changes.' % (deleted, pruned))
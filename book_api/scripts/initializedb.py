@@ -8,6 +8,7 @@ from pyramid.paster import (
     )
 
 from pyramid.scripts.common import parse_vars
+from sqlalchemy import inspect
 
 from ..models.meta import Base
 from ..models import (
@@ -24,6 +25,29 @@ def usage(argv):
     sys.exit(1)
 
 
+def upgrade(engine):
+    """Bring the tables of an existing database up to date with the models.
+
+    create_all only creates missing tables, so the nullable columns and the
+    indexes added to existing tables since, such as books.deleted_at and
+    ix_books_deleted_at, are added here.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns and column.nullable:
+                engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(engine.dialect)))
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+
+
 def main(argv=sys.argv):
     if len(argv) < 2:
         usage(argv)
@@ -33,4 +57,5 @@ def main(argv=sys.argv):
     settings = get_appsettings(config_uri, options=options)
 
     engine = get_engine(settings)
+    upgrade(engine)
     Base.metadata.create_all(engine)
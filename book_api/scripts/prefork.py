@@ -0,0 +1,330 @@
+"""Pre-forking server running several waitress workers on a shared socket.
+
+The master imports the application and configures the mappers once before
+forking, so the workers share that memory copy-on-write. Each worker builds
+its own application, and with it its own database engine, after the fork.
+
+Signals handled by the master:
+
+- ``HUP`` re-reads the configuration and starts a new set of workers. The
+  old ones are gracefully stopped once all the new ones report that they
+  are ready; if the configuration cannot be read, or a new worker exits
+  before it is ready, the old workers keep serving.
+- ``TERM`` and ``INT`` gracefully stop the workers and exit.
+
+Workers exit after ``max_requests`` requests (plus up to
+``max_requests_jitter`` more, so they do not all restart together) and are
+replaced by the master, which bounds any memory growth. Workers that exit
+before becoming ready are replaced after a delay that doubles with each
+such failure in a row, up to ``max_backoff`` seconds.
+"""
+
+import itertools
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+from plaster import get_settings
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from pyramid.scripts.common import parse_vars
+from sqlalchemy.orm import configure_mappers
+
+log = logging.getLogger(__name__)
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [workers=N] [max_requests=N] [var=value]\n'
+          '(example: "%s production.ini workers=4 max_requests=10000")' % (cmd, cmd))
+    sys.exit(1)
+
+
+class RecyclingMiddleware(object):
+    """Call ``on_limit`` once the app has started ``max_requests`` requests."""
+
+    def __init__(self, app, max_requests, on_limit):
+        """Wrap the app, counting its requests."""
+        self.app = app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self._count = itertools.count(1)
+
+    def __call__(self, environ, start_response):
+        if self.max_requests and next(self._count) == self.max_requests:
+            self.on_limit()
+        return self.app(environ, start_response)
+
+
+def bind_socket(listen):
+    """Bind and listen on a ``host:port`` address shared by the workers."""
+    host, _, port = listen.rpartition(':')
+    host = host.strip('[]')
+    if host in ('', '*'):
+        host = '0.0.0.0'
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def run_worker(sock, config_uri, settings, options, ready_fd):
+    """Serve requests from the shared socket until told to stop.
+
+    A byte is written to ``ready_fd`` once the app is built and serving.
+    """
+    import waitress
+    from waitress.wasyncore import dispatcher
+    from book_api import main as make_app
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    max_requests = int(options.get('max_requests', 0))
+    if max_requests:
+        max_requests += random.randint(0, int(options.get('max_requests_jitter', 0)))
+
+    # the engine, and so its connection pool, is created after the fork
+    app = make_app({'__file__': config_uri}, **settings)
+    server = waitress.create_server(
+        RecyclingMiddleware(app, max_requests, stop.set),
+        sockets=[sock],
+        threads=int(options.get('threads', 4)),
+    )
+    thread = threading.Thread(target=server.run, name='waitress')
+    thread.daemon = True
+    thread.start()
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+
+    while not stop.wait(1):
+        pass
+
+    # stop accepting connections, then let the open ones finish
+    server.trigger.pull_trigger(lambda: dispatcher.close(server))
+    deadline = time.monotonic() + float(options.get('graceful_timeout', 30))
+    while server.active_channels and time.monotonic() < deadline:
+        for channel in list(server.active_channels.values()):
+            if not channel.requests:
+                channel.will_close = True
+        server.trigger.pull_trigger()
+        time.sleep(0.1)
+
+    server.task_dispatcher.shutdown(cancel_pending=False)
+
+    # os._exit skips the atexit hooks, so hand over the metrics here
+    store = app.registry.get('metrics_store')
+    if store is not None:
+        store.close()
+    os._exit(0)
+
+
+class Master(object):
+    """Start, watch and replace the worker processes."""
+
+    def __init__(self, sock, config_uri, options):
+        """Prepare to run workers serving the socket."""
+        self.sock = sock
+        self.config_uri = config_uri
+        self.options = options
+        self.num_workers = int(options.get('workers', os.cpu_count() or 1))
+        self.max_backoff = float(options.get('max_backoff', 30))
+        self.workers = {}
+        self.ready = set()
+        self.ready_pipes = {}
+        self.settings = {}
+        self.generations = itertools.count()
+        self.generation = None
+        self.pending_generation = None
+        self.failures = 0
+        self.next_spawn = 0.0
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def load_settings(self):
+        """Read the application settings from the config file."""
+        return get_appsettings(self.config_uri, options=self.options)
+
+    def spawn(self, generation):
+        """Fork a single worker for the generation."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_fd)
+                run_worker(self.sock, self.config_uri, self.settings[generation],
+                           self.options, write_fd)
+            except Exception:
+                log.exception('worker %d failed', os.getpid())
+            finally:
+                os._exit(1)
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        self.workers[pid] = generation
+        self.ready_pipes[pid] = read_fd
+        log.info('started worker %d', pid)
+
+    def start_generation(self, settings):
+        """Start a full set of workers with the settings, returning its number."""
+        generation = next(self.generations)
+        self.settings[generation] = settings
+        for _ in range(self.num_workers):
+            self.spawn(generation)
+        return generation
+
+    def stop_workers(self, generation=None):
+        """Gracefully stop the workers, or those of a single generation."""
+        for pid, worker_generation in list(self.workers.items()):
+            if generation is None or worker_generation == generation:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    self.workers.pop(pid, None)
+
+    def check_ready(self, pids=None):
+        """Note the workers, or the given ones, that have reported they are ready."""
+        for pid in list(self.ready_pipes if pids is None else pids):
+            fd = self.ready_pipes.get(pid)
+            if fd is None:
+                continue
+            try:
+                data = os.read(fd, 1)
+            except BlockingIOError:
+                continue
+            os.close(fd)
+            del self.ready_pipes[pid]
+            if data:
+                self.ready.add(pid)
+                self.failures = 0
+
+    def reap(self):
+        """Forget workers that have exited, returning how many there were."""
+        reaped = 0
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return reaped
+            if pid == 0:
+                return reaped
+            self.check_ready([pid])
+            generation = self.workers.pop(pid, None)
+            fd = self.ready_pipes.pop(pid, None)
+            if fd is not None:
+                os.close(fd)
+            log.info('worker %d exited with status %d', pid, status)
+            reaped += 1
+            if pid in self.ready:
+                self.ready.discard(pid)
+            elif generation in self.settings:
+                # workers of a generation being stopped are not failures
+                self.worker_failed(generation)
+
+    def worker_failed(self, generation):
+        """Back off from replacing workers that exit before they are ready."""
+        self.failures += 1
+        delay = min(self.max_backoff, 0.5 * 2 ** (self.failures - 1))
+        self.next_spawn = time.monotonic() + delay
+        log.error('worker exited before it was ready, waiting %.1fs to replace it', delay)
+        if generation is not None and generation == self.pending_generation:
+            log.error('reload failed, keeping the current workers')
+            self.stop_workers(generation)
+            del self.settings[generation]
+            self.pending_generation = None
+
+    def reload(self):
+        """Start workers with fresh settings, keeping the old ones until they are ready."""
+        self.reload_requested = False
+        if self.pending_generation is not None:
+            log.warning('a reload is already in progress')
+            return
+        try:
+            settings = self.load_settings()
+        except Exception:
+            log.exception('could not read the settings, keeping the current workers')
+            return
+        self.pending_generation = self.start_generation(settings)
+
+    def finish_reload(self):
+        """Stop the old workers once every new worker is ready."""
+        if self.pending_generation is None:
+            return
+        new = [pid for pid, generation in self.workers.items()
+               if generation == self.pending_generation]
+        if len(new) < self.num_workers or not self.ready.issuperset(new):
+            return
+        self.stop_workers(self.generation)
+        del self.settings[self.generation]
+        self.generation, self.pending_generation = self.pending_generation, None
+
+    def replace_workers(self):
+        """Replace the workers of the current generation that have exited."""
+        if time.monotonic() < self.next_spawn:
+            return
+        current = [g for g in self.workers.values() if g == self.generation]
+        for _ in range(self.num_workers - len(current)):
+            self.spawn(self.generation)
+
+    def step(self):
+        """Do one round of watching the workers."""
+        if self.reload_requested:
+            self.reload()
+        self.check_ready()
+        self.reap()
+        self.finish_reload()
+        self.replace_workers()
+
+    def run(self):
+        """Run the workers until the master is told to stop."""
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.request_reload())
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.request_stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.request_stop())
+
+        self.generation = self.start_generation(self.load_settings())
+
+        while not self.stop_requested:
+            self.step()
+            time.sleep(0.5)
+
+        self.stop_workers()
+        while self.workers:
+            self.reap()
+            time.sleep(0.1)
+
+    def request_reload(self):
+        self.reload_requested = True
+
+    def request_stop(self):
+        self.stop_requested = True
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    setup_logging(config_uri)
+
+    # import the models and set up the mappers once, shared by all workers
+    import book_api.models  # flake8: noqa
+    configure_mappers()
+
+    server_settings = get_settings(config_uri, 'server:main')
+    listen = options.get('listen') or server_settings.get('listen', '*:6543')
+    options.setdefault('threads', server_settings.get('threads', 4))
+    sock = bind_socket(listen.split()[0])
+    log.info('listening on %s', listen)
+
+    Master(sock, config_uri, options).run()
@@ -0,0 +1,104 @@
+"""Compare building the hot queries with Query objects and baked queries."""
+
+import os
+import sys
+import time
+
+import transaction
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+    )
+from ..models import queries
+from ..models.book import Book, BookRow
+from ..models.meta import Base
+from ..models.user import User
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s [iterations=5000] [sqlalchemy.url=sqlite://]\n'
+          '(example: "%s iterations=20000")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def fill(session_factory):
+    """Add a user with a few books, returning the email, user id and a book id."""
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        user = User(email='bench@example.com', password='bench')
+        books = [Book(user=user, title='Book %d' % i) for i in range(10)]
+        dbsession.add_all([user] + books)
+        dbsession.flush()
+        return user.email, user.id, books[0].id
+
+
+def query_user(dbsession, email, user_id, book_id):
+    return dbsession.query(User).filter_by(email=email).first()
+
+
+def query_book(dbsession, email, user_id, book_id):
+    return dbsession.query(*BookRow.columns).filter(
+        Book.id == book_id, Book.user_id == user_id, Book.deleted_at == None).first()
+
+
+def query_list(dbsession, email, user_id, book_id):
+    return dbsession.query(*BookRow.columns).filter(
+        Book.user_id == user_id, Book.deleted_at == None).order_by(Book.id).all()
+
+
+def baked_user(dbsession, email, user_id, book_id):
+    return queries.user_by_email(dbsession, email)
+
+
+def baked_book(dbsession, email, user_id, book_id):
+    return queries.owned_book_row(dbsession, user_id, book_id)
+
+
+def baked_list(dbsession, email, user_id, book_id):
+    return queries.book_rows_for_user(dbsession, user_id)
+
+
+def measure(session_factory, run_query, args, iterations):
+    """Get the average time of one query, in microseconds."""
+    dbsession = session_factory()
+    try:
+        run_query(dbsession, *args)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            run_query(dbsession, *args)
+            dbsession.expunge_all()
+        return (time.perf_counter() - started) / iterations * 1e6
+    finally:
+        dbsession.close()
+
+
+def main(argv=sys.argv):
+    options = parse_vars(argv[1:])
+    if 'help' in options:
+        usage(argv)
+    iterations = int(options.pop('iterations', 5000))
+    options.setdefault('sqlalchemy.url', 'sqlite://')
+
+    engine = get_engine(options)
+    Base.metadata.create_all(engine)
+    session_factory = get_session_factory(engine)
+    args = fill(session_factory)
+
+    print('average time per query over %d iterations:' % iterations)
+    for name, plain, baked in (
+            ('user by email', query_user, baked_user),
+            ('book by id', query_book, baked_book),
+            ('book list', query_list, baked_list)):
+        plain_time = measure(session_factory, plain, args, iterations)
+        baked_time = measure(session_factory, baked, args, iterations)
+        print('  %-14s Query %7.1fus  baked %7.1fus  (%.0f%% less)'
+              % (name, plain_time, baked_time, 100 * (1 - baked_time / plain_time)))
+
+
+if __name__ == '__main__':
+    main()
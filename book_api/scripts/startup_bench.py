@@ -0,0 +1,81 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [runs=5] [var=value]\n'
+          '(example: "%s production.ini runs=10")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def child(config_uri, started, options):
+    """Load the app and serve one signup, reporting when each step ended.
+
+    Runs in a fresh interpreter, so the imports are measured from cold.
+    """
+    from pyramid.paster import get_app
+    imported = time.time()
+
+    app = get_app(config_uri, options=options)
+    loaded = time.time()
+
+    # the first request signs up a user, which hashes a password and so loads
+    # the password handlers; its transaction is aborted, so nothing is stored
+    import transaction
+    from webob import Request
+    manager = transaction.TransactionManager(explicit=True)
+    request = Request.blank('/signup', POST={
+        'email': 'startup-bench@example.com',
+        'password': 'startup-bench',
+    }, environ={'tm.active': True, 'tm.manager': manager})
+    manager.begin()
+    try:
+        request.get_response(app)
+    finally:
+        manager.abort()
+    served = time.time()
+
+    print(json.dumps({
+        'startup': imported - started,
+        'app': loaded - imported,
+        'first_request': served - loaded,
+        'total': served - started,
+    }))
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    if argv[1] == '--child':
+        from pyramid.scripts.common import parse_vars
+        child(argv[2], float(argv[3]), parse_vars(argv[4:]))
+        return
+
+    from pyramid.scripts.common import parse_vars
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    runs = int(options.pop('runs', 5))
+    extra = ['%s=%s' % item for item in options.items()]
+
+    results = []
+    for _ in range(runs):
+        started = time.time()
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'book_api.scripts.startup_bench',
+             '--child', config_uri, repr(started)] + extra)
+        results.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    print('time from process start to first served request, %d runs:' % runs)
+    for step in ('startup', 'app', 'first_request', 'total'):
+        times = [result[step] * 1000 for result in results]
+        print('  %-14s median %7.1fms  min %7.1fms'
+              % (step, statistics.median(times), min(times)))
+
+
+if __name__ == '__main__':
+    main()
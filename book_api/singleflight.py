@@ -0,0 +1,94 @@
+"""Sharing the work of identical reads that run at the same time.
+
+When several devices of a user sync at once, they ask for the same list at
+the same moment. With ``book_api.singleflight`` enabled, the first of those
+requests runs the query and serializes the books, and the others wait for it
+and share its result instead of repeating the work.
+
+Nothing is kept once the first request is done, so this is not a cache.
+The keys include the newest change log token of the user, so a request that
+starts after a change has committed never shares a result read before it.
+"""
+
+import threading
+
+from pyramid.settings import asbool
+
+from book_api.metrics import record_cache_lookup
+
+
+class _Call(object):
+    """A call in progress, waited on by the callers sharing it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight(object):
+    """Run a function once for all the concurrent callers with the same key."""
+
+    def __init__(self, timeout=5.0):
+        """Make callers wait up to ``timeout`` seconds for a shared call."""
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Get the result of ``fn()``, sharing a call already running for the key.
+
+        A caller that waits longer than the timeout runs ``fn`` itself, and
+        so does a caller whose shared call failed, as the error may be the
+        leader's own, such as its request running out of time.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        record_cache_lookup('singleflight', not leader)
+
+        if not leader:
+            if not call.done.wait(self.timeout) or call.failed:
+                return fn()
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception:
+            call.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def coalesce(request, make_key, fn):
+    """Get the result of ``fn()``, shared with identical concurrent requests.
+
+    Calls ``fn`` directly when single-flight is not enabled. Otherwise the
+    key comes from ``make_key()``, so a key that needs a query to build only
+    costs that query when it is used.
+    """
+    flight = request.registry.get('singleflight')
+    if flight is None:
+        return fn()
+    return flight.do(make_key(), fn)
+
+
+def includeme(config):
+    """
+    Share identical concurrent reads when ``book_api.singleflight`` is enabled.
+
+    The SingleFlight is stored as ``registry['singleflight']``.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.singleflight', False)):
+        return
+
+    config.registry['singleflight'] = SingleFlight(
+        timeout=float(settings.get('book_api.singleflight.timeout', 5)))
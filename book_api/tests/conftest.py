@@ -12,20 +12,25 @@ from book_api.models.book import Book
 from book_api.models.meta import Base
 from book_api.models.user import User
 
-BASE_DIR = os.path.dirname(
-    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-)
-
-TEST_DATABASE = 'sqlite:///{}/test_book_api.sqlite'.format(BASE_DIR)
+# set TEST_DATABASE to a PostgreSQL URL to also run the PostgreSQL tests
+TEST_DATABASE = os.environ.get('TEST_DATABASE')
 
 FAKE = Faker()
 
 
 @pytest.fixture(scope='session')
-def configuration(request):
+def test_database(tmp_path_factory):
+    """Get the URL of the test database, a new SQLite file by default."""
+    if TEST_DATABASE:
+        return TEST_DATABASE
+    return 'sqlite:///{}'.format(tmp_path_factory.mktemp('db') / 'test_book_api.sqlite')
+
+
+@pytest.fixture(scope='session')
+def configuration(request, test_database):
     """Set up a database for testing purposes."""
     config = testing.setUp(settings={
-        'sqlalchemy.url': TEST_DATABASE
+        'sqlalchemy.url': test_database
     })
     config.include('book_api.models')
     config.include("book_api.routes")
@@ -60,12 +65,12 @@ def dummy_request(db_session):
 
 
 @pytest.fixture(scope="session")
-def testapp(request):
+def testapp(request, test_database):
     """Create a test wsgi app for route tests."""
     from webtest import TestApp
     from book_api import main
 
-    app = main({}, **{'sqlalchemy.url': TEST_DATABASE})
+    app = main({}, **{'sqlalchemy.url': test_database})
 
     SessionFactory = app.registry["dbsession_factory"]
     engine = SessionFactory().bind
@@ -79,6 +84,37 @@ def testapp(request):
     return TestApp(app)
 
 
+@pytest.fixture(scope='session')
+def make_testapp():
+    """Get a factory for test apps on fresh in-memory databases.
+
+    ``make_testapp(**settings)`` creates the app with the given settings
+    and signs up a user, returning the TestApp and the user's credentials.
+    The user's id is kept as ``testapp.user_id``. Pass ``signup=False`` to
+    skip the signup, which gives None for the credentials.
+    """
+    from webtest import TestApp
+    from book_api import main
+
+    def make_testapp(signup=True, **settings):
+        app = main({}, **dict({'sqlalchemy.url': 'sqlite://'}, **settings))
+        Base.metadata.create_all(bind=app.registry['db_engine'])
+        testapp = TestApp(app)
+        if not signup:
+            return testapp, None
+
+        data = {
+            'first_name': FAKE.first_name(),
+            'last_name': FAKE.last_name(),
+            'email': FAKE.email(),
+            'password': 'password'
+        }
+        testapp.user_id = testapp.post('/signup', data).json['id']
+        return testapp, {'email': data['email'], 'password': 'password'}
+
+    return make_testapp
+
+
 @pytest.fixture
 def testapp_session(testapp, request):
     """Create a session to interact with the database."""
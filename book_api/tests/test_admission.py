@@ -0,0 +1,136 @@
+"""Tests for admission control and load shedding."""
+
+import pytest
+from pyramid.request import Request
+
+from book_api.admission import (
+    AUTH,
+    CHEAP,
+    WRITE,
+    AdmissionController,
+    classify,
+    queue_wait,
+)
+from book_api.metrics import SHED
+
+
+@pytest.fixture
+def testapp(make_testapp):
+    """Create a test app admitting four requests at a time, one of them a write."""
+    testapp, credentials = make_testapp(**{
+        'book_api.admission': 'true',
+        'book_api.admission.max_in_flight': '4',
+        'book_api.admission.write_share': '0.25',
+        'book_api.admission.max_queue_wait_ms': '1000',
+    })
+    testapp.credentials = credentials
+    testapp.controller = testapp.app.registry['admission_controller']
+    return testapp
+
+
+CREDENTIALS = 'email=a@example.com&password=secret'
+
+
+@pytest.mark.parametrize('method, path, body, kind', [
+    ('GET', '/metrics', None, CHEAP),
+    ('GET', '/nowhere', None, CHEAP),
+    ('GET', '/books', None, CHEAP),
+    ('POST', '/signup', 'email=a@example.com', CHEAP),
+    ('GET', '/books?' + CREDENTIALS, None, AUTH),
+    ('GET', '/books/1?' + CREDENTIALS, None, AUTH),
+    ('POST', '/books/batch', CREDENTIALS + '&ids=1', AUTH),
+    ('POST', '/signup', CREDENTIALS, WRITE),
+    ('POST', '/books', CREDENTIALS + '&title=Dune', WRITE),
+    ('DELETE', '/books/1', CREDENTIALS, WRITE),
+])
+def test_requests_are_classified_by_cost(testapp, method, path, body, kind):
+    """Test that requests are sorted by whether they check a password and write."""
+    request = Request.blank(path, method=method, POST=body)
+    request.method = method
+    request.registry = testapp.app.registry
+    assert classify(request) == kind
+
+
+def test_max_in_flight_defaults_below_the_server_threads(make_testapp):
+    """Test that some threads are left to answer shed requests."""
+    testapp, _ = make_testapp(signup=False, **{
+        'book_api.admission': 'true',
+        'book_api.threads': '16',
+    })
+    controller = testapp.app.registry['admission_controller']
+    assert controller.limits == {CHEAP: 12, AUTH: 9, WRITE: 6}
+
+
+def test_open_streams_count_against_the_limit(make_testapp):
+    """Test that requests are refused while event streams hold the threads."""
+    testapp, _ = make_testapp(signup=False, **{
+        'book_api.admission': 'true',
+        'book_api.admission.max_in_flight': '2',
+        'book_api.events': 'true',
+    })
+    controller = testapp.app.registry['admission_controller']
+    bus = testapp.app.registry['event_bus']
+    subscriptions = [bus.subscribe(1), bus.subscribe(2)]
+    try:
+        assert not controller.try_acquire(CHEAP)
+        testapp.get('/nowhere', status=503)
+    finally:
+        for subscription in subscriptions:
+            bus.unsubscribe(subscription)
+    assert controller.try_acquire(CHEAP)
+
+
+@pytest.mark.parametrize('header', [
+    't=1700000000.5', '1700000000.5', '1700000000500', 't=1700000000500000',
+])
+def test_queue_wait_reads_all_header_units(header):
+    """Test that seconds, milliseconds and microseconds are understood."""
+    request = Request.blank('/', headers={'X-Request-Start': header})
+    assert queue_wait(request, now=1700000001.0) == pytest.approx(0.5)
+
+
+def test_queue_wait_is_none_without_a_valid_header():
+    """Test that a missing or broken header gives no wait."""
+    assert queue_wait(Request.blank('/')) is None
+    assert queue_wait(Request.blank('/', headers={'X-Request-Start': 'soon'})) is None
+
+
+def test_writes_and_auth_reads_only_get_their_share():
+    """Test that expensive classes are refused while cheap requests still fit."""
+    controller = AdmissionController(max_in_flight=10, auth_share=0.8, write_share=0.6)
+    assert all(controller.try_acquire(WRITE) for _ in range(6))
+    assert not controller.try_acquire(WRITE)
+    assert all(controller.try_acquire(AUTH) for _ in range(2))
+    assert not controller.try_acquire(AUTH)
+    assert all(controller.try_acquire(CHEAP) for _ in range(2))
+    assert not controller.try_acquire(CHEAP)
+
+    controller.release()
+    assert controller.try_acquire(CHEAP)
+
+
+def test_write_over_its_share_is_shed_with_503(testapp):
+    """Test that a write is shed while the write slots are taken."""
+    data = testapp.credentials
+    before = SHED._merged().get((WRITE, 'in_flight'), 0)
+
+    assert testapp.controller.try_acquire(WRITE)
+    try:
+        res = testapp.post('/books', dict(data, title='Dune'), status=503)
+        assert res.json['status'] == 503
+        assert res.headers['Retry-After'] == '1'
+        assert SHED._merged()[(WRITE, 'in_flight')] == before + 1
+
+        testapp.get('/books', data, status=200)
+    finally:
+        testapp.controller.release()
+    assert testapp.controller.in_flight == 0
+
+
+def test_request_that_waited_too_long_is_shed(testapp):
+    """Test that a request queued longer than the limit is shed."""
+    import time
+
+    started = '%.3f' % (time.time() - 5)
+    res = testapp.get('/books', headers={'X-Request-Start': started}, status=503)
+    assert res.json['status'] == 503
@@ -0,0 +1,84 @@
+"""Tests for the ASGI entry point."""
+
+import asyncio
+from urllib.parse import urlencode
+
+import pytest
+
+from book_api.asgi import build_environ, make_asgi_app
+from book_api.models.meta import Base
+from book_api.tests.conftest import FAKE
+
+
+@pytest.fixture(scope='module')
+def asgi_app(tmpdir_factory):
+    """Create the ASGI app backed by a fresh database."""
+    path = tmpdir_factory.mktemp('asgi').join('book_api.sqlite')
+    app = make_asgi_app({}, **{'sqlalchemy.url': 'sqlite:///{}'.format(path)})
+    Base.metadata.create_all(bind=app.wsgi_app.registry['db_engine'])
+    return app
+
+
+def call(app, method, path, query='', body=b'', headers=()):
+    """Send a single request to the ASGI app, returning status and body."""
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query.encode('latin-1'),
+        'headers': [(name.encode(), value.encode()) for name, value in headers],
+        'client': ('127.0.0.1', 5000),
+        'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    return sent[0]['status'], body
+
+
+def test_build_environ_maps_scope_to_wsgi_keys():
+    """Test that the ASGI scope is translated into a WSGI environ."""
+    scope = {
+        'method': 'GET',
+        'path': '/books',
+        'query_string': b'email=a',
+        'headers': [(b'content-type', b'text/plain'), (b'x-thing', b'1')],
+        'client': ('1.2.3.4', 1234),
+    }
+    environ = build_environ(scope, b'')
+    assert environ['REQUEST_METHOD'] == 'GET'
+    assert environ['PATH_INFO'] == '/books'
+    assert environ['QUERY_STRING'] == 'email=a'
+    assert environ['CONTENT_TYPE'] == 'text/plain'
+    assert environ['HTTP_X_THING'] == '1'
+    assert environ['REMOTE_ADDR'] == '1.2.3.4'
+
+
+def test_asgi_app_serves_signup_and_book_list(asgi_app):
+    """Test that the ASGI app serves the same routes as the WSGI app."""
+    data = {
+        'email': FAKE.email(),
+        'password': 'password'
+    }
+    status, _ = call(
+        asgi_app, 'POST', '/signup', body=urlencode(data).encode(),
+        headers=[('content-type', 'application/x-www-form-urlencoded')])
+    assert status == 201
+
+    status, body = call(asgi_app, 'GET', '/books', query=urlencode(data))
+    assert status == 200
+    assert body == b'[]'
+
+
+def test_asgi_app_rejects_bodies_over_the_limit(asgi_app):
+    """Test that request bodies over the size limit get a 413."""
+    status, _ = call(asgi_app, 'POST', '/signup', body=b'x' * (asgi_app.max_body_size + 1))
+    assert status == 413
@@ -0,0 +1,100 @@
+"""Tests for response compression."""
+
+import gzip
+import zlib
+
+import pytest
+from webob import Request
+
+from book_api.compression import CompressedCache, Compressor
+from book_api.metrics import CACHE_REQUESTS
+from book_api.tests.conftest import FAKE
+
+
+@pytest.fixture(scope='module')
+def compressing_app(make_testapp):
+    """Create a test app compressing bodies of 100 bytes or more."""
+    testapp, credentials = make_testapp(**{
+        'book_api.compression': 'true',
+        'book_api.compression.min_size': '100',
+    })
+    testapp.credentials = credentials
+    for _ in range(5):
+        testapp.post('/books', dict(testapp.credentials, title=FAKE.sentence()))
+    return testapp
+
+
+def get_raw(testapp, path, params, headers):
+    """Get a response without WebTest decoding its content."""
+    request = Request.blank(path, POST=None, headers=headers)
+    request.GET.update(params)
+    return request.get_response(testapp.app)
+
+
+def test_list_is_gzipped_when_accepted(compressing_app):
+    """Test that a large body is gzipped for a client accepting gzip."""
+    res = get_raw(
+        compressing_app, '/books', compressing_app.credentials,
+        {'Accept-Encoding': 'gzip'})
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in res.headers['Vary']
+    assert gzip.decompress(res.body).startswith(b'[{')
+
+
+def test_list_uses_deflate_when_only_deflate_is_accepted(compressing_app):
+    """Test that deflate is used when gzip is not accepted."""
+    res = get_raw(
+        compressing_app, '/books', compressing_app.credentials,
+        {'Accept-Encoding': 'deflate, gzip;q=0'})
+    assert res.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(res.body).startswith(b'[{')
+
+
+def test_response_is_not_compressed_without_accept_encoding(compressing_app):
+    """Test that a client not asking for compression gets plain JSON."""
+    res = compressing_app.get('/books', compressing_app.credentials)
+    assert 'Content-Encoding' not in res.headers
+    assert len(res.json) == 5
+
+
+def test_small_body_is_not_compressed(compressing_app):
+    """Test that bodies under the minimum size are left alone."""
+    res = compressing_app.get(
+        '/books', {'email': 'nobody@example.com', 'password': 'password'},
+        headers={'Accept-Encoding': 'gzip'}, status=403)
+    assert 'Content-Encoding' not in res.headers
+
+
+def test_unchanged_body_is_compressed_once(compressing_app):
+    """Test that a repeated body is served from the compressed cache."""
+    hits = ('compression', 'hit')
+    compressing_app.get(
+        '/books', compressing_app.credentials,
+        headers={'Accept-Encoding': 'gzip'})
+    before = CACHE_REQUESTS._merged().get(hits, 0)
+    compressing_app.get(
+        '/books', compressing_app.credentials,
+        headers={'Accept-Encoding': 'gzip'})
+    assert CACHE_REQUESTS._merged()[hits] == before + 1
+
+
+def test_compressor_output_is_decodable_after_each_chunk():
+    """Test that each compressed chunk can be decoded before the end."""
+    compressor = Compressor('gzip')
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decoder.decompress(compressor.compress(b'data: one\n\n')) == b'data: one\n\n'
+    assert decoder.decompress(compressor.compress(b'data: two\n\n')) == b'data: two\n\n'
+    decoder.decompress(compressor.finish())
+    assert decoder.eof
+
+
+def test_compressed_cache_evicts_least_recently_used():
+    """Test that the cache stays within its size by evicting old entries."""
+    cache = CompressedCache(max_bytes=10)
+    cache.set('a', b'12345')
+    cache.set('b', b'12345')
+    cache.get('a')
+    cache.set('c', b'12345')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'12345'
+    assert cache.size == 10
@@ -0,0 +1,80 @@
+"""Tests for request deadlines."""
+
+import pytest
+from pyramid.httpexceptions import HTTPServiceUnavailable
+
+from book_api.deadline import Deadline
+from book_api.models.user import User
+from book_api.tests.conftest import FAKE
+from book_api.views.books import validate_user
+
+# a query running for many seconds unless it is stopped
+SLOW_QUERY = (
+    'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT 100000000) '
+    'SELECT count(*) FROM c'
+)
+
+
+def test_deadline_check_raises_503_once_expired():
+    """Test that checking an expired deadline raises a 503 with Retry-After."""
+    Deadline(60).check()
+    with pytest.raises(HTTPServiceUnavailable) as excinfo:
+        Deadline(0).check()
+    assert excinfo.value.headers['Retry-After'] == '1'
+
+
+def test_validate_user_checks_deadline_before_verifying(dummy_request, monkeypatch):
+    """Test that no password is verified for a request out of time."""
+    user = User(email=FAKE.email(), password='password')
+    dummy_request.dbsession.add(user)
+    dummy_request.dbsession.flush()
+    dummy_request.deadline = Deadline(0)
+    monkeypatch.setattr(User, 'verify_and_update', lambda *args: pytest.fail('verified'))
+
+    with pytest.raises(HTTPServiceUnavailable):
+        validate_user(
+            dummy_request.dbsession,
+            {'email': user.email, 'password': 'password'},
+            dummy_request,
+        )
+
+
+def test_route_timeout_gives_signup_503(make_testapp):
+    """Test that a route's own timeout applies and gives a JSON 503."""
+    testapp, _ = make_testapp(signup=False, **{
+        'book_api.deadline': 'true',
+        'book_api.deadline.timeout_ms.signup': '0',
+    })
+    res = testapp.post(
+        '/signup', {'email': FAKE.email(), 'password': 'password'}, status=503)
+    assert res.json['status'] == 503
+    assert res.headers['Retry-After'] == '1'
+
+
+def test_keyed_request_gets_the_timeout_of_its_route(make_testapp):
+    """Test that a query made before routing does not fix the deadline early."""
+    testapp, _ = make_testapp(signup=False, **{
+        'book_api.deadline': 'true',
+        'book_api.deadline.timeout_ms': '0',
+        'book_api.deadline.timeout_ms.signup': '60000',
+        'book_api.idempotency': 'true',
+    })
+    data = {'email': FAKE.email(), 'password': 'password'}
+    testapp.post('/signup', data, headers={'Idempotency-Key': 'abc'}, status=201)
+
+
+def test_slow_statement_is_stopped_at_the_deadline(make_testapp, monkeypatch):
+    """Test that a statement running past the deadline is stopped with a 503."""
+    testapp, data = make_testapp(**{
+        'book_api.deadline': 'true',
+        'book_api.deadline.timeout_ms.book-list': '200',
+    })
+    monkeypatch.setattr(
+        'book_api.views.books.book_rows_for_user',
+        lambda dbsession, user_id: dbsession.execute(SLOW_QUERY).fetchall())
+
+    res = testapp.get('/books', data, status=503)
+    assert res.json['status'] == 503
+
+    monkeypatch.undo()
+    assert testapp.get('/books', data).json == []
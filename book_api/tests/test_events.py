@@ -0,0 +1,128 @@
+"""Tests for publishing book changes to event streams."""
+
+import pytest
+
+from book_api.events import EventBus, format_event
+
+
+@pytest.fixture(scope='module')
+def events_app(make_testapp):
+    """Create a test app with events enabled and short lived streams."""
+    testapp, credentials = make_testapp(**{
+        'book_api.events': 'true',
+        'book_api.events.max_subscribers': '2',
+        'book_api.events.heartbeat': '0.05',
+        'book_api.events.max_duration': '0.2',
+    })
+    testapp.credentials = credentials
+    return testapp
+
+
+def test_bus_delivers_events_to_the_users_subscriptions():
+    """Test that published events only reach the user's subscriptions."""
+    bus = EventBus()
+    mine = bus.subscribe(1)
+    other = bus.subscribe(2)
+    bus.publish(1, {'token': 1})
+    assert mine.get(timeout=0) == {'token': 1}
+    assert other.get(timeout=0) is None
+
+
+def test_bus_limits_the_number_of_subscriptions():
+    """Test that subscribe returns None once the limit is reached."""
+    bus = EventBus(max_subscribers=1)
+    subscription = bus.subscribe(1)
+    assert bus.subscribe(1) is None
+    bus.unsubscribe(subscription)
+    assert bus.subscribe(1) is not None
+
+
+def test_full_subscription_drops_events_and_asks_for_resync():
+    """Test that a subscription that falls behind gets a single resync."""
+    bus = EventBus(queue_size=2)
+    subscription = bus.subscribe(1)
+    for token in range(5):
+        bus.publish(1, {'token': token})
+    assert subscription.get(timeout=0) == 'resync'
+    assert subscription.get(timeout=0) is None
+    bus.publish(1, {'token': 5})
+    assert subscription.get(timeout=0) == {'token': 5}
+
+
+def test_format_event_uses_token_as_event_id():
+    """Test that an event with a token has it as its id."""
+    assert format_event({'token': 3}) == b'id: 3\nevent: book\ndata: {"token": 3}\n\n'
+
+
+def test_created_book_is_published_after_commit(events_app):
+    """Test that creating a book publishes it to the user's streams."""
+    bus = events_app.app.registry['event_bus']
+    subscription = bus.subscribe(events_app.user_id)
+    try:
+        data = dict(events_app.credentials, title='Dune')
+        res = events_app.post('/books', data)
+        event = subscription.get(timeout=1)
+    finally:
+        bus.unsubscribe(subscription)
+    assert event['action'] == 'create'
+    assert event['id'] == res.json['id']
+    assert event['book']['title'] == 'Dune'
+
+
+def test_failed_request_publishes_nothing(events_app):
+    """Test that a rejected book is not published."""
+    bus = events_app.app.registry['event_bus']
+    subscription = bus.subscribe(events_app.user_id)
+    try:
+        data = dict(events_app.credentials, pub_date='not a date', title='Dune')
+        events_app.post('/books', data, status=400)
+        event = subscription.get(timeout=0)
+    finally:
+        bus.unsubscribe(subscription)
+    assert event is None
+
+
+def test_event_stream_sends_heartbeats(events_app):
+    """Test that an idle stream sends keepalive comments until it ends."""
+    res = events_app.get('/books/events', events_app.credentials)
+    assert res.content_type == 'text/event-stream'
+    assert res.body.startswith(b'retry: 1000\n\n')
+    assert b': keepalive\n\n' in res.body
+
+
+def test_event_stream_is_refused_when_too_many_are_open(events_app):
+    """Test that a 503 is returned once the stream limit is reached."""
+    bus = events_app.app.registry['event_bus']
+    subscriptions = [bus.subscribe(1), bus.subscribe(1)]
+    try:
+        res = events_app.get('/books/events', events_app.credentials, status=503)
+    finally:
+        for subscription in subscriptions:
+            bus.unsubscribe(subscription)
+    assert res.json['status'] == 503
+
+
+def test_stream_that_never_starts_leaves_no_subscription():
+    """Test that the subscription is only made once the stream is iterated."""
+    from book_api.events import stream_events
+
+    bus = EventBus(max_subscribers=1)
+    stream = stream_events(bus, 1, heartbeat=0.01, max_duration=0.05)
+    stream.close()
+    assert not bus.full
+
+    stream = stream_events(bus, 1, heartbeat=0.01, max_duration=0.05)
+    assert next(stream) == b'retry: 1000\n\n'
+    next(stream)
+    assert bus.full
+    stream.close()
+    assert not bus.full
+
+
+def test_max_subscribers_defaults_to_half_the_threads(make_testapp):
+    """Test that streams may only take half of the server threads by default."""
+    testapp, _ = make_testapp(signup=False, **{
+        'book_api.events': 'true',
+        'book_api.threads': '16',
+    })
+    assert testapp.app.registry['event_bus'].max_subscribers == 8
@@ -0,0 +1,120 @@
+"""Tests for replaying responses to requests with an Idempotency-Key."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from book_api.models.idempotency_key import IdempotencyKey
+from book_api.models.user import User
+from book_api.tests.conftest import FAKE
+
+
+@pytest.fixture
+def testapp(make_testapp):
+    """Create a test app replaying responses for an hour, with a user."""
+    testapp, credentials = make_testapp(**{
+        'book_api.idempotency': 'true',
+        'book_api.idempotency.ttl': '3600',
+    })
+    testapp.data = credentials
+    return testapp
+
+
+@pytest.fixture
+def app(testapp):
+    """Get the app under the test app."""
+    return testapp.app
+
+
+def _count(app, model):
+    """Count the rows of the model in the app's database."""
+    dbsession = app.registry['dbsession_factory']()
+    try:
+        return dbsession.query(model).count()
+    finally:
+        dbsession.close()
+
+
+def test_repeated_create_is_replayed(app, testapp):
+    """Test that a repeated POST /books gets the first response back."""
+    from book_api.models.book import Book
+
+    headers = {'Idempotency-Key': 'abc'}
+    data = dict(testapp.data, title='Dune')
+    first = testapp.post('/books', data, headers=headers, status=201)
+    second = testapp.post('/books', data, headers=headers, status=201)
+
+    assert second.json == first.json
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert _count(app, Book) == 1
+
+
+def test_repeated_signup_is_replayed_without_running_the_view(app, testapp, monkeypatch):
+    """Test that a repeated signup does not run the view again."""
+    headers = {'Idempotency-Key': 'signup-1'}
+    data = {'email': FAKE.email(), 'password': 'password'}
+    first = testapp.post('/signup', data, headers=headers, status=201)
+
+    # running the view again would fail on creating the User
+    monkeypatch.setattr('book_api.views.users.User', None)
+    second = testapp.post('/signup', data, headers=headers, status=201)
+    assert second.json == first.json
+    assert _count(app, User) == 2
+
+
+def test_key_reused_for_a_different_request_is_rejected(testapp):
+    """Test that the same key with a different body gets a 422."""
+    headers = {'Idempotency-Key': 'abc'}
+    testapp.post('/books', dict(testapp.data, title='Dune'), headers=headers)
+    res = testapp.post(
+        '/books', dict(testapp.data, title='Emma'), headers=headers, status=422)
+    assert res.json['status'] == 422
+
+
+def test_keys_are_scoped_to_the_email(testapp):
+    """Test that another user sending the same key gets their own response."""
+    other = {'email': FAKE.email(), 'password': 'password'}
+    testapp.post('/signup', other)
+    headers = {'Idempotency-Key': 'abc'}
+    mine = testapp.post('/books', dict(testapp.data, title='Dune'), headers=headers)
+    theirs = testapp.post('/books', dict(other, title='Dune'), headers=headers)
+    assert mine.json['id'] != theirs.json['id']
+
+
+def test_failed_requests_are_not_stored(app, testapp):
+    """Test that an error response is not replayed."""
+    headers = {'Idempotency-Key': 'abc'}
+    testapp.post('/books', testapp.data, headers=headers, status=400)
+    testapp.post('/books', testapp.data, headers=headers, status=400)
+    assert _count(app, IdempotencyKey) == 0
+
+
+def test_expired_responses_are_not_replayed(app, testapp):
+    """Test that a stored response older than the TTL is ignored and purged."""
+    from book_api.models.book import Book
+
+    headers = {'Idempotency-Key': 'abc'}
+    data = dict(testapp.data, title='Dune')
+    testapp.post('/books', data, headers=headers)
+
+    store = app.registry['idempotency_store']
+    dbsession = store.session_factory()
+    dbsession.query(IdempotencyKey).update(
+        {'created_at': datetime.utcnow() - timedelta(hours=2)})
+    dbsession.commit()
+    dbsession.close()
+
+    res = testapp.post('/books', data, headers=headers)
+    assert 'Idempotent-Replayed' not in res.headers
+    assert _count(app, Book) == 2
+
+    store.purge_interval = 0
+    store.maybe_purge()
+    assert _count(app, IdempotencyKey) == 1
+
+
+def test_requests_without_a_key_are_not_stored(app, testapp):
+    """Test that nothing is stored for a request without the header."""
+    testapp.post('/books', dict(testapp.data, title='Dune'))
+    assert _count(app, IdempotencyKey) == 0
@@ -0,0 +1,182 @@
+"""Tests for the in-process metrics."""
+
+import gc
+import json
+import os
+import threading
+
+import pytest
+
+from book_api.metrics import (
+    Counter, Gauge, Histogram, MetricsRegistry, MetricsStore, merge_snapshots,
+    render_text)
+
+
+@pytest.fixture
+def registry():
+    """Create an empty metrics registry."""
+    return MetricsRegistry()
+
+
+@pytest.fixture(scope='module')
+def metrics_testapp(make_testapp):
+    """Create a test wsgi app with metrics enabled and a user."""
+    testapp, credentials = make_testapp(**{'book_api.metrics': 'true'})
+    testapp.credentials = credentials
+    return testapp
+
+
+def test_counter_adds_up_values_from_all_threads(registry):
+    """Test that a counter merges the values recorded by each thread."""
+    counter = Counter('test_total', 'Test counter.', ('route',), registry=registry)
+
+    def work():
+        for _ in range(100):
+            counter.inc(('home',))
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter._merged() == {('home',): 400}
+
+
+def test_histogram_renders_cumulative_buckets(registry):
+    """Test that histogram buckets are rendered cumulatively."""
+    histogram = Histogram('test_seconds', 'Test histogram.', buckets=(1, 2), registry=registry)
+    histogram.observe(0.5)
+    histogram.observe(1.5)
+    histogram.observe(3)
+    text = render_text(merge_snapshots([registry.snapshot()]))
+    assert 'test_seconds_bucket{le="1"} 1' in text
+    assert 'test_seconds_bucket{le="2"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_seconds_sum 5.0' in text
+    assert 'test_seconds_count 3' in text
+
+
+def test_gauge_drops_sources_of_collected_owners(registry):
+    """Test that a gauge leaves out the sources of owners that are gone."""
+    class Owner(object):
+        value = 2
+
+    gauge = Gauge('test_in_flight', 'Test gauge.', registry=registry)
+    gauge.add_source(lambda: {(): 1})
+    owners = [Owner(), Owner()]
+    for owner in owners:
+        gauge.add_source(lambda owner: {(): owner.value}, owner=owner)
+    assert gauge._merged() == {(): 5}
+
+    del owners[0]
+    gc.collect()
+    assert gauge._merged() == {(): 3}
+    assert len(gauge.sources) == 2
+
+
+def test_discarded_app_leaves_the_pool_gauges(make_testapp):
+    """Test that the pool gauges stop counting an app once it is gone."""
+    from book_api.metrics import DB_POOL_CHECKED_OUT
+
+    gc.collect()
+    DB_POOL_CHECKED_OUT._merged()
+    before = len(DB_POOL_CHECKED_OUT.sources)
+    testapp, _ = make_testapp(signup=False, **{'book_api.metrics': 'true'})
+    assert len(DB_POOL_CHECKED_OUT.sources) == before + 1
+
+    del testapp
+    gc.collect()
+    DB_POOL_CHECKED_OUT._merged()
+    assert len(DB_POOL_CHECKED_OUT.sources) == before
+
+
+def test_merge_snapshots_adds_values_from_each_process(registry):
+    """Test that snapshots from several processes are added together."""
+    counter = Counter('test_total', 'Test counter.', ('route',), registry=registry)
+    counter.inc(('home',), 2)
+    snapshot = json.loads(json.dumps(registry.snapshot()))
+    merged = merge_snapshots([snapshot, snapshot])
+    assert merged['test_total']['samples'] == {('home',): 4}
+
+
+def test_store_collects_files_in_shared_directory(registry, tmpdir):
+    """Test that the store merges the files written by other processes."""
+    counter = Counter('test_total', 'Test counter.', registry=registry)
+    counter.inc()
+    other = tmpdir.join('metrics_{}_abc123.json'.format(os.getppid()))
+    other.write(json.dumps(registry.snapshot()))
+
+    store = MetricsStore(registry=registry, directory=str(tmpdir))
+    merged = store.collect()
+    assert merged['test_total']['samples'] == {(): 2}
+
+
+def _dead_pid():
+    """Get the PID of a process that has exited."""
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+def test_store_folds_files_of_dead_processes(registry, tmpdir):
+    """Test that a dead process keeps its counters but loses its gauges."""
+    counter = Counter('test_total', 'Test counter.', registry=registry)
+    gauge = Gauge('test_in_flight', 'Test gauge.', registry=registry)
+    gauge.add_source(lambda: {(): 3})
+    counter.inc()
+    dead = tmpdir.join('metrics_{}_abc123.json'.format(_dead_pid()))
+    dead.write(json.dumps(registry.snapshot()))
+
+    store = MetricsStore(registry=registry, directory=str(tmpdir))
+    for _ in range(2):
+        merged = store.collect()
+        assert merged['test_total']['samples'] == {(): 2}
+        # only the gauge of this process
+        assert merged['test_in_flight']['samples'] == {(): 3}
+    assert not dead.exists()
+    assert tmpdir.join('archive.json').exists()
+
+
+def test_store_leaves_out_gauges_of_stale_files(registry, tmpdir):
+    """Test that gauges from a file not written for a while are left out."""
+    gauge = Gauge('test_in_flight', 'Test gauge.', registry=registry)
+    gauge.add_source(lambda: {(): 3})
+    other = tmpdir.join('metrics_{}_abc123.json'.format(os.getppid()))
+    other.write(json.dumps(registry.snapshot()))
+    os.utime(str(other), (0, 0))
+
+    store = MetricsStore(registry=registry, directory=str(tmpdir))
+    # only the gauge of this process
+    assert store.collect()['test_in_flight']['samples'] == {(): 3}
+
+
+def test_store_close_hands_values_to_the_archive(registry, tmpdir):
+    """Test that closing a store keeps its counters for the other processes."""
+    counter = Counter('test_total', 'Test counter.', registry=registry)
+    counter.inc(amount=5)
+    store = MetricsStore(registry=registry, directory=str(tmpdir))
+    store.collect()
+    store.close()
+    assert not tmpdir.listdir(lambda path: path.basename.startswith('metrics_'))
+
+    merged = MetricsStore(registry=MetricsRegistry(), directory=str(tmpdir)).collect()
+    assert merged['test_total']['samples'] == {(): 5}
+
+
+def test_metrics_route_not_found_by_default(make_testapp):
+    """Test that /metrics is not exposed unless enabled."""
+    testapp, _ = make_testapp(signup=False)
+    testapp.get('/metrics', status=404)
+
+
+def test_metrics_route_reports_request_and_password_metrics(metrics_testapp):
+    """Test that /metrics reports requests and password verification."""
+    metrics_testapp.get('/books', metrics_testapp.credentials)
+    res = metrics_testapp.get('/metrics')
+    assert res.content_type == 'text/plain'
+    assert 'book_api_requests_total{route="book-list",method="GET",status="200"}' in res.text
+    assert 'book_api_request_duration_seconds_count{route="signup",method="POST"}' in res.text
+    assert 'book_api_password_verify_duration_seconds_count' in res.text
+    assert 'book_api_db_pool_checked_out_connections' in res.text
@@ -3,7 +3,7 @@
 import pytest
 from sqlalchemy.exc import IntegrityError
 
-from book_api.models.book import Book
+from book_api.models.book import Book, BookRow
 from book_api.models.user import User
 from book_api.tests.conftest import FAKE
 
@@ -60,3 +60,24 @@ def test_to_json_has_property_values_from_object(one_book):
     for prop in ['id', 'title', 'author', 'isbn']:
         assert json[prop] == getattr(one_book, prop)
     assert json['pub_date'] == one_book.pub_date.strftime('%m/%d/%Y')
+
+
+def test_book_row_to_json_matches_book(db_session):
+    """Test that a BookRow serializes the same as the Book it was read from."""
+    book = Book(
+        user=User(email=FAKE.email(), password='password'),
+        title=FAKE.sentence(nb_words=3),
+        author=FAKE.name(),
+        isbn=FAKE.isbn13(separator="-"),
+        pub_date=FAKE.date_object()
+    )
+    db_session.add(book)
+    db_session.flush()
+    row = db_session.query(*BookRow.columns).filter(Book.id == book.id).one()
+    assert BookRow.from_row(row).to_json() == book.to_json()
+
+
+def test_book_row_has_no_instance_dict():
+    """Test that a BookRow only stores its slots."""
+    book = BookRow(1, 'Title', None, None, None)
+    assert not hasattr(book, '__dict__')
@@ -0,0 +1,143 @@
+"""Tests for committing writes in groups."""
+
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+
+from book_api.models.book import Book
+from book_api.models.group_commit import GroupCommitWriter
+from book_api.models.meta import Base
+from book_api.models.user import User
+from book_api.tests.conftest import FAKE
+
+
+@pytest.fixture
+def writer(tmp_path):
+    """Create a writer for a new SQLite file holding one user."""
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'books.sqlite'))
+    Base.metadata.create_all(engine)
+    writer = GroupCommitWriter(engine, window=0.2)
+    writer.user_id = writer.submit(lambda dbsession: _add_user(dbsession))
+    yield writer
+    writer.close()
+
+
+def _add_user(dbsession):
+    user = User(email=FAKE.email(), password='password')
+    dbsession.add(user)
+    dbsession.flush()
+    return user.id
+
+
+def _add_book(user_id, title):
+    def add(dbsession):
+        book = Book(user_id=user_id, title=title)
+        dbsession.add(book)
+        dbsession.flush()
+        return book.id
+    return add
+
+
+def test_concurrent_writes_share_one_commit(writer):
+    """Test that writes arriving within the window are committed together."""
+    commits = writer.commits
+    results = []
+    threads = [
+        threading.Thread(target=lambda i=i: results.append(
+            writer.submit(_add_book(writer.user_id, 'Book %d' % i), timeout=5)))
+        for i in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(results)) == 5
+    assert writer.commits == commits + 1
+
+
+def test_failed_write_only_undoes_itself(writer):
+    """Test that a write that fails is rolled back to its own savepoint."""
+    from book_api.models.group_commit import _Write
+
+    good = _Write(_add_book(writer.user_id, 'Kept'))
+    bad = _Write(_add_book(writer.user_id, None))
+    writer.commit([bad, good])
+
+    assert bad.error is not None
+    dbsession = writer.session_factory()
+    try:
+        assert dbsession.query(Book).get(good.result).title == 'Kept'
+    finally:
+        dbsession.close()
+
+
+def test_error_from_write_is_raised_to_submitter(writer):
+    """Test that submit raises the exception of the write."""
+    def fail(dbsession):
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        writer.submit(fail, timeout=5)
+
+
+def test_timed_out_write_is_cancelled(writer):
+    """Test that a write the writer did not get to in time never runs."""
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def slow(dbsession):
+        started.set()
+        release.wait(5)
+
+    busy = threading.Thread(target=lambda: writer.submit(slow, timeout=5))
+    busy.start()
+    started.wait(5)
+    with pytest.raises(TimeoutError):
+        writer.submit(lambda dbsession: ran.append(1), timeout=0.05)
+    release.set()
+    busy.join(5)
+
+    assert writer.submit(lambda dbsession: 'next', timeout=5) == 'next'
+    assert ran == []
+
+
+def test_write_is_not_queued_once_the_deadline_has_passed(dummy_request):
+    """Test that a request out of time gets a 503 without queuing its write."""
+    from pyramid.httpexceptions import HTTPServiceUnavailable
+    from book_api.deadline import Deadline
+    from book_api.views.books import _write
+
+    class Writer(object):
+        def submit(self, fn, timeout=None):
+            pytest.fail('queued')
+
+    dummy_request.registry['group_commit'] = Writer()
+    dummy_request.deadline = Deadline(0)
+    try:
+        with pytest.raises(HTTPServiceUnavailable):
+            _write(dummy_request, lambda dbsession: None)
+    finally:
+        del dummy_request.registry['group_commit']
+
+
+def test_books_are_created_through_the_writer(make_testapp, tmp_path):
+    """Test that the book views work with group commit enabled."""
+    testapp, data = make_testapp(**{
+        'sqlalchemy.url': 'sqlite:///{}'.format(tmp_path / 'app.sqlite'),
+        'book_api.group_commit': 'true',
+    })
+    app = testapp.app
+
+    try:
+        book = testapp.post('/books', dict(data, title='Dune'), status=201).json
+        updated = testapp.put('/books/{}'.format(book['id']), dict(data, author='Herbert')).json
+        assert updated['author'] == 'Herbert'
+        assert testapp.get('/books', data).json == [updated]
+        testapp.delete('/books/{}'.format(book['id']), data, status=204)
+        assert testapp.get('/books', data).json == []
+        assert app.registry['group_commit'].commits == 3
+    finally:
+        app.registry['group_commit'].close()
@@ -0,0 +1,42 @@
+"""Tests for the baked queries."""
+
+import pytest
+
+from book_api.models.book import Book
+from book_api.models.queries import book_rows_for_user, owned_book_row, user_by_email
+from book_api.models.user import User
+from book_api.tests.conftest import FAKE
+
+
+@pytest.fixture
+def two_users(db_session):
+    """Create two Users with two Books each."""
+    users = []
+    for _ in range(2):
+        user = User(email=FAKE.email(), password='password')
+        db_session.add_all([user, Book(user=user, title='b'), Book(user=user, title='a')])
+        users.append(user)
+    db_session.flush()
+    return users
+
+
+def test_user_by_email_finds_user(db_session, two_users):
+    """Test that the user with the email is found."""
+    user = two_users[1]
+    assert user_by_email(db_session, user.email) is user
+    assert user_by_email(db_session, 'nobody@example.com') is None
+
+
+def test_owned_book_row_only_finds_books_of_user(db_session, two_users):
+    """Test that a book is only found for the user who owns it."""
+    mine, other = two_users
+    book = mine.books[0]
+    assert owned_book_row(db_session, mine.id, book.id).id == book.id
+    assert owned_book_row(db_session, other.id, book.id) is None
+
+
+def test_book_rows_for_user_lists_books_by_id(db_session, two_users):
+    """Test that the list has only the user's books, ordered by id."""
+    user = two_users[0]
+    rows = book_rows_for_user(db_session, user.id)
+    assert [row.id for row in rows] == sorted(book.id for book in user.books)
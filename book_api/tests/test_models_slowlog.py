@@ -0,0 +1,112 @@
+"""Unit tests for the slow query log."""
+
+import logging
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+
+from book_api.models.book import Book
+from book_api.models.meta import Base
+from book_api.models.slowlog import explain, install_slow_query_log, loggable_parameters
+
+
+def test_explain_gets_sqlite_query_plan():
+    """Test that explain returns the SQLite query plan for a statement."""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        plan = explain(conn, 'SELECT * FROM books WHERE id = ?', (1,))
+    assert any('books' in line for line in plan)
+
+
+class FakePostgresCursor(object):
+    """A DBAPI cursor recording its statements, failing on EXPLAIN if told to."""
+
+    def __init__(self, fail=False):
+        self.statements = []
+        self.fail = fail
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(statement)
+        if self.fail and statement.startswith('EXPLAIN'):
+            raise RuntimeError('EXPLAIN failed')
+
+    def fetchall(self):
+        return [('Seq Scan on books',)]
+
+    def close(self):
+        pass
+
+
+def _postgres_connection(cursor):
+    """Get a stand-in for a PostgreSQL connection handing out the cursor."""
+    return SimpleNamespace(
+        dialect=SimpleNamespace(name='postgresql'),
+        connection=SimpleNamespace(cursor=lambda: cursor),
+    )
+
+
+@pytest.mark.parametrize('statement', [
+    'SET LOCAL statement_timeout = 100',
+    'CREATE INDEX ix_books_title ON books (title)',
+    '',
+])
+def test_explain_skips_statements_that_cannot_be_explained(statement):
+    """Test that only SELECT, INSERT, UPDATE and DELETE are explained."""
+    cursor = FakePostgresCursor()
+    assert explain(_postgres_connection(cursor), statement, {}) == []
+    assert cursor.statements == []
+
+
+def test_explain_runs_in_a_savepoint_on_postgresql():
+    """Test that EXPLAIN on PostgreSQL is wrapped in a released savepoint."""
+    cursor = FakePostgresCursor()
+    plan = explain(_postgres_connection(cursor), '  select * from books', {})
+    assert plan == ['Seq Scan on books']
+    assert cursor.statements == [
+        'SAVEPOINT slowlog_explain',
+        'EXPLAIN   select * from books',
+        'RELEASE SAVEPOINT slowlog_explain',
+    ]
+
+
+def test_failed_explain_rolls_back_to_the_savepoint():
+    """Test that a failed EXPLAIN leaves the transaction usable."""
+    cursor = FakePostgresCursor(fail=True)
+    with pytest.raises(RuntimeError):
+        explain(_postgres_connection(cursor), 'SELECT * FROM books', {})
+    assert cursor.statements[-1] == 'ROLLBACK TO SAVEPOINT slowlog_explain'
+
+
+def test_slow_query_logged_with_plan(caplog):
+    """Test that statements over the threshold are logged with their plan."""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    install_slow_query_log(engine, 0)
+
+    with caplog.at_level(logging.WARNING, logger='book_api.models.slowlog'):
+        with engine.connect() as conn:
+            conn.execute(Book.__table__.select().where(Book.user_id == 1))
+    assert 'slow query' in caplog.text
+    assert 'params=(1,)' in caplog.text
+    assert 'books' in caplog.text.split('\n', 1)[1]
+
+
+def test_fast_query_not_logged(caplog):
+    """Test that statements under the threshold are not logged."""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    install_slow_query_log(engine, 60)
+
+    with caplog.at_level(logging.WARNING, logger='book_api.models.slowlog'):
+        with engine.connect() as conn:
+            conn.execute(Book.__table__.select())
+    assert 'slow query' not in caplog.text
+
+
+def test_parameters_of_user_statements_are_not_logged():
+    """Test that password hashes bound to statements on users are left out."""
+    statement = 'UPDATE users SET password=? WHERE users.id = ?'
+    assert loggable_parameters(statement, ('$argon2$hash', 1)) == '<2 parameters>'
+    assert loggable_parameters('SELECT * FROM books WHERE id = ?', (1,)) == '(1,)'
@@ -3,7 +3,8 @@
 import pytest
 from sqlalchemy.exc import IntegrityError
 
-from book_api.models.user import User
+from book_api.models import user as user_module
+from book_api.models.user import User, pwd_context_from_settings
 from book_api.tests.conftest import FAKE, one_book
 
 
@@ -81,6 +82,60 @@ def test_verify_returns_false_for_incorrect_password(one_user):
     assert one_user.verify('notthepassword') is False
 
 
+def test_verify_and_update_keeps_current_hash(one_user):
+    """Test that verify_and_update leaves a hash from the current policy."""
+    password_hash = one_user.password
+    assert one_user.verify_and_update('password') is True
+    assert one_user.password == password_hash
+
+
+def test_verify_and_update_rehashes_deprecated_hash(monkeypatch):
+    """Test that verify_and_update rehashes with the new default scheme."""
+    user = User(email=FAKE.email(), password='password')
+    context = pwd_context_from_settings({
+        'passlib.schemes': 'pbkdf2_sha256, sha512_crypt',
+        'passlib.deprecated': 'auto',
+    })
+    monkeypatch.setattr(user_module, 'pwd_context', context)
+
+    assert user.verify_and_update('password') is True
+    assert user.password.startswith('$pbkdf2-sha256$')
+    assert user.verify('password') is True
+
+
+def test_verify_and_update_does_not_rehash_for_incorrect_password(monkeypatch):
+    """Test that verify_and_update keeps the hash for a wrong password."""
+    user = User(email=FAKE.email(), password='password')
+    password_hash = user.password
+    context = pwd_context_from_settings({
+        'passlib.schemes': 'pbkdf2_sha256, sha512_crypt',
+        'passlib.deprecated': 'auto',
+    })
+    monkeypatch.setattr(user_module, 'pwd_context', context)
+
+    assert user.verify_and_update('notthepassword') is False
+    assert user.password == password_hash
+
+
+def test_pwd_context_from_settings_uses_defaults_without_settings():
+    """Test that the context matches the default policy without settings."""
+    context = pwd_context_from_settings({'sqlalchemy.url': 'sqlite://'})
+    assert context.default_scheme() == 'sha512_crypt'
+
+
+def test_apps_keep_their_own_password_policy(make_testapp):
+    """Test that an app without passlib settings keeps the default policy."""
+    custom_app, _ = make_testapp(**{'passlib.schemes': 'pbkdf2_sha256'})
+    default_app, _ = make_testapp()
+
+    def stored_hash(testapp):
+        session = testapp.app.registry['dbsession_factory']()
+        return session.query(User).get(testapp.user_id).password
+
+    assert stored_hash(custom_app).startswith('$pbkdf2-sha256$')
+    assert stored_hash(default_app).startswith('$6$')
+
+
 def test_to_json_has_all_user_properties_except_password(one_user):
     """Test that to_json has all the properties on the User model."""
     json = one_user.to_json()
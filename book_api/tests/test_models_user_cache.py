@@ -0,0 +1,149 @@
+"""Tests for the cache of User snapshots."""
+
+import pytest
+import transaction
+from sqlalchemy import event
+
+from book_api.models import get_tm_session
+from book_api.models.user import User
+from book_api.models import user_cache as user_cache_module
+from book_api.models.user_cache import UserCache, UserSnapshot
+
+
+def make_snapshot(user_id=1, email='a@example.com'):
+    """Create a snapshot of an imaginary user."""
+    return UserSnapshot(user_id, 'First', 'Last', email, 'hash')
+
+
+@pytest.fixture(scope='module')
+def cached_app(make_testapp):
+    """Create a test app with the user cache enabled and a user."""
+    testapp, credentials = make_testapp(**{'book_api.user_cache': 'true'})
+    testapp.credentials = credentials
+    return testapp
+
+
+def test_cache_gets_snapshot_by_email_or_id():
+    """Test that a stored snapshot is found by both of its keys."""
+    cache = UserCache()
+    snapshot = make_snapshot()
+    cache.add(snapshot)
+    assert cache.get(email='a@example.com') is snapshot
+    assert cache.get(user_id=1) is snapshot
+    assert cache.get(email='b@example.com') is None
+
+
+def test_cache_entries_expire_after_ttl():
+    """Test that a snapshot is dropped once its time to live has passed."""
+    cache = UserCache(ttl=60)
+    cache.add(make_snapshot(), now=0)
+    assert cache.get(email='a@example.com', now=59) is not None
+    assert cache.get(email='a@example.com', now=60) is None
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used():
+    """Test that the cache stays within its size."""
+    cache = UserCache(max_entries=2)
+    cache.add(make_snapshot(1, 'a@example.com'))
+    cache.add(make_snapshot(2, 'b@example.com'))
+    cache.get(user_id=1)
+    cache.add(make_snapshot(3, 'c@example.com'))
+    assert cache.get(email='b@example.com') is None
+    assert cache.get(email='a@example.com') is not None
+
+
+def test_cache_invalidate_by_email_drops_entry():
+    """Test that invalidating an email removes its snapshot."""
+    cache = UserCache()
+    cache.add(make_snapshot())
+    cache.invalidate(emails=['a@example.com'])
+    assert cache.get(user_id=1) is None
+
+
+def test_snapshot_read_before_invalidation_is_not_stored():
+    """Test that a lookup racing an invalidation does not store a stale row."""
+    cache = UserCache()
+    generation = cache.generation('a@example.com')
+    cache.invalidate(emails=['a@example.com'])
+    assert not cache.add(make_snapshot(), generation=generation)
+    assert cache.get(email='a@example.com') is None
+
+    assert cache.add(make_snapshot(), generation=cache.generation('a@example.com'))
+    assert cache.get(email='a@example.com') is not None
+
+
+def test_load_user_racing_a_commit_does_not_cache_old_row(cached_app, monkeypatch):
+    """Test that a user read just before a concurrent commit is not cached."""
+    cache = cached_app.app.registry['user_cache']
+    cache.invalidate(ids=[cached_app.user_id])
+    session_factory = cached_app.app.registry['dbsession_factory']
+    email = cached_app.credentials['email']
+    query = user_cache_module.user_by_email
+
+    def query_then_commit_change(dbsession, email):
+        user = query(dbsession, email)
+        with transaction.manager:
+            other = get_tm_session(session_factory, transaction.manager)
+            other.query(User).get(cached_app.user_id).first_name = 'Raced'
+        return user
+
+    monkeypatch.setattr(user_cache_module, 'user_by_email', query_then_commit_change)
+    reader = session_factory()
+    try:
+        cache.load_user(reader, email)
+    finally:
+        reader.close()
+    assert cache.get(email=email) is None
+
+
+def test_cached_user_authenticates_without_querying_users(cached_app):
+    """Test that the second lookup of a user comes from the cache."""
+    cache = cached_app.app.registry['user_cache']
+    cached_app.get('/books', cached_app.credentials)
+    assert cache.get(user_id=cached_app.user_id) is not None
+
+    statements = []
+    engine = cached_app.app.registry['db_engine']
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        cached_app.get('/books', cached_app.credentials)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert not any('FROM users' in statement for statement in statements)
+
+
+def test_cached_user_can_add_and_list_books(cached_app):
+    """Test that a User restored from the cache works with relationships."""
+    cached_app.get('/books', cached_app.credentials)
+    data = dict(cached_app.credentials, title='Dune')
+    res = cached_app.post('/books', data, status=201)
+    books = cached_app.get('/books', cached_app.credentials).json
+    assert res.json['id'] in [book['id'] for book in books]
+
+
+def test_updating_user_invalidates_cache(cached_app):
+    """Test that a committed change to a user drops its snapshot."""
+    cache = cached_app.app.registry['user_cache']
+    cached_app.get('/books', cached_app.credentials)
+    assert cache.get(user_id=cached_app.user_id) is not None
+
+    session_factory = cached_app.app.registry['dbsession_factory']
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        user = dbsession.query(User).get(cached_app.user_id)
+        user.first_name = 'Changed'
+
+    assert cache.get(user_id=cached_app.user_id) is None
+
+
+def test_adding_book_keeps_cache_entry(cached_app):
+    """Test that changing only the books of a user keeps its snapshot."""
+    cache = cached_app.app.registry['user_cache']
+    cached_app.get('/books', cached_app.credentials)
+    cached_app.post('/books', dict(cached_app.credentials, title='Emma'))
+    assert cache.get(user_id=cached_app.user_id) is not None
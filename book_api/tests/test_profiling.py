@@ -0,0 +1,65 @@
+"""Tests for the sampling profiler."""
+
+import threading
+import time
+
+import pytest
+
+from book_api.profiling import ProfileStore, StackSampler
+
+
+def busy_wait(seconds):
+    """Spin for the given number of seconds."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.fixture
+def profiled_testapp(make_testapp, tmpdir):
+    """Create a test wsgi app that only profiles requests with the token."""
+    testapp, _ = make_testapp(signup=False, **{
+        'book_api.profile': 'true',
+        'book_api.profile.token': 'secret',
+        'book_api.profile.interval_ms': '1',
+        'book_api.profile.dir': str(tmpdir),
+    })
+    return testapp
+
+
+def test_sampler_records_folded_stacks_of_thread():
+    """Test that the sampler records the stack of the sampled thread."""
+    with StackSampler(threading.get_ident(), 0.001) as sampler:
+        busy_wait(0.05)
+    assert sampler.stacks
+    assert any(stack.endswith('test_profiling:busy_wait') for stack in sampler.stacks)
+
+
+def test_store_aggregates_samples_per_route(tmpdir):
+    """Test that the store adds up samples for a route in its file."""
+    store = ProfileStore(str(tmpdir))
+    store.add('book-list', {'a;b': 2})
+    store.add('book-list', {'a;b': 1, 'a;c': 1})
+    with open(store.path('book-list')) as f:
+        lines = sorted(f.read().splitlines())
+    assert lines == ['a;b 3', 'a;c 1']
+
+
+def test_request_with_token_is_profiled(profiled_testapp, tmpdir):
+    """Test that a request with the right X-Profile header is profiled."""
+    res = profiled_testapp.get('/books', headers={'X-Profile': 'secret'}, status=400)
+    assert 'X-Profile-Samples' in res.headers
+    assert tmpdir.listdir()
+
+
+def test_request_with_wrong_token_is_not_profiled(profiled_testapp, tmpdir):
+    """Test that a request with the wrong X-Profile header is not profiled."""
+    res = profiled_testapp.get('/books', headers={'X-Profile': 'guess'}, status=400)
+    assert 'X-Profile-Samples' not in res.headers
+    assert not tmpdir.listdir()
+
+
+def test_request_with_non_ascii_token_is_not_profiled(profiled_testapp, tmpdir):
+    """Test that a non-ASCII X-Profile header is compared, not a 500."""
+    res = profiled_testapp.get('/books', headers={'X-Profile': 'sécret'}, status=400)
+    assert 'X-Profile-Samples' not in res.headers
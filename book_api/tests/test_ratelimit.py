@@ -0,0 +1,118 @@
+"""Tests for the credential check rate limiter."""
+
+import pytest
+from pyramid.httpexceptions import HTTPForbidden, HTTPTooManyRequests
+
+from book_api.ratelimit import MemoryBackend, RateLimiter
+from book_api.tests.conftest import FAKE
+from book_api.views.books import validate_user
+
+
+@pytest.fixture
+def limiter():
+    """Create a limiter allowing two failures per email a minute."""
+    return RateLimiter(MemoryBackend(), email_limit=2, ip_limit=3, window=60)
+
+
+def test_limiter_allows_attempts_under_the_limit(limiter):
+    """Test that check passes while failures are under the limit."""
+    limiter.record_failure('a@example.com', '1.2.3.4', now=0)
+    limiter.check('a@example.com', '1.2.3.4', now=1)
+
+
+def test_limiter_rejects_email_over_the_limit(limiter):
+    """Test that check raises 429 with Retry-After once an email is over."""
+    limiter.record_failure('a@example.com', '1.2.3.4', now=0)
+    limiter.record_failure('A@example.com', '5.6.7.8', now=10)
+    with pytest.raises(HTTPTooManyRequests) as excinfo:
+        limiter.check('a@example.com', '9.9.9.9', now=20)
+    assert excinfo.value.headers['Retry-After'] == '40'
+
+
+def test_limiter_rejects_address_over_the_limit(limiter):
+    """Test that check raises 429 once an address is over its limit."""
+    for email in ('a@example.com', 'b@example.com', 'c@example.com'):
+        limiter.record_failure(email, '1.2.3.4', now=0)
+    with pytest.raises(HTTPTooManyRequests):
+        limiter.check('d@example.com', '1.2.3.4', now=1)
+
+
+def test_limiter_allows_attempts_after_the_window(limiter):
+    """Test that old failures stop counting after the window."""
+    limiter.record_failure('a@example.com', '1.2.3.4', now=0)
+    limiter.record_failure('a@example.com', '1.2.3.4', now=1)
+    limiter.check('a@example.com', '1.2.3.4', now=61)
+
+
+def test_memory_backend_keeps_at_most_max_keys():
+    """Test that the backend forgets the least recently hit keys beyond its size."""
+    backend = MemoryBackend(max_keys=2)
+    for key in ('ip:a', 'ip:b', 'ip:a', 'ip:c'):
+        backend.hit(key, 60, 0)
+    assert backend.recent('ip:a', 60, 1) == [0, 0]
+    assert backend.recent('ip:b', 60, 1) == []
+    assert backend.recent('ip:c', 60, 1) == [0]
+
+
+def test_memory_backend_addresses_do_not_push_out_emails():
+    """Test that a flood of new addresses leaves the email counts alone."""
+    backend = MemoryBackend(max_keys=2)
+    backend.hit('email:victim@example.com', 60, 0)
+    for i in range(10):
+        backend.hit('ip:10.0.0.%d' % i, 60, 0)
+    assert backend.recent('email:victim@example.com', 60, 1) == [0]
+
+
+def test_client_ip_ignores_forwarded_for_without_proxies(limiter):
+    """Test that a client cannot pick its address with X-Forwarded-For."""
+    from pyramid.request import Request
+
+    request = Request.blank('/', remote_addr='9.9.9.9',
+                            headers={'X-Forwarded-For': '1.2.3.4'})
+    assert limiter.client_ip(request) == '9.9.9.9'
+
+
+def test_client_ip_takes_the_address_seen_by_trusted_proxies(limiter):
+    """Test that only the entries appended by trusted proxies are used."""
+    from pyramid.request import Request
+
+    limiter.trusted_proxies = 2
+    request = Request.blank('/', remote_addr='10.0.0.2', headers={
+        'X-Forwarded-For': '1.2.3.4, 5.6.7.8, 10.0.0.1'})
+    assert limiter.client_ip(request) == '5.6.7.8'
+
+    request = Request.blank('/', remote_addr='10.0.0.2', headers={
+        'X-Forwarded-For': '10.0.0.1'})
+    assert limiter.client_ip(request) == '10.0.0.2'
+
+
+def test_validate_user_records_failures_and_throttles(dummy_request, limiter):
+    """Test that validate_user rejects throttled emails before checking."""
+    dummy_request.registry['ratelimiter'] = limiter
+    dummy_request.remote_addr = '127.0.0.1'
+    data = {
+        'email': FAKE.email(),
+        'password': 'password'
+    }
+    try:
+        for _ in range(2):
+            with pytest.raises(HTTPForbidden):
+                validate_user(dummy_request.dbsession, data, dummy_request)
+        with pytest.raises(HTTPTooManyRequests):
+            validate_user(dummy_request.dbsession, data, dummy_request)
+    finally:
+        del dummy_request.registry['ratelimiter']
+
+
+def test_throttled_request_gets_429_with_retry_after(make_testapp):
+    """Test that a throttled request gets a JSON 429 with Retry-After."""
+    testapp, credentials = make_testapp(**{
+        'book_api.ratelimit': 'true',
+        'book_api.ratelimit.email_limit': '1',
+    })
+
+    data = dict(credentials, password='wrong')
+    testapp.get('/books', data, status=403)
+    res = testapp.get('/books', data, status=429)
+    assert res.json['status'] == 429
+    assert int(res.headers['Retry-After']) > 0
@@ -0,0 +1,59 @@
+"""Tests for the binary response formats."""
+
+from datetime import date
+
+import pytest
+
+from book_api.tests.conftest import FAKE
+
+msgpack = pytest.importorskip('msgpack')
+cbor2 = pytest.importorskip('cbor2')
+
+
+@pytest.fixture(scope='module')
+def binary_app(make_testapp):
+    """Create a test app with a user who has a book."""
+    testapp, credentials = make_testapp()
+    testapp.credentials = credentials
+    testapp.book = testapp.post('/books', dict(
+        credentials, title='Dune', pub_date='08/01/1965')).json
+    return testapp
+
+
+def test_list_is_json_by_default(binary_app):
+    """Test that clients not asking for a binary format get JSON."""
+    res = binary_app.get('/books', binary_app.credentials)
+    assert res.content_type == 'application/json'
+    assert res.json[0]['pub_date'] == '08/01/1965'
+
+
+def test_list_is_msgpack_when_accepted(binary_app):
+    """Test that the list is MessagePack with a native publication date."""
+    res = binary_app.get(
+        '/books', binary_app.credentials,
+        headers={'Accept': 'application/msgpack'})
+    assert res.content_type == 'application/msgpack'
+    books = msgpack.unpackb(res.body, timestamp=3)
+    assert books[0]['title'] == 'Dune'
+    assert books[0]['pub_date'].date() == date(1965, 8, 1)
+
+
+def test_book_is_cbor_when_accepted(binary_app):
+    """Test that a book is CBOR with a native publication date."""
+    res = binary_app.get(
+        '/books/{}'.format(binary_app.book['id']), binary_app.credentials,
+        headers={'Accept': 'application/cbor'})
+    assert res.content_type == 'application/cbor'
+    book = cbor2.loads(res.body)
+    assert book == dict(binary_app.book, pub_date=date(1965, 8, 1))
+
+
+def test_signup_is_msgpack_when_accepted(binary_app):
+    """Test that the signup view also has a MessagePack response."""
+    data = {
+        'email': FAKE.email(),
+        'password': 'password'
+    }
+    res = binary_app.post(
+        '/signup', data, headers={'Accept': 'application/msgpack'}, status=201)
+    assert msgpack.unpackb(res.body)['email'] == data['email']
@@ -0,0 +1,129 @@
+"""Tests for retrying requests that failed on database contention."""
+
+import sqlite3
+
+import pytest
+from pyramid.registry import Registry
+from pyramid.request import Request
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+
+from book_api.metrics import RETRIES_EXHAUSTED
+from book_api.retry import RetryPolicy, is_retryable
+from book_api.tests.conftest import FAKE
+
+
+class FakePostgresError(Exception):
+    """A driver error carrying a SQLSTATE code like psycopg2 errors do."""
+
+    def __init__(self, pgcode):
+        super(FakePostgresError, self).__init__('error')
+        self.pgcode = pgcode
+
+
+def test_sqlite_lock_errors_are_retryable():
+    """Test that a locked SQLite database is retryable."""
+    error = OperationalError('INSERT', {}, sqlite3.OperationalError('database is locked'))
+    assert is_retryable(error)
+
+
+def test_other_operational_errors_are_not_retryable():
+    """Test that an OperationalError not about locks is not retryable."""
+    error = OperationalError('SELECT', {}, sqlite3.OperationalError('no such table: books'))
+    assert not is_retryable(error)
+
+
+def test_integrity_errors_are_not_retryable():
+    """Test that a constraint violation is never retryable."""
+    error = IntegrityError('INSERT', {}, sqlite3.IntegrityError('database is locked'))
+    assert not is_retryable(error)
+
+
+@pytest.mark.parametrize('pgcode, retryable', [
+    ('40001', True),
+    ('40P01', True),
+    ('23505', False),
+])
+def test_sqlstates_are_classified(pgcode, retryable):
+    """Test that serialization failures and deadlocks are retryable."""
+    error = OperationalError('UPDATE', {}, FakePostgresError(pgcode))
+    assert is_retryable(error) is retryable
+
+
+@pytest.mark.parametrize('method, headers, replayed, retryable', [
+    ('GET', {}, False, True),
+    ('PUT', {}, False, True),
+    ('POST', {}, True, False),
+    ('POST', {'Idempotency-Key': 'abc'}, False, False),
+    ('POST', {'Idempotency-Key': 'abc'}, True, True),
+])
+def test_dropped_connection_is_retried_only_if_safe(method, headers, replayed, retryable):
+    """Test that a dropped connection is retried only for requests that can run twice."""
+    error = DBAPIError('SELECT', {}, Exception('closed'), connection_invalidated=True)
+    request = Request.blank('/books', method=method, headers=headers)
+    request.registry = Registry()
+    if replayed:
+        request.registry['idempotency_store'] = object()
+    assert is_retryable(error, request) is retryable
+    assert not is_retryable(error)
+
+
+def test_delay_is_capped_and_grows_with_attempts():
+    """Test that the delay stays under a limit doubling up to the maximum."""
+    policy = RetryPolicy(backoff=0.01, max_backoff=0.05)
+    assert all(0 <= policy.delay(0) <= 0.01 for _ in range(100))
+    assert all(0 <= policy.delay(1) <= 0.02 for _ in range(100))
+    assert all(0 <= policy.delay(10) <= 0.05 for _ in range(100))
+
+
+RETRY_SETTINGS = {
+    'book_api.retry': 'true',
+    'book_api.retry.backoff_ms': '1',
+}
+
+
+def _lock_inserts(testapp, times):
+    """Make the first few INSERT statements of the app find the database locked."""
+    engine = testapp.app.registry['db_engine']
+    remaining = [times]
+    do_execute = engine.dialect.do_execute
+
+    def locking_execute(cursor, statement, parameters, context=None):
+        if statement.startswith('INSERT') and remaining[0]:
+            remaining[0] -= 1
+            raise sqlite3.OperationalError('database is locked')
+        do_execute(cursor, statement, parameters, context)
+
+    engine.dialect.do_execute = locking_execute
+
+
+def test_locked_write_is_retried(make_testapp, monkeypatch):
+    """Test that a request failing on a lock is run again after a sleep."""
+    sleeps = []
+    monkeypatch.setattr('book_api.retry.time.sleep', sleeps.append)
+    testapp, _ = make_testapp(signup=False, **RETRY_SETTINGS)
+    _lock_inserts(testapp, 1)
+
+    res = testapp.post('/signup', {'email': FAKE.email(), 'password': 'password'})
+    assert res.status_code == 201
+    assert len(sleeps) == 1
+    assert 0 <= sleeps[0] <= 0.001
+
+
+def test_route_attempts_limit_retries(make_testapp, monkeypatch):
+    """Test that a route with one attempt fails and is counted as exhausted."""
+    monkeypatch.setattr('book_api.retry.time.sleep', lambda delay: None)
+    testapp, _ = make_testapp(signup=False, **dict(
+        RETRY_SETTINGS, **{'book_api.retry.attempts.signup': '1'}))
+    _lock_inserts(testapp, 1)
+    before = RETRIES_EXHAUSTED._merged().get(('signup', 'OperationalError'), 0)
+
+    with pytest.raises(OperationalError):
+        testapp.post('/signup', {'email': FAKE.email(), 'password': 'password'})
+    assert RETRIES_EXHAUSTED._merged()[('signup', 'OperationalError')] == before + 1
+
+
+def test_locked_write_is_not_retried_when_disabled(make_testapp):
+    """Test that views handle lock errors as before while retry is disabled."""
+    testapp, _ = make_testapp(signup=False)
+    _lock_inserts(testapp, 1)
+    testapp.post('/signup', {'email': FAKE.email(), 'password': 'password'}, status=400)
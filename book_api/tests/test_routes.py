@@ -280,6 +280,31 @@ def test_book_list_get_correct_auth_all_book_details(testapp, one_user):
                    ['id', 'title', 'author', 'isbn', 'pub_date'])
 
 
+def test_book_list_get_with_ids_returns_requested_books(testapp, testapp_session, one_user):
+    """Test that GET to book-list route with ids only gets those books."""
+    books = testapp_session.query(User).get(one_user.id).books[:2]
+    data = {
+        'email': one_user.email,
+        'password': 'password',
+        'ids': '{},{},0'.format(books[0].id, books[1].id),
+    }
+    res = testapp.get('/books', data)
+    assert [book['id'] for book in res.json['books']] == [books[0].id, books[1].id]
+    assert res.json['missing'] == [0]
+
+
+def test_book_batch_post_returns_requested_books(testapp, testapp_session, one_user):
+    """Test that POST to book-batch route gets the books with the ids."""
+    book = testapp_session.query(User).get(one_user.id).books[0]
+    data = {
+        'email': one_user.email,
+        'password': 'password',
+        'ids': str(book.id),
+    }
+    res = testapp.post('/books/batch', data)
+    assert res.json == {'books': [book.to_json()], 'missing': []}
+
+
 def test_book_id_other_methods_gets_404_status_code(testapp):
     """Test that other HTTP method requests to book-id get a 404 status code."""
     for method in ('post',):
@@ -0,0 +1,36 @@
+"""Tests for the calibrate_hash script."""
+
+import pytest
+
+from book_api.scripts import calibrate_hash
+
+
+class FakeLog2Handler(object):
+    """A handler whose verify takes 2 ** rounds milliseconds."""
+
+    rounds_cost = 'log2'
+    default_rounds = 8
+    min_rounds = 4
+    max_rounds = 31
+
+
+@pytest.fixture
+def log2_timing(monkeypatch):
+    """Time verifies as 2 ** rounds milliseconds."""
+    monkeypatch.setattr(calibrate_hash, 'time_verify',
+                        lambda handler, rounds: 2 ** rounds / 1000.0)
+
+
+@pytest.mark.parametrize('target_ms, expected', [
+    (300, 8),
+    (400, 9),
+    (2000, 11),
+    (3000, 12),
+    (100, 7),
+    (20, 4),
+])
+def test_calibrate_log2_picks_the_closest_rounds(log2_timing, target_ms, expected):
+    """Test that calibrate returns the rounds closest to the target."""
+    rounds, elapsed = calibrate_hash.calibrate(FakeLog2Handler(), target_ms / 1000.0)
+    assert rounds == expected
+    assert elapsed == 2 ** expected / 1000.0
@@ -0,0 +1,81 @@
+"""Unit tests for the compaction of soft deleted books."""
+
+from datetime import datetime, timedelta
+
+from book_api.models.book import Book
+from book_api.models.book_change import BookChange
+from book_api.models.slowlog import explain
+from book_api.models.user import User
+from book_api.scripts.compact_books import compact, prune_changes
+from book_api.tests.conftest import FAKE
+
+
+def test_compact_removes_only_old_soft_deleted_books(configuration, db_session, one_user):
+    """Test that compact hard deletes tombstones older than the cutoff."""
+    now = datetime.utcnow()
+    old = [Book(user=one_user, title=FAKE.sentence(nb_words=3),
+                deleted_at=now - timedelta(days=2)) for _ in range(5)]
+    recent = Book(user=one_user, title=FAKE.sentence(nb_words=3),
+                  deleted_at=now)
+    kept = Book(user=one_user, title=FAKE.sentence(nb_words=3))
+    db_session.add_all(old + [recent, kept])
+    db_session.commit()
+    old_ids = [book.id for book in old]
+
+    deleted = compact(
+        configuration.registry['dbsession_factory'],
+        now - timedelta(days=1),
+        batch_size=2,
+        pause=0,
+    )
+    assert deleted == 5
+
+    db_session.expire_all()
+    remaining = [book_id for book_id, in db_session.query(Book.id)]
+    assert not any(book_id in remaining for book_id in old_ids)
+    assert recent.id in remaining
+    assert kept.id in remaining
+
+
+def test_prune_changes_keeps_the_latest_change_of_live_books(configuration, db_session):
+    """Test that only superseded changes and deletions past the cutoff go."""
+    user = User(email=FAKE.email(), password='password')
+    db_session.add(user)
+    db_session.flush()
+    now = datetime.utcnow()
+    old = now - timedelta(days=40)
+
+    def change(book_id, action, changed_at):
+        return BookChange(user_id=user.id, book_id=book_id,
+                          action=action, changed_at=changed_at)
+
+    superseded = change(1, 'create', old)
+    latest = change(1, 'update', old)
+    deleted = change(2, 'delete', old)
+    recent_create = change(3, 'create', now)
+    recent_delete = change(3, 'delete', now)
+    db_session.add_all([superseded, latest, deleted, recent_create, recent_delete])
+    db_session.commit()
+
+    pruned = prune_changes(
+        configuration.registry['dbsession_factory'],
+        now - timedelta(days=30),
+        batch_size=1,
+        pause=0,
+    )
+    assert pruned == 2
+
+    db_session.expire_all()
+    remaining = {change_id for change_id, in db_session.query(BookChange.id)}
+    assert remaining == {latest.id, recent_create.id, recent_delete.id}
+
+
+def test_soft_deleted_books_are_found_by_index(db_session):
+    """Test that compact finds old soft deleted books without a table scan."""
+    cutoff = datetime.utcnow()
+    query = db_session.query(Book.id).filter(
+        Book.deleted_at != None, Book.deleted_at < cutoff)
+    statement = query.statement.compile(db_session.bind)
+    parameters = tuple(statement.params[name] for name in statement.positiontup)
+    plan = explain(db_session.connection(), str(statement), parameters)
+    assert any('ix_books_deleted_at' in line for line in plan)
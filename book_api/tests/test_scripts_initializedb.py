@@ -0,0 +1,23 @@
+"""Unit tests for creating and upgrading the database."""
+
+from sqlalchemy import create_engine, inspect
+
+from book_api.scripts.initializedb import upgrade
+
+
+def test_upgrade_adds_new_columns_and_indexes(tmp_path):
+    """Test that a books table from before soft deletes is brought up to date."""
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'old.sqlite'))
+    engine.execute(
+        'CREATE TABLE users (id INTEGER PRIMARY KEY, first_name VARCHAR, '
+        'last_name VARCHAR, email VARCHAR NOT NULL UNIQUE, password VARCHAR NOT NULL)')
+    engine.execute(
+        'CREATE TABLE books (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, '
+        'title VARCHAR NOT NULL, author VARCHAR, isbn VARCHAR, pub_date DATE)')
+
+    upgrade(engine)
+    upgrade(engine)
+
+    inspector = inspect(engine)
+    assert 'deleted_at' in {column['name'] for column in inspector.get_columns('books')}
+    assert 'ix_books_deleted_at' in {index['name'] for index in inspector.get_indexes('books')}
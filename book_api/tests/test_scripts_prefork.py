@@ -0,0 +1,116 @@
+"""Unit tests for the pre-forking server helpers."""
+
+import os
+import time
+
+import pytest
+
+from book_api.scripts.prefork import Master, RecyclingMiddleware, bind_socket
+
+
+def app(environ, start_response):
+    """Respond to every request with an empty 200."""
+    start_response('200 OK', [])
+    return [b'']
+
+
+def test_recycling_middleware_calls_on_limit_once_at_max_requests():
+    """Test that the limit callback runs once, on the last allowed request."""
+    calls = []
+    middleware = RecyclingMiddleware(app, 3, lambda: calls.append(True))
+    for _ in range(5):
+        middleware({}, lambda status, headers: None)
+    assert calls == [True]
+
+
+def test_recycling_middleware_without_limit_never_calls_on_limit():
+    """Test that a max_requests of 0 disables recycling."""
+    calls = []
+    middleware = RecyclingMiddleware(app, 0, lambda: calls.append(True))
+    for _ in range(5):
+        middleware({}, lambda status, headers: None)
+    assert calls == []
+
+
+def test_bind_socket_listens_on_given_address():
+    """Test that bind_socket binds the host and port it is given."""
+    sock = bind_socket('127.0.0.1:0')
+    try:
+        assert sock.getsockname()[0] == '127.0.0.1'
+    finally:
+        sock.close()
+
+
+def fake_worker(sock, config_uri, settings, options, ready_fd):
+    """Report ready and wait to be stopped, or fail when the settings say so."""
+    if settings.get('broken'):
+        return
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+    while True:
+        time.sleep(1)
+
+
+@pytest.fixture
+def master(monkeypatch):
+    """Create a master running two fake workers."""
+    monkeypatch.setattr('book_api.scripts.prefork.run_worker', fake_worker)
+    master = Master(None, 'test.ini', {'workers': '2', 'max_backoff': '60'})
+    master.load_settings = lambda: {}
+    master.generation = master.start_generation({})
+    yield master
+    master.stop_workers()
+    while master.workers:
+        master.reap()
+        time.sleep(0.05)
+
+
+def run_until(master, condition, timeout=5):
+    """Step the master until the condition holds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        master.step()
+        time.sleep(0.05)
+
+
+def test_reload_stops_old_workers_once_new_ones_are_ready(master):
+    """Test that the old workers are only stopped after the new ones are ready."""
+    run_until(master, lambda: len(master.ready) == 2)
+    old = set(master.workers)
+
+    master.request_reload()
+    master.step()
+    run_until(master, lambda: master.pending_generation is None
+              and not old & set(master.workers))
+    assert len(master.workers) == 2
+    assert master.ready.issuperset(master.workers)
+
+
+def test_reload_with_unreadable_settings_keeps_the_workers(master):
+    """Test that a settings error leaves the master and its workers running."""
+    run_until(master, lambda: len(master.ready) == 2)
+    old = set(master.workers)
+
+    def fail():
+        raise ValueError('bad ini')
+
+    master.load_settings = fail
+    master.request_reload()
+    master.step()
+    assert master.pending_generation is None
+    assert set(master.workers) == old
+
+
+def test_reload_with_failing_workers_keeps_the_old_ones(master):
+    """Test that new workers exiting before ready abort the reload."""
+    run_until(master, lambda: len(master.ready) == 2)
+    old = set(master.workers)
+    generation = master.generation
+
+    master.load_settings = lambda: {'broken': True}
+    master.request_reload()
+    run_until(master, lambda: master.failures and master.pending_generation is None
+              and set(master.workers) == old)
+    assert master.generation == generation
+    assert master.next_spawn > time.monotonic()
@@ -0,0 +1,97 @@
+"""Tests for sharing identical concurrent reads."""
+
+import threading
+
+import pytest
+
+from book_api.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    """Test that a caller arriving during a call gets its result."""
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ['books']
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(calls) == 1
+    assert results[0] is results[1]
+
+
+def test_calls_after_the_first_one_ends_run_again():
+    """Test that nothing is kept once a call is done."""
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+
+
+def test_error_is_raised_and_key_released():
+    """Test that a failing call raises and does not block later calls."""
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_follower_runs_the_call_itself_when_the_leader_fails():
+    """Test that the leader's error is not shared with the callers waiting."""
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError('boom')
+
+    errors = []
+
+    def lead():
+        try:
+            flight.do('key', fail)
+        except ValueError as error:
+            errors.append(error)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait(5)
+    results = []
+    follower = threading.Thread(
+        target=lambda: results.append(flight.do('key', lambda: 'ok')))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(errors) == 1
+    assert results == ['ok']
+
+
+def test_list_with_single_flight_sees_new_books(make_testapp):
+    """Test that the list keyed on the change log includes a new book."""
+    testapp, data = make_testapp(**{'book_api.singleflight': 'true'})
+
+    assert testapp.get('/books', data).json == []
+    book = testapp.post('/books', dict(data, title='Dune')).json
+    assert testapp.get('/books', data).json == [book]
+    assert testapp.get('/books/{}'.format(book['id']), data).json == book
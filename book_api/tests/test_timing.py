@@ -0,0 +1,72 @@
+"""Tests for the request timing tween."""
+
+import pytest
+
+from book_api.timing import RequestTimer, timed
+
+
+@pytest.fixture(scope='module')
+def timed_testapp(make_testapp):
+    """Create a test wsgi app with request timing enabled and a user."""
+    testapp, credentials = make_testapp(**{'book_api.timing': 'true'})
+    testapp.credentials = credentials
+    return testapp
+
+
+def test_server_timing_has_total_for_new_timer():
+    """Test that a timer with no phases only reports the total."""
+    timer = RequestTimer()
+    timer.finish()
+    assert timer.server_timing().startswith('total;dur=')
+
+
+def test_server_timing_reports_phases_and_query_count():
+    """Test that recorded phases are listed in the Server-Timing value."""
+    timer = RequestTimer()
+    timer.add('auth', 0.01)
+    timer.add_query(0.002)
+    timer.add_query(0.003)
+    timer.finish()
+    value = timer.server_timing()
+    assert 'auth;dur=10.00' in value
+    assert 'db;dur=5.00;desc="2 queries"' in value
+
+
+def test_render_phase_ends_with_the_view_and_commit_follows():
+    """Test that the time after the view is reported as commit, not render."""
+    timer = RequestTimer()
+    timer.render_start = timer.start
+    timer.view_done()
+    render = timer.phases['render']
+    timer.finish()
+    assert timer.phases['render'] == render
+    assert 'commit' in timer.phases
+
+
+def test_timed_does_nothing_without_timer(dummy_request):
+    """Test that timed is a no-op for requests that are not timed."""
+    with timed(dummy_request, 'auth'):
+        pass
+    assert not hasattr(dummy_request, 'timer')
+
+
+def test_timed_adds_phase_to_request_timer(dummy_request):
+    """Test that timed records the block under the given phase."""
+    dummy_request.timer = RequestTimer()
+    with timed(dummy_request, 'auth'):
+        pass
+    assert 'auth' in dummy_request.timer.phases
+
+
+def test_untimed_app_has_no_server_timing_header(testapp):
+    """Test that responses have no Server-Timing header by default."""
+    res = testapp.get('/books', status=400)
+    assert 'Server-Timing' not in res.headers
+
+
+def test_timed_app_adds_server_timing_header(timed_testapp):
+    """Test that responses include the auth, db and render phases."""
+    res = timed_testapp.get('/books', timed_testapp.credentials)
+    value = res.headers['Server-Timing']
+    for phase in ('auth;', 'db;', 'render;', 'commit;', 'total;'):
+        assert phase in value
@@ -1,12 +1,22 @@
 """Unit tests for the Book view functions."""
 
+from datetime import date
+
 import pytest
-from pyramid.httpexceptions import HTTPBadRequest, HTTPForbidden
+from pyramid.httpexceptions import HTTPBadRequest, HTTPForbidden, HTTPNotFound
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
 
 from book_api.models.book import Book
-from book_api.tests.conftest import FAKE
+from book_api.models.user import User
+from book_api.tests.conftest import FAKE, TEST_DATABASE
 from book_api.views.books import (
-    _create_book, _delete_book, _list_books, _update_book, validate_user)
+    _create_book, _delete_book, _get_books, _list_books, _owned_book, _update_book,
+    _update_returning, book_changes_view, book_restore_view, validate_user)
+
+on_postgresql = pytest.mark.skipif(
+    not (TEST_DATABASE or '').startswith('postgresql'),
+    reason='TEST_DATABASE is not a PostgreSQL database')
 
 
 def test_validate_user_raises_error_for_incomplete_data(dummy_request):
@@ -229,7 +239,7 @@ def test_update_raises_error_for_bad_date_format(dummy_request, db_session, one_
     }
     dummy_request.POST = data
     with pytest.raises(HTTPBadRequest):
-        _update_book(dummy_request, book)
+        _update_book(dummy_request, book.user, book.id)
 
 
 def test_update_changes_single_value_for_given_book_using_post_data(dummy_request, db_session, one_user):
@@ -246,7 +256,7 @@ def test_update_changes_single_value_for_given_book_using_post_data(dummy_reques
         'author': new_author
     }
     dummy_request.POST = data
-    _update_book(dummy_request, book)
+    _update_book(dummy_request, book.user, book.id)
     assert book.author == new_author
 
 
@@ -267,7 +277,7 @@ def test_update_changes_all_values_for_given_book_using_post_data(dummy_request,
         assert getattr(book, prop) != data[prop]
 
     dummy_request.POST = data
-    _update_book(dummy_request, book)
+    _update_book(dummy_request, book.user, book.id)
 
     for prop in ['title', 'author', 'isbn', 'pub_date']:
         assert getattr(book, prop) == data[prop]
@@ -287,12 +297,58 @@ def test_update_returns_dict_with_updated_book_data(dummy_request, db_session, o
         'pub_date': FAKE.date(pattern='%m/%d/%Y')
     }
     dummy_request.POST = data
-    res = _update_book(dummy_request, book)
+    res = _update_book(dummy_request, book.user, book.id)
     assert isinstance(res, dict)
     assert all(prop in res for prop in
                ['id', 'title', 'author', 'isbn', 'pub_date'])
 
 
+def test_update_returning_compiles_for_postgresql():
+    """Test that the UPDATE used on PostgreSQL is scoped and returns the book."""
+    user = User(id=7)
+    statement = _update_returning(
+        _owned_book(user, 3), {'title': 'Dune', 'pub_date': date(1965, 8, 1)})
+    compiled = statement.compile(dialect=postgresql.dialect())
+    sql = ' '.join(str(compiled).split())
+
+    assert sql.startswith('UPDATE books SET title=%(title)s, pub_date=%(pub_date)s')
+    assert ('WHERE books.id = %(id_1)s AND books.user_id = %(user_id_1)s '
+            'AND books.deleted_at IS NULL') in sql
+    assert sql.endswith(
+        'RETURNING books.id, books.title, books.author, books.isbn, books.pub_date')
+    assert compiled.params['id_1'] == 3
+    assert compiled.params['user_id_1'] == 7
+
+
+@on_postgresql
+def test_update_returns_new_data_with_returning(dummy_request, db_session, one_user):
+    """Test that the book is updated and read back in one statement on PostgreSQL."""
+    db_session.add(one_user)
+    book = Book(user=one_user, title='Dune')
+    db_session.add(book)
+    db_session.flush()
+    assert db_session.get_bind().dialect.implicit_returning
+
+    statements = []
+    dummy_request.POST = {'author': 'Herbert', 'pub_date': '08/01/1965'}
+    engine = db_session.get_bind()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        res = _update_book(dummy_request, one_user, book.id)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert res['author'] == 'Herbert'
+    assert res['pub_date'] == '08/01/1965'
+    updates = [statement for statement in statements if statement.startswith('UPDATE')]
+    assert len(updates) == 1 and 'RETURNING' in updates[0]
+    assert not any(statement.startswith('SELECT books') for statement in statements)
+
+
 def test_delete_returns_nothing(dummy_request, db_session, one_user):
     """Test that delete returns None."""
     db_session.add(one_user)
@@ -303,7 +359,7 @@ def test_delete_returns_nothing(dummy_request, db_session, one_user):
         'password': 'password',
     }
     dummy_request.POST = data
-    res = _delete_book(dummy_request, book)
+    res = _delete_book(dummy_request, book.user, book.id)
     assert res is None
 
 
@@ -318,6 +374,214 @@ def test_delete_removes_book_from_database(dummy_request, db_session, one_user):
         'password': 'password',
     }
     dummy_request.POST = data
-    _delete_book(dummy_request, book)
+    _delete_book(dummy_request, book.user, book.id)
     db_session.commit()
     assert db_session.query(Book).get(book_id) is None
+
+
+@pytest.fixture
+def user_with_book(db_session):
+    """Create a User with a single Book, separate from the shared one_user."""
+    user = User(email=FAKE.email(), password='password')
+    book = Book(user=user, title=FAKE.sentence(nb_words=3))
+    db_session.add(user)
+    db_session.flush()
+    return user, book
+
+
+def test_update_raises_not_found_for_book_of_other_user(dummy_request, db_session, user_with_book):
+    """Test that update only changes books owned by the given user."""
+    user, book = user_with_book
+    other = User(email=FAKE.email(), password='password')
+    db_session.add(other)
+    db_session.flush()
+
+    dummy_request.POST = {
+        'email': other.email,
+        'password': 'password',
+        'title': FAKE.sentence(nb_words=3),
+    }
+    with pytest.raises(HTTPNotFound):
+        _update_book(dummy_request, other, book.id)
+
+
+def test_delete_raises_not_found_for_missing_book(dummy_request, user_with_book):
+    """Test that delete raises HTTPNotFound when no book has the ID."""
+    user, book = user_with_book
+
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+    }
+    with pytest.raises(HTTPNotFound):
+        _delete_book(dummy_request, user, book.id + 1)
+
+
+def test_soft_delete_marks_book_as_deleted(dummy_request, db_session, user_with_book, monkeypatch):
+    """Test that delete only marks the book with soft deletes enabled."""
+    monkeypatch.setitem(dummy_request.registry.settings, 'book_api.soft_delete', 'true')
+    user, book = user_with_book
+
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+    }
+    _delete_book(dummy_request, book.user, book.id)
+    db_session.flush()
+    assert db_session.query(Book.deleted_at).filter(Book.id == book.id).scalar() is not None
+
+
+def test_soft_deleted_book_not_in_list(dummy_request, db_session, user_with_book, monkeypatch):
+    """Test that list leaves out soft deleted books."""
+    monkeypatch.setitem(dummy_request.registry.settings, 'book_api.soft_delete', 'true')
+    user, book = user_with_book
+
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+    }
+    _delete_book(dummy_request, book.user, book.id)
+    db_session.flush()
+    db_session.expire(user, ['books'])
+
+    dummy_request.GET = dummy_request.POST
+    assert _list_books(dummy_request, user) == []
+
+
+def test_restore_brings_back_soft_deleted_book(dummy_request, db_session, user_with_book, monkeypatch):
+    """Test that restore clears the deleted mark of a book."""
+    monkeypatch.setitem(dummy_request.registry.settings, 'book_api.soft_delete', 'true')
+    user, book = user_with_book
+
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+    }
+    _delete_book(dummy_request, book.user, book.id)
+    db_session.flush()
+
+    dummy_request.matchdict = {'id': str(book.id)}
+    res = book_restore_view(dummy_request)
+    assert res['id'] == book.id
+    assert book.deleted_at is None
+
+
+def test_restore_raises_error_for_book_not_deleted(dummy_request, user_with_book):
+    """Test that restore raises HTTPNotFound for a book that is not deleted."""
+    user, book = user_with_book
+
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+    }
+    dummy_request.matchdict = {'id': str(book.id)}
+    with pytest.raises(HTTPNotFound):
+        book_restore_view(dummy_request)
+
+
+def test_changes_lists_created_book_with_data(dummy_request, db_session, user_with_book):
+    """Test that changes includes a created book with its current data."""
+    user, _ = user_with_book
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+        'title': FAKE.sentence(nb_words=3),
+    }
+    book = _create_book(dummy_request, user)
+    db_session.flush()
+
+    dummy_request.GET = {
+        'email': user.email,
+        'password': 'password',
+    }
+    res = book_changes_view(dummy_request)
+    assert [change['action'] for change in res['changes']] == ['create']
+    assert res['changes'][0]['book'] == book
+    assert res['next'] == res['changes'][0]['token']
+    assert res['more'] is False
+
+
+def test_changes_collapses_to_latest_change_per_book(dummy_request, db_session, user_with_book):
+    """Test that a book updated then deleted only shows as deleted."""
+    user, book = user_with_book
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+        'author': FAKE.name(),
+    }
+    _update_book(dummy_request, book.user, book.id)
+    _delete_book(dummy_request, book.user, book.id)
+    db_session.flush()
+
+    dummy_request.GET = {
+        'email': user.email,
+        'password': 'password',
+    }
+    res = book_changes_view(dummy_request)
+    assert res['changes'] == [{
+        'token': res['next'],
+        'id': book.id,
+        'action': 'delete',
+    }]
+
+
+def test_changes_only_lists_changes_after_since_token(dummy_request, db_session, user_with_book):
+    """Test that changes leaves out changes up to the since token."""
+    user, book = user_with_book
+    dummy_request.POST = {
+        'email': user.email,
+        'password': 'password',
+        'author': FAKE.name(),
+    }
+    _update_book(dummy_request, book.user, book.id)
+    db_session.flush()
+
+    dummy_request.GET = {
+        'email': user.email,
+        'password': 'password',
+    }
+    token = book_changes_view(dummy_request)['next']
+
+    dummy_request.GET['since'] = str(token)
+    res = book_changes_view(dummy_request)
+    assert res['changes'] == []
+    assert res['next'] == token
+
+
+def test_changes_raises_error_for_bad_since_token(dummy_request, user_with_book):
+    """Test that changes raises HTTPBadRequest for a non-integer token."""
+    user, _ = user_with_book
+    dummy_request.GET = {
+        'email': user.email,
+        'password': 'password',
+        'since': 'yesterday',
+    }
+    with pytest.raises(HTTPBadRequest):
+        book_changes_view(dummy_request)
+
+
+def test_get_books_returns_found_books_and_missing_ids(dummy_request, user_with_book):
+    """Test that get books splits the ids into found books and missing ids."""
+    user, book = user_with_book
+    missing = book.id + 1
+
+    res = _get_books(dummy_request, user, '{},{},{}'.format(missing, book.id, book.id))
+    assert res['books'] == [book.to_json()]
+    assert res['missing'] == [missing]
+
+
+def test_get_books_raises_error_for_too_many_ids(dummy_request, user_with_book, monkeypatch):
+    """Test that get books raises HTTPBadRequest over the ids limit."""
+    monkeypatch.setitem(dummy_request.registry.settings, 'book_api.multi_get.max_ids', '2')
+    user, book = user_with_book
+
+    with pytest.raises(HTTPBadRequest):
+        _get_books(dummy_request, user, '1,2,3')
+
+
+def test_get_books_raises_error_for_bad_ids(dummy_request, user_with_book):
+    """Test that get books raises HTTPBadRequest for non-integer ids."""
+    user, book = user_with_book
+
+    with pytest.raises(HTTPBadRequest):
+        _get_books(dummy_request, user, '1,two')
@@ -0,0 +1,181 @@
+"""Per-request timing of the auth, database, render and commit phases."""
+
+import logging
+import time
+from contextlib import contextmanager
+
+from pyramid.events import BeforeRender
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_request
+from pyramid.tweens import EXCVIEW
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+
+class RequestTimer(object):
+    """Accumulate the time spent in each phase of a single request."""
+
+    def __init__(self):
+        """Start the clock for a new request."""
+        self.start = time.perf_counter()
+        self.end = None
+        self.render_start = None
+        self.commit_start = None
+        self.phases = {}
+        self.db_count = 0
+
+    def add(self, phase, duration):
+        """Add the given duration in seconds to a phase."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def add_query(self, duration):
+        """Record a single executed SQL statement."""
+        self.db_count += 1
+        self.add('db', duration)
+
+    def view_done(self):
+        """Close the render phase and start the commit phase."""
+        self.commit_start = time.perf_counter()
+        if self.render_start is not None:
+            self.add('render', self.commit_start - self.render_start)
+            self.render_start = None
+
+    def finish(self):
+        """Stop the clock, closing the render or commit phase if open."""
+        self.end = time.perf_counter()
+        if self.render_start is not None:
+            self.add('render', self.end - self.render_start)
+        elif self.commit_start is not None:
+            self.add('commit', self.end - self.commit_start)
+
+    @property
+    def total(self):
+        """Get the total time for the request in seconds."""
+        return (self.end or time.perf_counter()) - self.start
+
+    def server_timing(self):
+        """Render the phases as the value of a Server-Timing header."""
+        entries = []
+        for phase in ('auth', 'db', 'render', 'commit'):
+            if phase not in self.phases:
+                continue
+            entry = '{};dur={:.2f}'.format(phase, self.phases[phase] * 1000)
+            if phase == 'db':
+                entry += ';desc="{} queries"'.format(self.db_count)
+            entries.append(entry)
+        entries.append('total;dur={:.2f}'.format(self.total * 1000))
+        return ', '.join(entries)
+
+
+@contextmanager
+def timed(request, phase):
+    """Time the enclosed block as the given phase of the request.
+
+    Does nothing when timing is not enabled for the request.
+    """
+    timer = getattr(request, 'timer', None)
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, time.perf_counter() - start)
+
+
+def _current_timer():
+    """Get the timer for the request being handled on this thread."""
+    request = get_current_request()
+    return getattr(request, 'timer', None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Note when a statement starts executing."""
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Add the time a statement took to the current request."""
+    start = conn.info['query_start_time'].pop()
+    timer = _current_timer()
+    if timer is not None:
+        timer.add_query(time.perf_counter() - start)
+
+
+def _before_render(system):
+    """Mark the start of the render phase."""
+    timer = getattr(system['request'], 'timer', None)
+    if timer is not None:
+        timer.render_start = time.perf_counter()
+
+
+def view_done_tween_factory(handler, registry):
+    """Create a tween marking the end of the view and its rendering.
+
+    It sits under pyramid_tm, so the time after it is the commit.
+    """
+    def view_done_tween(request):
+        try:
+            return handler(request)
+        finally:
+            timer = getattr(request, 'timer', None)
+            if timer is not None:
+                timer.view_done()
+
+    return view_done_tween
+
+
+def timing_tween_factory(handler, registry):
+    """Create a tween that times each request and reports the phases."""
+    def timing_tween(request):
+        timer = request.timer = RequestTimer()
+        response = None
+        try:
+            response = handler(request)
+            return response
+        finally:
+            timer.finish()
+            if response is not None:
+                response.headers['Server-Timing'] = timer.server_timing()
+            route = getattr(request, 'matched_route', None)
+            log.info(
+                'route=%s method=%s status=%s total=%.2fms auth=%.2fms '
+                'db=%.2fms queries=%d render=%.2fms commit=%.2fms',
+                route.name if route else None,
+                request.method,
+                response.status_code if response is not None else 500,
+                timer.total * 1000,
+                timer.phases.get('auth', 0.0) * 1000,
+                timer.phases.get('db', 0.0) * 1000,
+                timer.db_count,
+                timer.phases.get('render', 0.0) * 1000,
+                timer.phases.get('commit', 0.0) * 1000,
+            )
+
+    return timing_tween
+
+
+def includeme(config):
+    """
+    Time requests when ``book_api.timing`` is enabled in the settings.
+
+    Nothing is registered when timing is disabled, so there is no cost to
+    requests or SQL statements in that case.
+
+    """
+    settings = config.get_settings()
+    if not asbool(settings.get('book_api.timing', False)):
+        return
+
+    engine = config.registry['db_engine']
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    config.add_subscriber(_before_render, BeforeRender)
+    config.add_tween('book_api.timing.timing_tween_factory')
+    config.add_tween(
+        'book_api.timing.view_done_tween_factory',
+        under='pyramid_tm.tm_tween_factory', over=EXCVIEW)
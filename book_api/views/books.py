@@ -1,26 +1,67 @@
 """Views for the User model."""
 
+from collections import OrderedDict
 from datetime import datetime
 
-from pyramid.httpexceptions import HTTPBadRequest, HTTPForbidden, HTTPNotFound
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPForbidden,
+    HTTPNotFound,
+    HTTPServiceUnavailable,
+)
+from pyramid.settings import asbool
 from pyramid.view import view_config
+from sqlalchemy import and_
 from sqlalchemy.exc import DBAPIError
 
-from book_api.models.book import Book
+from book_api.deadline import check_deadline
+from book_api.events import publish_after_commit, stream_events
+from book_api.metrics import PASSWORD_VERIFY_DURATION
+from book_api.models.book import Book, BookRow
+from book_api.models.book_change import BookChange
 from book_api.models.user import User
-
-
-def validate_user(dbsession, data):
+from book_api.models.queries import (
+    book_rows_for_user,
+    list_version,
+    owned_book_row,
+    user_by_email,
+)
+from book_api.retry import should_retry
+from book_api.singleflight import coalesce
+from book_api.timing import timed
+
+
+def validate_user(dbsession, data, request=None):
     """Validate that the request has correct email and password for an User.
 
+    When given the request, failed attempts are throttled by the app's
+    rate limiter before any password is checked, and the User is taken from
+    the app's user cache when it has one. A password stored with an
+    outdated hash is rehashed with the current policy.
+
     Returns the validated User object.
     """
     if not all([field in data for field in ['email', 'password']]):
         raise HTTPBadRequest
 
-    user = dbsession.query(User).filter_by(email=data['email']).first()
-
-    if not user or not user.verify(data['password']):
+    registry = request.registry if request is not None else {}
+    limiter = registry.get('ratelimiter')
+    if limiter:
+        limiter.check(data['email'], limiter.client_ip(request))
+
+    user_cache = registry.get('user_cache')
+    if user_cache is not None:
+        user = user_cache.load_user(dbsession, data['email'])
+    else:
+        user = user_by_email(dbsession, data['email'])
+    if user:
+        check_deadline(request)
+        with PASSWORD_VERIFY_DURATION.time():
+            verified = user.verify_and_update(data['password'])
+
+    if not user or not verified:
+        if limiter:
+            limiter.record_failure(data['email'], limiter.client_ip(request))
         raise HTTPForbidden('The given email and password do not match.')
 
     return user
@@ -30,7 +71,8 @@ def validate_user(dbsession, data):
 def book_list_create_view(request):
     """List the books for a user or add a new book to the list.
 
-    GET request for listing books. POST request for adding new book.
+    GET request for listing books, or only the books with the given 'ids'.
+    POST request for adding new book.
 
     Information should be formatted as follows:
         {
@@ -46,7 +88,11 @@ def book_list_create_view(request):
     The only required field is 'title'. Bad data will produce a 400 response.
     """
     data = request.GET if request.method == 'GET' else request.POST
-    user = validate_user(request.dbsession, data)
+    with timed(request, 'auth'):
+        user = validate_user(request.dbsession, data, request)
+
+    if request.method == 'GET' and 'ids' in data:
+        return _get_books(request, user, data['ids'])
 
     if request.method == 'GET':
         return _list_books(request, user)
@@ -55,6 +101,28 @@ def book_list_create_view(request):
         return _create_book(request, user)
 
 
+@view_config(route_name='book-batch', request_method='POST', renderer='json')
+def book_batch_view(request):
+    """Get many books by ID, for lists of IDs too long for a query string.
+
+    Information should be formatted as follows:
+        {
+            email: <String>,
+            password: <String>,
+
+            ids: <String of comma separated IDs>
+        }
+    'email' and 'password' are required as authentication for the user.
+    Responds the same as GET /books with 'ids'.
+    """
+    with timed(request, 'auth'):
+        user = validate_user(request.dbsession, request.POST, request)
+
+    if 'ids' not in request.POST:
+        raise HTTPBadRequest
+    return _get_books(request, user, request.POST['ids'])
+
+
 @view_config(route_name='book-id', request_method=('GET', 'PUT', 'DELETE'), renderer='json')
 def book_detail_update_delete_view(request):
     """Update or delete a book by ID.
@@ -75,22 +143,232 @@ def book_detail_update_delete_view(request):
     The only required field is 'title'. Bad data will produce a 400 response.
     """
     data = request.GET if request.method == 'GET' else request.POST
-    user = validate_user(request.dbsession, data)
+    with timed(request, 'auth'):
+        user = validate_user(request.dbsession, data, request)
 
     book_id = int(request.matchdict['id'])
-    book = request.dbsession.query(Book).filter_by(user_id=user.id, id=book_id).first()
-
-    if not book:
-        raise HTTPNotFound
 
     if request.method == 'GET':
-        return book.to_json()
+        def get_book():
+            row = owned_book_row(request.dbsession, user.id, book_id)
+            return BookRow.from_row(row).to_json() if row is not None else None
+
+        book = coalesce(request, lambda: (
+            'book', user.id, book_id, list_version(request.dbsession, user.id)
+        ), get_book)
+        if book is None:
+            raise HTTPNotFound
+        return book
 
     if request.method == 'PUT':
-        return _update_book(request, book)
+        return _update_book(request, user, book_id)
 
     if request.method == 'DELETE':
-        return _delete_book(request, book)
+        return _delete_book(request, user, book_id)
+
+
+@view_config(route_name='book-restore', request_method='POST', renderer='json')
+def book_restore_view(request):
+    """Restore a soft deleted book by ID.
+
+    Information should be formatted as follows:
+        {
+            email: <String>,
+            password: <String>,
+        }
+    'email' and 'password' are required as authentication for the user.
+    Books that are not deleted, or were already compacted away, produce a
+    404 response.
+    """
+    with timed(request, 'auth'):
+        user = validate_user(request.dbsession, request.POST, request)
+
+    book_id = int(request.matchdict['id'])
+
+    def restore(dbsession):
+        book = dbsession.query(Book).filter(
+            Book.user_id == user.id, Book.id == book_id, Book.deleted_at != None).first()
+
+        if not book:
+            raise HTTPNotFound
+
+        book.deleted_at = None
+        _record_change(request, dbsession, user.id, book.id, 'create', book)
+        return book.to_json()
+
+    return _write(request, restore)
+
+
+@view_config(route_name='book-changes', request_method='GET', renderer='json')
+def book_changes_view(request):
+    """List the changes to the books of a user since a sync token.
+
+    Information should be formatted as follows:
+        {
+            email: <String>,
+            password: <String>,
+
+            since: <Integer token from a previous response, default 0>
+        }
+    'email' and 'password' are required as authentication for the user.
+
+    Each book appears at most once, with its latest change. Created and
+    updated books include their current data, deleted books only their id.
+    At most 'book_api.changes.page_size' changes are returned at a time;
+    'more' is true when the client should ask again with the 'next' token.
+    Deletions older than the retention of compact_books are forgotten, so a
+    client that has not synced for longer should reload the whole list.
+    """
+    with timed(request, 'auth'):
+        user = validate_user(request.dbsession, request.GET, request)
+
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        raise HTTPBadRequest('The since token must be an integer.')
+
+    page_size = int(request.registry.settings.get('book_api.changes.page_size', 500))
+    changes = request.dbsession.query(BookChange).filter(
+        BookChange.user_id == user.id, BookChange.id > since
+    ).order_by(BookChange.id).limit(page_size).all()
+
+    latest = {}
+    for change in changes:
+        latest.pop(change.book_id, None)
+        latest[change.book_id] = change
+
+    live_ids = [book_id for book_id, change in latest.items() if change.action != 'delete']
+    books = {}
+    if live_ids:
+        books = {book.id: book for book in request.dbsession.query(Book).filter(
+            Book.id.in_(live_ids), Book.user_id == user.id, Book.deleted_at == None)}
+
+    results = []
+    for book_id, change in latest.items():
+        item = change.to_json()
+        if book_id in books:
+            item['book'] = books[book_id].to_json()
+        else:
+            item['action'] = 'delete'
+        results.append(item)
+
+    return {
+        'changes': results,
+        'next': changes[-1].id if changes else since,
+        'more': len(changes) == page_size,
+    }
+
+
+@view_config(route_name='book-events', request_method='GET')
+def book_events_view(request):
+    """Stream the changes to the books of a user as Server-Sent Events.
+
+    Information should be formatted as follows:
+        {
+            email: <String>,
+            password: <String>,
+        }
+    'email' and 'password' are required as authentication for the user.
+
+    Each event has the same data as an item of the change feed, and its
+    token as the event id. A 'resync' event means changes were missed and
+    the client should catch up with the change feed. Produces a 404 response
+    when 'book_api.events' is not enabled, and a 503 response when there are
+    already 'book_api.events.max_subscribers' streams open.
+    """
+    bus = request.registry.get('event_bus')
+    if bus is None:
+        raise HTTPNotFound
+
+    with timed(request, 'auth'):
+        user = validate_user(request.dbsession, request.GET, request)
+
+    if bus.full:
+        raise HTTPServiceUnavailable('Too many open event streams.')
+
+    settings = request.registry.settings
+    response = request.response
+    response.content_type = 'text/event-stream'
+    response.cache_control = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.app_iter = stream_events(
+        bus,
+        user.id,
+        heartbeat=float(settings.get('book_api.events.heartbeat', 15)),
+        max_duration=float(settings.get('book_api.events.max_duration', 300)),
+    )
+    return response
+
+
+def _owned_book(user, book_id):
+    """Get the criteria matching a book of the user that is not deleted."""
+    return (Book.id == book_id, Book.user_id == user.id, Book.deleted_at == None)
+
+
+def _supports_returning(dbsession):
+    """Check if the database can return the rows changed by a statement."""
+    return dbsession.get_bind().dialect.implicit_returning
+
+
+def _update_returning(criteria, values):
+    """Build an UPDATE of the matching books that returns their new data."""
+    return Book.__table__.update().where(and_(*criteria)).values(values).returning(
+        *BookRow.columns)
+
+
+def _write(request, fn):
+    """Run ``fn(dbsession)``, which writes to the database, and get its result.
+
+    The function runs in the request's own transaction, or on the group
+    commit writer when 'book_api.group_commit' is enabled, in which case
+    its result is returned once its write has been committed, or a 503
+    response given if that takes longer than the request has left.
+    """
+    writer = request.registry.get('group_commit')
+    if writer is None:
+        return fn(request.dbsession)
+
+    timeout = float(request.registry.settings.get('book_api.group_commit.timeout', 30))
+    deadline = getattr(request, 'deadline', None)
+    if deadline is not None:
+        deadline.check()
+        timeout = min(timeout, deadline.remaining())
+    try:
+        return writer.submit(fn, timeout)
+    except TimeoutError:
+        raise HTTPServiceUnavailable('The change is taking too long to save.')
+
+
+def _record_change(request, dbsession, user_id, book_id, action, book=None):
+    """Append a change to the given book to the change log.
+
+    On PostgreSQL the user's row is locked until the transaction commits,
+    so that the changes of a user are committed in the order of their ids.
+
+    When events are enabled, the change is also published to the user's
+    event streams once the request's transaction commits, along with the
+    data of the given Book or BookRow for created and updated books.
+    """
+    if dbsession.get_bind().dialect.name == 'postgresql':
+        # lock the user until commit, so the user's changes commit in the
+        # order of their ids and a client never gets a token past a change
+        # that is not committed yet; SQLite already serializes its writers
+        dbsession.query(User.id).filter(User.id == user_id).with_for_update().scalar()
+
+    change = BookChange(
+        user_id=user_id,
+        book_id=book_id,
+        action=action,
+        changed_at=datetime.utcnow(),
+    )
+    dbsession.add(change)
+
+    if 'event_bus' in request.registry:
+        dbsession.flush()
+        event = change.to_json()
+        if book is not None and action != 'delete':
+            event['book'] = book.to_json()
+        publish_after_commit(request, user_id, event)
 
 
 def _list_books(request, user):
@@ -102,8 +380,48 @@ def _list_books(request, user):
             password: <String>,
         }
     'email' and 'password' are required as authentication for the user.
+
+    Identical concurrent requests for an unchanged list share one query.
+    """
+    def list_books():
+        rows = book_rows_for_user(request.dbsession, user.id)
+        return [BookRow.from_row(row).to_json() for row in rows]
+
+    return coalesce(request, lambda: (
+        'list', user.id, list_version(request.dbsession, user.id)
+    ), list_books)
+
+
+def _get_books(request, user, ids):
+    """Get the books of a user with the given comma separated IDs.
+
+    All the books are read with a single query. Returns the books found, in
+    the order they were asked for, and the IDs of any that were not:
+        {
+            books: [<Book>, ...],
+            missing: [<Integer>, ...]
+        }
+    Asking for more than 'book_api.multi_get.max_ids' books, or for IDs
+    that are not integers, will produce a 400 response.
     """
-    return [book.to_json() for book in user.books]
+    try:
+        ids = [int(book_id) for book_id in ids.split(',') if book_id.strip()]
+    except ValueError:
+        raise HTTPBadRequest('The ids must be integers.')
+
+    # keep the first occurrence of each ID, in order
+    ids = list(OrderedDict.fromkeys(ids))
+    max_ids = int(request.registry.settings.get('book_api.multi_get.max_ids', 100))
+    if not ids or len(ids) > max_ids:
+        raise HTTPBadRequest('Between 1 and {} ids can be given.'.format(max_ids))
+
+    rows = request.dbsession.query(*BookRow.columns).filter(
+        Book.id.in_(ids), Book.user_id == user.id, Book.deleted_at == None)
+    books = {book.id: book for book in map(BookRow.from_row, rows)}
+    return {
+        'books': [books[book_id].to_json() for book_id in ids if book_id in books],
+        'missing': [book_id for book_id in ids if book_id not in books],
+    }
 
 
 def _create_book(request, user):
@@ -131,24 +449,34 @@ def _create_book(request, user):
         except ValueError:
             raise HTTPBadRequest
 
-    book = Book(
-        user=user,
-        title=request.POST['title'],
-        author=request.POST['author'] if 'author' in request.POST else None,
-        isbn=request.POST['isbn'] if 'isbn' in request.POST else None,
-        pub_date=pub_date if 'pub_date' in request.POST else None,
-    )
-    request.dbsession.add(book)
-    try:
-        request.dbsession.flush()
-    except DBAPIError:
-        raise HTTPBadRequest
+    def create(dbsession):
+        # the User can only be attached to the request's own session
+        owner = {'user': user} if dbsession is request.dbsession else {'user_id': user.id}
+        book = Book(
+            title=request.POST['title'],
+            author=request.POST['author'] if 'author' in request.POST else None,
+            isbn=request.POST['isbn'] if 'isbn' in request.POST else None,
+            pub_date=pub_date if 'pub_date' in request.POST else None,
+            **owner
+        )
+        dbsession.add(book)
+        try:
+            dbsession.flush()
+        except DBAPIError as error:
+            if should_retry(request, error):
+                raise
+            check_deadline(request)
+            raise HTTPBadRequest
+        _record_change(request, dbsession, user.id, book.id, 'create', book)
+        return book.to_json()
+
+    result = _write(request, create)
     request.response.status = 201
-    return book.to_json()
+    return result
 
 
-def _update_book(request, book):
-    """Update the given book with data from the request.
+def _update_book(request, user, book_id):
+    """Update the user's book with the given ID with data from the request.
 
     Information should be formatted as follows:
         {
@@ -161,7 +489,11 @@ def _update_book(request, book):
             pub_date: <String of mm/dd/yyyy>
         }
     'email' and 'password' are required as authentication for the user.
-    Bad data will produce a 400 response.
+    Bad data will produce a 400 response, and a missing book a 404 response.
+
+    The book is changed with a single UPDATE scoped to the user, which also
+    returns the new data on databases supporting RETURNING. Elsewhere the
+    book is read back after it is updated.
     """
     if 'pub_date' in request.POST:
         try:
@@ -169,19 +501,38 @@ def _update_book(request, book):
         except ValueError:
             raise HTTPBadRequest
 
-    for prop in ['title', 'author', 'isbn', 'pub_date']:
-        if prop in request.POST:
-            setattr(book, prop, request.POST[prop])
-    request.dbsession.add(book)
-    try:
-        request.dbsession.flush()
-    except DBAPIError:
-        raise HTTPBadRequest
-    return book.to_json()
+    values = {prop: request.POST[prop] for prop in ['title', 'author', 'isbn', 'pub_date']
+              if prop in request.POST}
+    criteria = _owned_book(user, book_id)
+
+    def update(dbsession):
+        try:
+            if values and _supports_returning(dbsession):
+                row = dbsession.execute(_update_returning(criteria, values)).first()
+            else:
+                if values and not dbsession.query(Book).filter(*criteria).update(
+                        values, synchronize_session='evaluate'):
+                    raise HTTPNotFound
+                row = owned_book_row(dbsession, user.id, book_id)
+        except DBAPIError as error:
+            if should_retry(request, error):
+                raise
+            check_deadline(request)
+            raise HTTPBadRequest
+
+        if row is None:
+            raise HTTPNotFound
+
+        book = BookRow.from_row(row)
+        if values:
+            _record_change(request, dbsession, user.id, book_id, 'update', book)
+        return book.to_json()
+
+    return _write(request, update)
 
 
-def _delete_book(request, book):
-    """Delete the given book.
+def _delete_book(request, user, book_id):
+    """Delete the user's book with the given ID.
 
     Information should be formatted as follows:
         {
@@ -189,8 +540,27 @@ def _delete_book(request, book):
             password: <String>,
         }
     'email' and 'password' are required as authentication for the user.
-    Bad data will produce a 400 response.
+    A missing book will produce a 404 response.
+
+    The book is removed with a single DELETE scoped to the user. With the
+    'book_api.soft_delete' setting it is only marked as deleted instead, to
+    be restored or removed later by the compact_books script.
     """
-    request.dbsession.delete(book)
+    soft_delete = asbool(request.registry.settings.get('book_api.soft_delete', False))
+
+    def delete(dbsession):
+        books = dbsession.query(Book).filter(*_owned_book(user, book_id))
+        if soft_delete:
+            deleted = books.update(
+                {'deleted_at': datetime.utcnow()}, synchronize_session='evaluate')
+        else:
+            deleted = books.delete(synchronize_session='evaluate')
+
+        if not deleted:
+            raise HTTPNotFound
+
+        _record_change(request, dbsession, user.id, book_id, 'delete')
+
+    _write(request, delete)
     request.response.status = 204
     request.response.content_type = None
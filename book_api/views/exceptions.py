@@ -1,6 +1,11 @@
 """JSON responses for various HTTP exceptions."""
 
-from pyramid.httpexceptions import HTTPBadRequest, HTTPForbidden
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPForbidden,
+    HTTPServiceUnavailable,
+    HTTPTooManyRequests,
+)
 from pyramid.view import notfound_view_config, exception_view_config
 
 
@@ -23,3 +28,20 @@ def forbidden_view(message, request):
     """Get JSON response for a 403 status code."""
     request.response.status = 403
     return {'message': str(message), 'status': 403}
+
+
+@exception_view_config(HTTPTooManyRequests, renderer='json')
+def too_many_requests_view(message, request):
+    """Get JSON response for a 429 status code."""
+    request.response.status = 429
+    request.response.headers['Retry-After'] = message.headers['Retry-After']
+    return {'message': str(message), 'status': 429}
+
+
+@exception_view_config(HTTPServiceUnavailable, renderer='json')
+def service_unavailable_view(message, request):
+    """Get JSON response for a 503 status code."""
+    request.response.status = 503
+    if 'Retry-After' in message.headers:
+        request.response.headers['Retry-After'] = message.headers['Retry-After']
+    return {'message': str(message), 'status': 503}
@@ -4,7 +4,9 @@ from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.view import view_config
 from sqlalchemy.exc import DBAPIError
 
+from book_api.deadline import check_deadline
 from book_api.models.user import User
+from book_api.retry import should_retry
 
 
 @view_config(route_name='signup', request_method='POST', renderer='json')
@@ -25,6 +27,7 @@ def signup_view(request):
     """
     if not all([field in request.POST for field in ['email', 'password']]):
         raise HTTPBadRequest
+    check_deadline(request)
     user = User(
         first_name=request.POST['first_name'] if 'first_name' in request.POST else None,
         last_name=request.POST['last_name'] if 'last_name' in request.POST else None,
@@ -34,7 +37,10 @@ def signup_view(request):
     request.dbsession.add(user)
     try:
         request.dbsession.flush()
-    except DBAPIError:
+    except DBAPIError as error:
+        if should_retry(request, error):
+            raise
+        check_deadline(request)
         raise HTTPBadRequest('A User with that email already exits.')
     request.response.status = 201
     return user.to_json()
@@ -49,6 +49,9 @@ setup(
     zip_safe=False,
     extras_require={
         'testing': tests_require,
+        'brotli': ['brotli'],
+        'cbor': ['cbor2'],
+        'msgpack': ['msgpack'],
     },
     install_requires=requires,
     entry_points={
@@ -57,6 +60,12 @@ setup(
         ],
         'console_scripts': [
             'initializedb = book_api.scripts.initializedb:main',
+            'book_rows_bench = book_api.scripts.book_rows_bench:main',
+            'calibrate_hash = book_api.scripts.calibrate_hash:main',
+            'compact_books = book_api.scripts.compact_books:main',
+            'prefork_serve = book_api.scripts.prefork:main',
+            'query_bench = book_api.scripts.query_bench:main',
+            'startup_bench = book_api.scripts.startup_bench:main',
         ],
     },
 )